@@ -1,9 +1,13 @@
-from setuptools import setup
+from setuptools import find_packages, setup
 
 setup(
     name='src',
+    packages=find_packages(),
     version='0.1.0',
     description='Analysis & Predictive Exploration of Disney World Magic Kingdom Ride Wait Times for 2015-2021',
     author='Kendall Dyke',
     license='',
+    entry_points={
+        'console_scripts': ['wait-times=src.cli:main'],
+    },
 )
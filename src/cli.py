@@ -0,0 +1,94 @@
+"""
+    wait-times command line interface
+
+    Single entry point for every stage of the project:
+
+        wait-times clean data/interim data/processed
+        wait-times features data/processed data/final
+        wait-times select data/final models/features.json --cumulative 0.99
+        wait-times matrix data/final data/final/matrix
+        wait-times train data/final models/pipeline.pkl
+        wait-times predict models/pipeline.pkl.gz
+        wait-times compact models/pipeline.pkl.gz models/pipeline_compact.pkl
+        wait-times update models/store --X data/new/X.csv --y data/new/y.csv --max-trees 10
+        wait-times backtest data/final reports/backtest_metrics.csv
+        wait-times drift models/train_sketches.json models/scoring_sketches.json
+
+    The arguments of every stage are defined once in data_arguments.py / model_arguments.py, shared with
+    the __main__ block of the stage module. Only argparse & those light modules are imported at startup -
+    each stage module (and with it pandas, sklearn, scipy...) is imported when its subcommand runs, so
+    `wait-times <command> --help` returns immediately.
+"""
+import argparse
+import importlib
+import os
+import sys
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the stage modules import their neighbours by module name (they are also run as scripts)
+STAGE_DIRS = [os.path.join(SRC_DIR, "data"), os.path.join(SRC_DIR, "models")]
+
+
+def load_stage(module_name):
+    """
+        Import a stage module (e.g. "pipeline_train") or an arguments module on first use
+    """
+    for stage_dir in STAGE_DIRS:
+        if stage_dir not in sys.path:
+            sys.path.insert(0, stage_dir)
+
+    return importlib.import_module(module_name)
+
+
+# subcommand -> stage module, its arguments (light modules without pandas & sklearn) & one line summary
+STAGES = {
+    "clean": ("data_cleaning", "data_arguments", "Clean & encode the interim data (data_cleaning.py)"),
+    "features": ("feature_engineering", "model_arguments", "Build the final pipeline data (feature_engineering.py)"),
+    "select": ("feature_selection", "model_arguments", "Importance-driven feature selection (feature_selection.py)"),
+    "matrix": ("training_matrix", "model_arguments", "Build the memory-mapped training matrix (training_matrix.py)"),
+    "train": ("pipeline_train", "model_arguments", "Train the pipeline (pipeline_train.py)"),
+    "predict": ("pipeline_predict", "model_arguments", "Score the test data (pipeline_predict.py)"),
+    "update": ("incremental", "model_arguments",
+               "Warm start the model on new data as a new version (incremental.py)"),
+    "compact": ("compact_model", "model_arguments", "Prune & compact a trained pipeline (compact_model.py)"),
+    "backtest": ("backtest", "model_arguments", "Rolling-origin backtest (backtest.py)"),
+    "drift": ("drift", "model_arguments", "Compare feature sketches against the training baseline (drift.py)"),
+}
+
+
+def run_stage(module_name):
+    def run(args):
+        load_stage(module_name).main(args)
+
+    return run
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="wait-times",
+                                     description="Magic Kingdom ride wait time data & model pipeline")
+    parser.add_argument('--project-dir', default=os.getcwd(),
+                        help="Project root that the data/, models/ & reports/ paths are relative to "
+                             "(default: current directory)")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+
+    for name, (module_name, arguments_module, summary) in STAGES.items():
+        stage = subparsers.add_parser(name, help=summary)
+        # same definitions as the __main__ block of the stage module
+        getattr(load_stage(arguments_module), f"{module_name}_arguments")(stage)
+        stage.set_defaults(func=run_stage(module_name))
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    # every stage reads & writes paths relative to the project root
+    os.chdir(args.project_dir)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""
+    Command line arguments of the data stages (see src/models/model_arguments.py)
+"""
+from helper import park_rides
+from partition_writer import CODECS
+
+
+def data_cleaning_arguments(parser):
+    """
+        Command line arguments of data_cleaning.py
+    """
+    parser.add_argument('input', help="Interim Data Directory")
+    parser.add_argument('output', help="Processed Data Directory")
+    parser.add_argument('--star', action='store_true',
+                        help="Keep park-day & ride metadata in dimension tables in the interim data")
+    parser.add_argument('--codec', choices=list(CODECS), default="gzip",
+                        help="Compression of the per-year posted wait time files")
+    parser.add_argument('--parks', nargs='+', choices=list(park_rides),
+                        help="Process these parks in parallel, each into its own sub directory")
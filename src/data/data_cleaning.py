@@ -1,11 +1,21 @@
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import pandas as pd
 import numpy as np
-from helper import *
+from helper import (ride_files, ride_names, park_rides, categoricalCols, parse_dates, parse_times,
+                    park_metadata_cols)
 from weather_data import weatherData
+from date_features import rideAgeDays
+from materialize import materialize
+from partition_writer import writePartitions
+from prefetch import prefetch
 from sklearn.feature_selection import VarianceThreshold
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.model_selection import train_test_split
+from data_arguments import data_cleaning_arguments as add_arguments
 
 
 def stringPercentToInt(df):
@@ -116,7 +126,7 @@ def dateCleaning(df):
     df['datetime'] = pd.to_datetime(df["datetime"])
     df['date'] = pd.to_datetime(df["date"])
 
-    df["Age_of_ride_days"] = (df["date"] - df["Open_date"]).dt.days.astype('int16')
+    df["Age_of_ride_days"] = rideAgeDays(df["date"], df["Open_date"])
     df["Age_of_ride_years"] = df["Age_of_ride_days"] / 365
 
     df.drop("Age_of_ride_total", axis=1, inplace=True)
@@ -124,7 +134,63 @@ def dateCleaning(df):
     return df
 
 
-def combineCovidData(rideData):
+def loadDataWorld(park="MK"):
+    """
+        Ride metadata from data.world for one park with Yes/No columns converted to boolean
+
+        Materialized once from the (slow to parse) Excel file & reused until the file changes
+
+        Parameters
+        ----------
+        park : string
+            data.world Park_location code
+
+        Returns
+        -------
+        DataFrame
+            data.world rows of the park
+    """
+    def build():
+        data_world = pd.read_excel("data/raw/WDW_Ride_Data_DW.xlsx")
+        park_dw = data_world[data_world["Park_location"] == park].reset_index(drop=True)
+        yesNoToBool(park_dw)  # convert Yes/No columns to boolean
+        return park_dw
+
+    return materialize(f"data_world_{park}", ["data/raw/WDW_Ride_Data_DW.xlsx"], build)
+
+
+def loadParkMetadata():
+    """
+        Daily park metadata with parsed dates & inSession percentages converted to int8
+
+        Materialized once from park_metadata.csv & reused until the file changes
+    """
+    def build():
+        park_metadata = stringPercentToInt(pd.read_csv("data/raw/park_metadata.csv"))
+        park_metadata['DATE'] = pd.to_datetime(park_metadata["DATE"])
+        return park_metadata
+
+    return materialize("park_metadata", ["data/raw/park_metadata.csv"], build)
+
+
+def loadNationalCovidCases():
+    """
+        Daily number of new US covid cases (sum over all states)
+
+        Materialized once from the state level covid csv & reused until the file changes
+    """
+    covid_file = "data/raw/United_States_COVID-19_Cases_and_Deaths_by_State_over_Time.csv"
+
+    def build():
+        covidData = pd.read_csv(covid_file, usecols=["DATE", "new_case"])
+        covidData = covidData.groupby("DATE")["new_case"].sum().reset_index()
+        covidData["DATE"] = pd.to_datetime(covidData["DATE"])
+        return covidData
+
+    return materialize("national_covid_cases", [covid_file], build)
+
+
+def combineCovidData(rideData, how='left'):
     """
         Extract & combine covid-data (number of daily US new cases) into existing park metadata by day
 
@@ -133,17 +199,17 @@ def combineCovidData(rideData):
         rideData : DataFrame
             dataframe with wait times & metadata
 
+        how : string
+            merge type - 'outer' keeps the days that only have covid data
+
         Returns
         -------
         rides_with_covid: Dataframe
             updated dataframe with appended covid metrics
 
     """
-    covidData = pd.read_csv("data/raw/United_States_COVID-19_Cases_and_Deaths_by_State_over_Time.csv")
-
-    covidData = covidData.groupby("DATE")["new_case"].sum().reset_index()
-    covidData["DATE"] = pd.to_datetime(covidData["DATE"])
-    rides_with_covid = rideData.merge(covidData, on="DATE", how='left')
+    covidData = loadNationalCovidCases()
+    rides_with_covid = rideData.merge(covidData, on="DATE", how=how)
     rides_with_covid["new_case"] = rides_with_covid["new_case"].fillna(0)
 
     del covidData
@@ -151,7 +217,181 @@ def combineCovidData(rideData):
     return rides_with_covid
 
 
-def combineMetadataAndUpdate(ride_files, ride_names):
+def dateId(dates):
+    """
+        Integer surrogate key for dates (days since 1970-01-01) used to key the park-day dimension table
+
+        Parameters
+        ----------
+        dates : Series
+            datetime Series
+
+        Returns
+        -------
+        ndarray
+            int32 date ids
+    """
+    return pd.to_datetime(dates).to_numpy().astype("datetime64[D]").astype("int32")
+
+
+def buildDimensionTables(ride_names, data_world_df, park_metadata):
+    """
+        Build the day-level and ride-level dimension tables of the star schema
+
+        Parameters
+        ----------
+        ride_names : list
+            list of Ride names - RIDE_ID is the position of the ride in this list
+
+        data_world_df : DataFrame
+            dataframe of ride metadata from data.world (Yes/No columns already converted)
+
+        park_metadata : DataFrame
+            daily park metadata (inSession columns already converted)
+
+        Returns
+        -------
+        park_day_dim : DataFrame
+            park metadata & covid counts, one row per day indexed by DATE_ID
+
+        ride_dim : DataFrame
+            data.world ride metadata, one row per ride indexed by RIDE_ID
+
+    """
+    ride_dim = pd.DataFrame({"Ride_name": ride_names}).merge(data_world_df, how="left")
+    ride_dim = ride_dim.drop(columns=["Park_location", "Ride_type_all", "Age_interest_all"])
+    ride_dim.index = pd.Index(np.arange(len(ride_dim), dtype="int16"), name="RIDE_ID")
+
+    park_day_dim = combineCovidData(park_metadata, how='outer')
+    park_day_dim.index = pd.Index(dateId(park_day_dim["DATE"]), name="DATE_ID")
+    park_day_dim = park_day_dim.drop(columns=["DATE", "WDWTICKETSEASON"])
+
+    return park_day_dim, ride_dim
+
+
+def gatherDimension(dim, keys, columns=None):
+    """
+        Gather dimension rows for every fact row by integer key (a positional take, no hash join)
+
+        Parameters
+        ----------
+        dim : DataFrame
+            dimension table indexed by its integer key
+
+        keys : array-like
+            integer key of every fact row
+
+        columns : list
+            dimension columns to gather (default: all)
+
+        Returns
+        -------
+        DataFrame
+            one dimension row per key (all NaN where the key is not in the dimension), RangeIndex
+    """
+    if columns is not None:
+        dim = dim[[col for col in dim.columns if col in columns]]
+
+    positions = dim.index.get_indexer(np.asarray(keys))
+    if (positions < 0).any():
+        gathered = dim.reindex(np.asarray(keys))
+    else:
+        gathered = dim.take(positions)
+
+    return gathered.reset_index(drop=True)
+
+
+def combineMetadataStar(ride_files, ride_names, park="MK"):
+    """
+        Combine the wait time observations into a narrow fact table with the day & ride
+        metadata kept as separate dimension tables instead of repeating it on every row
+
+        Parameters
+        ----------
+        ride_files : list
+            list of csv files with wait times to parse
+
+        ride_names : list
+            list of Ride names - must match order of ride_files & data.world ride name
+
+        park : string
+            park of the rides (key of helper.park_rides)
+
+        Returns
+        -------
+        fact : DataFrame
+            wait time observations with DATE_ID and RIDE_ID keys
+
+        park_day_dim, ride_dim : DataFrame
+            dimension tables (see buildDimensionTables)
+
+    """
+    park_metadata = loadParkMetadata()
+    park_dw = loadDataWorld(park_rides[park]["data_world"])
+
+    park_day_dim, ride_dim = buildDimensionTables(ride_names, park_dw, park_metadata)
+    del park_dw, park_metadata
+
+    all_waits = []
+    for idx, ride in enumerate(ride_files):
+        ride_waits = pd.read_csv(ride)
+        ride_waits["RIDE_ID"] = np.int16(idx)
+        all_waits.append(ride_waits)
+
+    fact = pd.concat(all_waits, ignore_index=True)
+    del all_waits
+
+    fact['datetime'] = pd.to_datetime(fact["datetime"])
+    fact['date'] = pd.to_datetime(fact["date"])
+    fact["DATE_ID"] = dateId(fact["date"])
+    print("FACT SHAPE: ", fact.shape)
+
+    return fact, park_day_dim, ride_dim
+
+
+def joinDimensions(fact, park_day_dim, ride_dim, columns=None):
+    """
+        Widen the fact table with its dimension columns, only when building the model matrix
+
+        Parameters
+        ----------
+        fact : DataFrame
+            wait time observations with DATE_ID and RIDE_ID keys
+
+        park_day_dim, ride_dim : DataFrame
+            dimension tables (see buildDimensionTables)
+
+        columns : list
+            dimension columns to join (default: all)
+
+        Returns
+        -------
+        combined_data : DataFrame
+            fact columns followed by the ride & park-day metadata of every row
+
+    """
+    if columns is not None:
+        # the ride age is derived from Open_date
+        columns = list(columns) + ["Open_date", "Age_of_ride_total"]
+
+    rides = gatherDimension(ride_dim, fact["RIDE_ID"], columns)
+    days = gatherDimension(park_day_dim, fact["DATE_ID"], columns)
+
+    combined_data = pd.concat([fact.drop(columns=["RIDE_ID", "DATE_ID"]).reset_index(drop=True),
+                               rides, days], axis=1)
+    del rides, days
+
+    if "new_case" in combined_data.columns:
+        # days missing from the dimension had no reported cases
+        combined_data["new_case"] = combined_data["new_case"].fillna(0)
+
+    if "Open_date" in combined_data.columns:
+        dateCleaning(combined_data)  # age of ride on the date of each observation
+
+    return combined_data
+
+
+def combineMetadataAndUpdate(ride_files, ride_names, park="MK"):
     """
         Combine all metadata together with respective dates & rides
 
@@ -163,41 +403,48 @@ def combineMetadataAndUpdate(ride_files, ride_names):
         ride_names : list
             list of Ride names - must match order of ride_files & data.world ride name (input to cleanData())
 
+        park : string
+            park of the rides (key of helper.park_rides)
+
         Returns
         -------
         combined_data : DataFrame
             Returns updated dataframe with all rides merged with their respective daily park & ride metadata
 
     """
-    park_metadata = pd.read_csv("data/raw/park_metadata.csv")
-    data_world = pd.read_excel("data/raw/WDW_Ride_Data_DW.xlsx")
-    mk_dw = data_world[data_world["Park_location"] == "MK"]
-    del data_world
+    combined_data = joinDimensions(*combineMetadataStar(ride_files, ride_names, park))
 
-    park_metadata = stringPercentToInt(park_metadata)
-    yesNoToBool(mk_dw)  # convert Yes/No columns to boolean
+    print("COMBINED DATA SHAPE: ", combined_data.shape)
 
-    all_rides = combineRidesAndName(ride_files,
-                                    ride_names, mk_dw)  # combine wait time data with data.world metadata
+    return combined_data
 
-    del mk_dw
-    dateCleaning(all_rides)  # clean date columns
 
+def writeDimensionTables(output_dir, park_day_dim, ride_dim):
+    """
+        Write the dimension tables next to the interim fact files
+    """
+    park_day_dim.to_csv(f"{output_dir}/park_day_dim.csv", compression='gzip')
+    ride_dim.to_csv(f"{output_dir}/ride_dim.csv", compression='gzip')
 
-    all_rides['DATE'] = all_rides['date']
-    park_metadata['DATE'] = pd.to_datetime(park_metadata["DATE"])
-    print("ALL RIDES SHAPE: ", all_rides.shape)
 
-    combined_data = all_rides.merge(park_metadata, how="left", on="DATE")
-    combined_data = combineCovidData(combined_data)
-    combined_data = combined_data.drop(columns=['DATE', "WDWTICKETSEASON", "Park_location",
-                                                "Ride_type_all", "Age_interest_all"])
+def readDimensionTables(input_dir):
+    """
+        Read the dimension tables written by writeDimensionTables
 
-    print("COMBINED DATA SHAPE: ", combined_data.shape)
+        Returns
+        -------
+        park_day_dim, ride_dim : DataFrame
+            dimension tables, or None if input_dir holds wide (non star-schema) data
+    """
+    if not os.path.exists(f"{input_dir}/park_day_dim.csv"):
+        return None
 
-    del all_rides, park_metadata
+    park_day_dim = pd.read_csv(f"{input_dir}/park_day_dim.csv", dtype=dtypes, index_col="DATE_ID",
+                               compression='gzip')
+    ride_dim = pd.read_csv(f"{input_dir}/ride_dim.csv", dtype=dtypes, index_col="RIDE_ID",
+                           parse_dates=["Open_date"], compression='gzip')
 
-    return combined_data
+    return park_day_dim, ride_dim
 
 
 def cleanStringData(df, cols):
@@ -344,7 +591,7 @@ def setVarianceThreshold(X_train, X_test, threshold, data_type):
     return X_train, X_test
 
 
-def trainTestSplit(input_dir, year):
+def trainTestSplit(input_dir, year, dimensions=None):
     """
             Reads in 1 year of clean data, splits into train/test for actual/posted wait times, respectively
 
@@ -352,6 +599,8 @@ def trainTestSplit(input_dir, year):
             ----------
             year : int
                 year to parse
+            dimensions : tuple
+                (park_day_dim, ride_dim) to join onto star-schema interim data (see readDimensionTables)
 
             Returns
             -------
@@ -360,6 +609,8 @@ def trainTestSplit(input_dir, year):
     """
 
     rideData = pd.read_csv(f'{input_dir}/RideData{year}Weather.csv', compression='gzip', dtype=dtypes, parse_dates=parse_dates)
+    if dimensions is not None:
+        rideData = joinDimensions(rideData, *dimensions).drop(columns=["Open_date"])
     rideData = rideData.dropna(subset=park_metadata_cols, how='all', axis=0)
 
     rideDataActual = rideData[~np.isnan(rideData["SACTMIN"])]
@@ -400,13 +651,16 @@ def encodeTrainAndTest(input_dir, posted=True):
            Cleaned, encoded, & combined dataframes for train/test features & targets
     """
     allYearsTrain_X, allYearsTrain_y, allYearsTest_X, allYearsTest_y = [], [], [], []
+    dimensions = readDimensionTables(input_dir)
 
-    for year in range(2015, 2022):
+    # the next years are read & split in background threads while the current one is collected
+    splits = prefetch(partial(trainTestSplit, input_dir, dimensions=dimensions), range(2015, 2022))
+    for year, yearSplits in zip(range(2015, 2022), splits):
         print(f"YEAR {year}")
         if posted:
-            data = trainTestSplit(input_dir, year)[1]
+            data = yearSplits[1]
         else:
-            data = trainTestSplit(input_dir, year)[0]
+            data = yearSplits[0]
 
         allYearsTrain_X.append(data[0])
         allYearsTest_X.append(data[1])
@@ -449,57 +703,153 @@ def encodeTrainAndTest(input_dir, posted=True):
     return X_train, X_test, y_train, y_test
 
 
-if __name__ == '__main__':
-    import argparse
+def checkRideFiles(parks):
+    """
+        Fail before any park is processed if the wait time files of a park have not been downloaded
 
-    # parse input and output args
-    parser = argparse.ArgumentParser()
-    parser.add_argument('input', help="Interim Data Directory")
-    parser.add_argument('output', help="Processed Data Directory")
-    args = parser.parse_args()
+        Only a few of the Magic Kingdom files ship with the repo - the other parks' files (helper.park_rides)
+        have to be downloaded into data/raw first.
 
-    # open dtypes to specify when loading CSVs
-    with open(f"{args.input}/dtypes.json") as json_file:
-        dtypes = json.load(json_file)
+        Parameters
+        ----------
+        parks : list
+            parks to process (keys of helper.park_rides)
+
+        Raises
+        ------
+        FileNotFoundError
+            naming every missing wait time file of the parks
+    """
+    missing = {park: [file for file in park_rides[park]["ride_files"] if not os.path.exists(file)] for park in parks}
+    missing = {park: files for park, files in missing.items() if files}
+    if missing:
+        raise FileNotFoundError("Missing wait time files (download them into data/raw): " +
+                                "; ".join(f"{park}: {', '.join(files)}" for park, files in missing.items()))
+
+
+def processPark(park, interim_dir, output_dir, star=False, codec="gzip", park_dtypes=None):
+    """
+        Run the whole cleaning stage for the rides of one park
+
+        Parameters
+        ----------
+        park : string
+            park to process (key of helper.park_rides)
+
+        interim_dir : string
+            directory for the park's interim (weather merged) files
+
+        output_dir : string
+            directory for the park's processed train/test files
+
+        star : bool
+            keep park-day & ride metadata in dimension tables in the interim data
+
+        codec : string
+            compression of the per-year posted wait time files (see partition_writer.CODECS)
+
+        park_dtypes : dictionary
+            dtypes to load the interim CSVs with (set in worker processes)
+
+    """
+    global dtypes
+    if park_dtypes is not None:
+        dtypes = park_dtypes
+
+    os.makedirs(interim_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    rides = park_rides[park]
+
+    if star:
+        # narrow fact rows + dimension tables, joined back when building the model matrix
+        combined_data, park_day_dim, ride_dim = combineMetadataStar(rides["ride_files"], rides["ride_names"], park)
+        writeDimensionTables(interim_dir, park_day_dim, ride_dim)
+        del park_day_dim, ride_dim
+    else:
+        combined_data = combineMetadataAndUpdate(rides["ride_files"], rides["ride_names"], park)
 
-    combined_data = combineMetadataAndUpdate(ride_files, ride_names)
     for year in range(2015, 2022):
-        weatherData(combined_data, year)
+        weatherData(combined_data, year, interim_dir)
 
     del combined_data, year
 
     for postedActual in ["posted", "actual"]:
         if postedActual == "posted":
-            print("posted")
-            X_train, X_test, y_train, y_test = encodeTrainAndTest(args.input, posted=True)
+            print(f"{park} posted")
+            X_train, X_test, y_train, y_test = encodeTrainAndTest(interim_dir, posted=True)
             # combing x and y together so that we keep the features and targets together
             # when splitting into smaller files
             X_train["POSTED_WAIT"] = y_train
             X_test["POSTED_WAIT"] = y_test
 
-            for year in range(2015, 2022):
-                print(f"WRITING {year}")
-                # write to year based files so that the data will fit on GitHub
-                X_train[X_train["date"].dt.year == year].to_csv(
-                    f"{args.output}/All_train_postedtimes{year}.csv",
-                    index=False, compression='gzip')
-
-                X_test[X_test["date"].dt.year == year].to_csv(
-                    f"{args.output}/All_test_postedtimes{year}.csv",
-                    index=False, compression='gzip')
+            # write to year based files so that the data will fit on GitHub
+            for split, X in [("train", X_train), ("test", X_test)]:
+                print(f"WRITING {park} {split}")
+                writePartitions(X, X["date"].dt.year, f"{output_dir}/All_{split}_postedtimes{{key}}",
+                                partitions=range(2015, 2022), codec=codec, index=False)
 
             del X_train, y_train, X_test, y_test
         else:
-            X_train, X_test, y_train, y_test = encodeTrainAndTest(args.input, posted=False)
+            X_train, X_test, y_train, y_test = encodeTrainAndTest(interim_dir, posted=False)
 
-            X_train.to_csv(f"{args.output}/Xtrain_actualtimes.csv", compression='gzip')
+            X_train.to_csv(f"{output_dir}/Xtrain_actualtimes.csv", compression='gzip')
             del X_train
 
-            X_test.to_csv(f"{args.output}/Xtest_actualtimes.csv", compression='gzip')
+            X_test.to_csv(f"{output_dir}/Xtest_actualtimes.csv", compression='gzip')
             del X_test
 
-            y_train.to_csv(f"{args.output}/ytrain_actualtimes.csv", compression='gzip')
+            y_train.to_csv(f"{output_dir}/ytrain_actualtimes.csv", compression='gzip')
             del y_train
 
-            y_test.to_csv(f"{args.output}/ytest_actualtimes.csv", compression='gzip')
+            y_test.to_csv(f"{output_dir}/ytest_actualtimes.csv", compression='gzip')
             del y_test
+
+    return park
+
+
+def main(args):
+    """
+        Clean & encode the interim ride data into the processed train/test files
+
+        Without --parks only Magic Kingdom is processed, straight into the input/output directories.
+        With --parks every park is processed as an independent shard in its own process, with its files
+        laid out in a per-park sub directory (e.g. data/processed/EP).
+
+        Parameters
+        ----------
+        args: Namespace
+            Parsed command line arguments (see the __main__ block below or src/cli.py)
+    """
+    global dtypes
+
+    checkRideFiles(args.parks or ["MK"])
+
+    # open dtypes to specify when loading CSVs
+    with open(f"{args.input}/dtypes.json") as json_file:
+        dtypes = json.load(json_file)
+
+    if not args.parks:
+        processPark("MK", args.input, args.output, star=args.star, codec=args.codec)
+        return
+
+    # tables every park joins are materialized once here instead of by every park process at once
+    loadParkMetadata()
+    loadNationalCovidCases()
+
+    with ProcessPoolExecutor(max_workers=len(args.parks)) as executor:
+        shards = [executor.submit(processPark, park, f"{args.input}/{park}", f"{args.output}/{park}",
+                                  args.star, args.codec, dtypes)
+                  for park in args.parks]
+        for shard in shards:
+            print(f"FINISHED {shard.result()}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # parse input and output args
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,199 @@
+import copy
+import json
+import os
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from prefetch import prefetch
+
+RIDE_PREFIX = "Ride_name_"
+
+
+def normalizeRideName(ride):
+    """
+        Ride name as it appears in the processed data - lowercased & stripped like every categorical
+        column by data_cleaning.cleanStringData
+    """
+    return ride.lower().strip()
+
+
+def partitionFile(path_stem):
+    """
+        Path & compression of a per-year file written by data_cleaning.py (with any --codec)
+    """
+    path = path_stem + ".csv"
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No partition found for {path_stem}")
+
+    # gzip magic number - plain text files (--codec csv) have the same name
+    with open(path, "rb") as partition:
+        compression = "gzip" if partition.read(2) == b"\x1f\x8b" else None
+
+    return path, compression
+
+
+class WaitTimeDataset:
+    """
+        Lazy view of the per-year posted wait time files (All_{split}_postedtimes{year})
+
+        select() & filter() only record what is wanted and return a new dataset; collect() then reads
+        just that: files of other splits/years are never opened, only the selected columns (plus the
+        ones the filters need) are parsed, and ride/date filters are applied chunk by chunk while
+        reading so only the matching rows are ever held in memory.
+
+        How to use:
+
+            data = WaitTimeDataset("data/processed")
+            peoplemover = data.filter(ride="Tomorrowland Transit Authority PeopleMover", years=[2019]) \
+                              .select(["datetime", "POSTED_WAIT"]) \
+                              .collect()
+
+        Parameters
+        ----------
+        input_dir : string
+            Directory of the per-year files (data/processed)
+
+        dtypes : dictionary
+            dtypes of the columns (default: {input_dir}/dtypes_parsed.json)
+
+        chunksize : int
+            Rows parsed at a time when rows are filtered
+
+    """
+
+    def __init__(self, input_dir="data/processed", dtypes=None, chunksize=500000):
+        if dtypes is None:
+            with open(f"{input_dir}/dtypes_parsed.json") as json_file:
+                dtypes = json.load(json_file)
+
+        self.input_dir = input_dir
+        self.dtypes = dtypes
+        self.chunksize = chunksize
+        self.splits = ["train", "test"]
+        self.years = list(range(2015, 2022))
+        self.columns = None
+        self.rides = None
+        self.start = None
+        self.end = None
+
+    def _replace(self, **changes):
+        dataset = copy.copy(self)
+        dataset.__dict__.update(changes)
+        return dataset
+
+    def select(self, columns):
+        """
+            Only read these columns (in this order)
+        """
+        return self._replace(columns=list(columns))
+
+    def filter(self, ride=None, years=None, start=None, end=None, split=None):
+        """
+            Only read the rows of these rides / years / dates (inclusive range) / split ("train" or "test")
+
+            Filters combine with the ones already set (e.g. filter(years=...) twice keeps the overlap).
+            Ride names are matched case-insensitively (see normalizeRideName).
+        """
+        changes = {}
+        if ride is not None:
+            rides = [normalizeRideName(r) for r in ([ride] if isinstance(ride, str) else ride)]
+            changes["rides"] = rides if self.rides is None else [r for r in self.rides if r in rides]
+        if years is not None:
+            changes["years"] = [year for year in self.years if year in set(years)]
+        if start is not None:
+            changes["start"] = pd.Timestamp(start) if self.start is None else max(self.start, pd.Timestamp(start))
+        if end is not None:
+            changes["end"] = pd.Timestamp(end) if self.end is None else min(self.end, pd.Timestamp(end))
+        if split is not None:
+            splits = [split] if isinstance(split, str) else list(split)
+            changes["splits"] = [s for s in self.splits if s in splits]
+
+        return self._replace(**changes)
+
+    def files(self):
+        """
+            (split, year) of every file that collect() reads - years outside the date range are skipped
+        """
+        years = [year for year in self.years
+                 if (self.start is None or year >= self.start.year) and (self.end is None or year <= self.end.year)]
+
+        return [(split, year) for split in self.splits for year in years]
+
+    def header(self):
+        files = self.files()
+        if not files:
+            raise ValueError("No files match the split/year/date filters")
+        split, year = files[0]
+        path, compression = partitionFile(f"{self.input_dir}/All_{split}_postedtimes{year}")
+
+        return list(pd.read_csv(path, nrows=0, compression=compression).columns)
+
+    def _plan(self):
+        """
+            Columns to parse, columns to return & the ride columns the ride filter needs
+        """
+        header = self.header()
+        columns = header if self.columns is None else self.columns
+        missing = [col for col in columns if col not in header]
+        if missing:
+            raise KeyError(f"Columns not in the dataset: {missing}")
+
+        ride_cols = []
+        if self.rides is not None:
+            if "Ride_name" in header:
+                ride_cols = ["Ride_name"]
+            else:
+                ride_cols = [RIDE_PREFIX + ride for ride in self.rides]
+                unknown = [ride for ride, col in zip(self.rides, ride_cols) if col not in header]
+                if unknown:
+                    raise ValueError(f"Rides without a {RIDE_PREFIX}* column: {unknown}")
+
+        date_cols = ["date"] if self.start is not None or self.end is not None else []
+        needed = set(columns) | set(ride_cols) | set(date_cols)
+
+        return [col for col in header if col in needed], columns, ride_cols
+
+    def _readFile(self, usecols, columns, ride_cols, split_year):
+        split, year = split_year
+        path, compression = partitionFile(f"{self.input_dir}/All_{split}_postedtimes{year}")
+        read = partial(pd.read_csv, path, usecols=usecols, dtype=self.dtypes, compression=compression,
+                       parse_dates=[col for col in ["date", "datetime"] if col in usecols])
+
+        if not ride_cols and self.start is None and self.end is None:
+            return read()[columns]
+
+        chunks = []
+        for chunk in read(chunksize=self.chunksize):
+            keep = np.ones(len(chunk), dtype=bool)
+            if ride_cols == ["Ride_name"]:
+                keep &= chunk["Ride_name"].isin(self.rides).to_numpy()
+            elif ride_cols:
+                keep &= chunk[ride_cols].to_numpy(dtype=bool).any(axis=1)
+            if self.start is not None:
+                keep &= (chunk["date"] >= self.start).to_numpy()
+            if self.end is not None:
+                keep &= (chunk["date"] <= self.end).to_numpy()
+            chunks.append(chunk.loc[keep, columns])
+
+        return pd.concat(chunks, ignore_index=True)
+
+    def collect(self, prefetch_depth=2):
+        """
+            Read the selected columns of the matching rows
+
+            Parameters
+            ----------
+            prefetch_depth : int
+                number of files read ahead in background threads (see prefetch)
+
+            Returns
+            -------
+            DataFrame
+                rows of every matching file, in split & year order
+        """
+        usecols, columns, ride_cols = self._plan()
+        frames = prefetch(partial(self._readFile, usecols, columns, ride_cols), self.files(), depth=prefetch_depth)
+
+        return pd.concat(list(frames), ignore_index=True)
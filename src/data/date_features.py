@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+NS_PER_DAY = 86400 * 10 ** 9
+NS_PER_HOUR = 3600 * 10 ** 9
+
+
+def dateCodes(dates):
+    """
+        Integer code of every row's date & the distinct dates (codes index into them, NaT -> -1)
+
+        A few thousand distinct dates (or 5 minute timestamps) repeat over millions of ride observations,
+        so features of the date only have to be computed once per distinct value and broadcast back
+        with the codes.
+
+        Parameters
+        ----------
+        dates : Series
+            datetime64 column (e.g. date, datetime or Open_date)
+
+        Returns
+        -------
+        codes : ndarray
+            int code of every row (-1 for missing dates)
+        uniques : DatetimeIndex
+            distinct dates
+    """
+    codes, uniques = pd.factorize(dates)
+
+    return codes, pd.DatetimeIndex(uniques)
+
+
+def broadcast(values, codes, dtype):
+    """
+        Gather per-distinct-date values back onto the rows (missing where the code is -1)
+    """
+    return pd.array(np.asarray(values), dtype=dtype).take(codes, allow_fill=True)
+
+
+def calendarTable(dates):
+    """
+        Calendar features of distinct dates: MONTHOFYEAR, YEAR & DAYOFYEAR
+
+        Parameters
+        ----------
+        dates : DatetimeIndex
+            distinct dates (e.g. the uniques of dateCodes)
+
+        Returns
+        -------
+        DataFrame
+            one row per date, indexed by date
+    """
+    return pd.DataFrame({"MONTHOFYEAR": pd.array(dates.month, dtype="Int8"),
+                         "YEAR": pd.array(dates.year, dtype="Int16"),
+                         "DAYOFYEAR": pd.array(dates.dayofyear, dtype="Int16")}, index=dates)
+
+
+def addCalendarFeatures(df, date_col="date", datetime_col="datetime"):
+    """
+    Add the integer date features of the pipeline:
+        MONTHOFYEAR, YEAR, DAYOFYEAR - computed once per distinct date (calendarTable) & broadcast to the rows
+        HOUROFDAY - hour of the observation timestamp
+
+    Parameters
+    ----------
+    df : DataFrame
+        dataframe with datetime64 date & datetime columns
+
+    Returns
+    -------
+    df
+        updated in place
+    """
+    codes, dates = dateCodes(df[date_col])
+    table = calendarTable(dates)
+    for col in table.columns:
+        df[col] = broadcast(table[col], codes, table[col].dtype)
+
+    # integer arithmetic on the timestamps - no per-row datetime components
+    timestamps = df[datetime_col].to_numpy(dtype="datetime64[ns]").view("int64")
+    hours = pd.array(timestamps // NS_PER_HOUR % 24, dtype="Int8")
+    hours[df[datetime_col].isna().to_numpy()] = pd.NA
+    df["HOUROFDAY"] = hours
+
+    return df
+
+
+def rideAgeDays(dates, open_dates):
+    """
+        Age of the ride in whole days on every row's date: (date - Open_date).days
+
+        Both columns only take a few distinct values (observation days & one opening date per ride), so
+        they are converted to nanoseconds once per distinct value and the rows only do an integer gather
+        & subtraction.
+
+        Returns
+        -------
+        ndarray
+            int16 age in days of every row
+    """
+    date_codes, date_uniques = dateCodes(dates)
+    open_codes, open_uniques = dateCodes(open_dates)
+    if (date_codes < 0).any() or (open_codes < 0).any():
+        raise ValueError("Ride age needs a date & an Open_date on every row")
+
+    date_ns = date_uniques.to_numpy(dtype="datetime64[ns]").view("int64")
+    open_ns = open_uniques.to_numpy(dtype="datetime64[ns]").view("int64")
+    age = (date_ns[date_codes] - open_ns[open_codes]) // NS_PER_DAY
+
+    return age.astype("int16")
+
+
+def hourCodes(datetimes):
+    """
+        Integer code of every row's hour (timestamp floored to the hour) & the distinct hours
+
+        The timestamps are floored once per distinct timestamp instead of once per row.
+
+        Returns
+        -------
+        codes : ndarray
+            int code of every row (-1 for missing timestamps)
+        hours : DatetimeIndex
+            distinct hours
+    """
+    codes, timestamps = dateCodes(datetimes)
+    if not len(timestamps):
+        return codes, timestamps
+    hour_codes, hours = pd.factorize(timestamps.floor("h"))
+    # keep -1 for missing timestamps
+    codes = np.where(codes < 0, -1, hour_codes[np.maximum(codes, 0)])
+
+    return codes, pd.DatetimeIndex(hours)
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import pandas as pd
+
+from materialize import sourceSignature
+
+
+def frameBytes(value):
+    """
+        Memory used by a DataFrame / Series or a tuple of them
+    """
+    if isinstance(value, (tuple, list)):
+        return sum(frameBytes(item) for item in value)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+
+    return 0
+
+
+def copyValue(value):
+    """
+        Deep copy of a cached DataFrame / Series or a tuple of them - callers (e.g. the notebooks' inplace
+        fillna & drop) can modify it without changing the cached frames
+    """
+    if isinstance(value, tuple):
+        return tuple(copyValue(item) for item in value)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=True)
+
+    return value
+
+
+class FrameCache:
+    """
+        In-process LRU cache of loaded frames, invalidated when their source files change
+
+        Every lookup compares the size & modification time of the sources (see materialize.sourceSignature)
+        with the ones the cached value was loaded from, so a rebuilt partition is always re-read. Every
+        lookup returns a copy (copyValue) - copying a frame is much faster than parsing its CSVs, and
+        changes to the returned frames never reach the cache. Once
+        the cached frames use more than max_bytes, the least recently used entries are evicted. With a
+        snapshot_dir, loaded values are also pickled to disk (with their source signature) so a new
+        Python process skips parsing & decompressing the CSVs as well.
+
+        Parameters
+        ----------
+        max_bytes : int
+            memory cap of the cached frames (values larger than the cap are not kept)
+
+        snapshot_dir : string
+            optional directory for the on-disk snapshots
+
+    """
+
+    def __init__(self, max_bytes=4 * 2 ** 30, snapshot_dir=None):
+        self.max_bytes = max_bytes
+        self.snapshot_dir = snapshot_dir
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.snapshot_hits = 0
+        self.misses = 0
+
+    def _snapshotPath(self, key):
+        digest = hashlib.sha1(json.dumps(key, default=str).encode()).hexdigest()[:16]
+        return f"{self.snapshot_dir}/{key[0]}-{digest}"
+
+    def _readSnapshot(self, key, signature):
+        path = self._snapshotPath(key)
+        if not os.path.exists(f"{path}.pkl") or not os.path.exists(f"{path}.json"):
+            return None
+        with open(f"{path}.json") as json_file:
+            if json.load(json_file) != signature:
+                return None
+
+        return pd.read_pickle(f"{path}.pkl")
+
+    def _writeSnapshot(self, key, signature, value):
+        # temporary files first so an interrupted write never leaves a stale snapshot behind
+        path = self._snapshotPath(key)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        pd.to_pickle(value, f"{path}.pkl.tmp", protocol=5)
+        os.replace(f"{path}.pkl.tmp", f"{path}.pkl")
+        with open(f"{path}.json.tmp", "w") as json_file:
+            json.dump(signature, json_file)
+        os.replace(f"{path}.json.tmp", f"{path}.json")
+
+    def _drop(self, key):
+        self.nbytes -= self.entries.pop(key)["nbytes"]
+
+    def _put(self, key, signature, value):
+        nbytes = frameBytes(value)
+        if nbytes > self.max_bytes:
+            return
+
+        self.entries[key] = {"signature": signature, "value": value, "nbytes": nbytes}
+        self.nbytes += nbytes
+        self._evict()
+
+    def _evict(self):
+        # least recently used first
+        while self.nbytes > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+
+    def resize(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def get(self, key, sources, load):
+        """
+            Cached value of key, calling load() only if it is missing or a source file changed
+
+            Parameters
+            ----------
+            key : tuple
+                hashable & json serializable key - its first item names the loader
+                (e.g. ("posted", columns, rides, years))
+
+            sources : list
+                files the value is loaded from
+
+            load : function
+                loads the value (a DataFrame / Series or a tuple of them)
+
+            Returns
+            -------
+            copies of the cached frames
+        """
+        signature = {"sources": sourceSignature(sources)}
+        entry = self.entries.get(key)
+        if entry is not None and entry["signature"] == signature:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return copyValue(entry["value"])
+        if entry is not None:
+            self._drop(key)
+
+        value = self._readSnapshot(key, signature) if self.snapshot_dir else None
+        if value is not None:
+            self.snapshot_hits += 1
+        else:
+            self.misses += 1
+            value = load()
+            if self.snapshot_dir:
+                self._writeSnapshot(key, signature, value)
+
+        self._put(key, signature, value)
+        return copyValue(value)
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {"entries": len(self.entries), "MB": self.nbytes / 1e6, "hits": self.hits,
+                "snapshot_hits": self.snapshot_hits, "misses": self.misses}
+
+
+# module level - loadTrainTestData.py is re-executed by path (importlib) in the notebooks, this module is
+# imported by name once per process, so the cache survives re-running the loader cells
+LOADER_CACHE = FrameCache()
@@ -19,6 +19,27 @@ ride_names = ['Seven Dwarfs Mine Train', 'Astro Orbiter', 'The Barnstormer', 'Bi
               'Pirates of the Caribbean', 'Prince Charming Regal Carrousel', 'Space Mountain', 'Splash Mountain',
               'Tomorrowland Speedway', 'The Many Adventures of Winnie the Pooh']
 
+# wait time files & data.world ride names of every park, keyed by the park prefix used in park_metadata
+# (data_world is the park's Park_location code in the data.world ride metadata)
+# the EP, HS & AK wait time files are not in the repo - download them into data/raw before data_cleaning.py --parks
+park_rides = {
+    "MK": {"data_world": "MK", "ride_files": ride_files, "ride_names": ride_names},
+    "EP": {"data_world": "EC",
+           "ride_files": ['data/raw/soarin.csv', 'data/raw/spaceship_earth.csv'],
+           "ride_names": ["Soarin' Around the World", 'Spaceship Earth']},
+    "HS": {"data_world": "HS",
+           "ride_files": ['data/raw/alien_saucers.csv', 'data/raw/rock_n_rollercoaster.csv',
+                          'data/raw/slinky_dog.csv', 'data/raw/toy_story_mania.csv'],
+           "ride_names": ['Alien Swirling Saucers', "Rock 'n' Roller Coaster", 'Slinky Dog Dash',
+                          'Toy Story Mania']},
+    "AK": {"data_world": "AK",
+           "ride_files": ['data/raw/dinosaur.csv', 'data/raw/expedition_everest.csv',
+                          'data/raw/flight_of_passage.csv', 'data/raw/kilimanjaro_safaris.csv',
+                          'data/raw/navi_river.csv'],
+           "ride_names": ['Dinosaur', 'Expedition Everest', 'Avatar Flight of Passage', 'Kilimanjaro Safaris',
+                          "Na'vi River Journey"]},
+}
+
 categoricalCols = ["WDW_TICKET_SEASON", "SEASON", "HOLIDAYN",
                            "WDWRaceN", "WDWeventN", "WDWSEASON",
                            "MKeventN", "EPeventN", "HSeventN", "AKeventN",
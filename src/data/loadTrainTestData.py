@@ -1,19 +1,50 @@
 import json
+import os
+import sys
 
 import pandas as pd
 
+# importable when this file is loaded by path (importlib) from the notebooks
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from dataset import WaitTimeDataset, partitionFile
+from frame_cache import LOADER_CACHE
+
+DTYPES_PATH = "data/processed/dtypes_parsed.json"
+
 
 def setup():
-    with open("data/processed/dtypes_parsed.json") as json_file:
+    with open(DTYPES_PATH) as json_file:
         dtypes = json.load(json_file)
 
     return dtypes
 
 
-def loadTrainTestPostedWaitTimes():
+def configureLoaderCache(max_bytes=None, snapshot_dir=None):
+    """
+        Set the memory cap (bytes) and/or the on-disk snapshot directory of the loader cache
+
+        e.g. configureLoaderCache(max_bytes=8 * 2 ** 30, snapshot_dir="data/interim/cache/loaders")
+    """
+    if max_bytes is not None:
+        LOADER_CACHE.resize(max_bytes)
+    if snapshot_dir is not None:
+        LOADER_CACHE.snapshot_dir = snapshot_dir
+
+    return LOADER_CACHE.stats()
+
+
+def clearLoaderCache():
+    LOADER_CACHE.clear()
+
+
+def loadTrainTestPostedWaitTimes(columns=None, ride=None, years=None, cache=True):
     """
             Loads train test data for posted wait times
 
+            Loaded frames are kept in an in-process cache (see frame_cache.FrameCache & configureLoaderCache):
+            repeated loads with the same arguments return a copy of the cached frames until a source file
+            changes, so the returned frames can be modified in place.
+
             How to use:
 
             import importlib.util
@@ -26,6 +57,17 @@ def loadTrainTestPostedWaitTimes():
 
             Parameters
             ----------
+            columns : list
+                only load these feature columns (default: all)
+
+            ride : string or list
+                only load the rows of these rides
+
+            years : list
+                only load these years
+
+            cache : bool
+                use the loader cache (False: always read the files)
 
             Returns
             -------
@@ -35,43 +77,42 @@ def loadTrainTestPostedWaitTimes():
             rideDataDf_testY - test data targets for posted wait times
 
         """
-    parse_dates = ['date', 'datetime']
-    X_train_list = []
-    y_train_list = []
-    dtypes = setup()
+    # only the wanted columns, rides & years are read (see dataset.WaitTimeDataset)
+    data = WaitTimeDataset("data/processed", dtypes=setup()).filter(ride=ride, years=years)
+    if columns is not None:
+        data = data.select(list(columns) + ["POSTED_WAIT"])
 
-    for year in range(2015, 2022):
+    if not cache:
+        return readTrainTestPostedWaitTimes(data)
 
-        rideData = pd.read_csv(f'data/processed/All_train_postedtimes{year}.csv', dtype=dtypes,
-                               parse_dates=parse_dates, compression='gzip')
-        rideDataX = rideData.drop(columns=["POSTED_WAIT"])
-        rideDataY = rideData["POSTED_WAIT"]
-        X_train_list.append(rideDataX)
-        y_train_list.append(rideDataY)
+    key = ("posted", None if columns is None else tuple(columns),
+           None if ride is None else tuple([ride] if isinstance(ride, str) else ride),
+           None if years is None else tuple(years))
+    sources = [DTYPES_PATH] + [partitionFile(f"data/processed/All_{split}_postedtimes{year}")[0]
+                               for split, year in data.files()]
+    # absolute - the same relative paths in another project directory are other files
+    sources = [os.path.abspath(source) for source in sources]
 
-    rideDataDf_trainX = pd.concat(X_train_list, ignore_index=True)
-    rideDataDf_trainY = pd.concat(y_train_list, ignore_index=True)
+    return LOADER_CACHE.get(key, sources, lambda: readTrainTestPostedWaitTimes(data))
 
 
-    X_test_list = []
-    y_test_list = []
-
-    for year in range(2015, 2022):
-        rideData = pd.read_csv(f'data/processed/All_test_postedtimes{year}.csv', dtype=dtypes,
-                               parse_dates=parse_dates, compression='gzip')
-        rideDataX = rideData.drop(columns=["POSTED_WAIT"])
-        rideDataY = rideData["POSTED_WAIT"]
-
-        X_test_list.append(rideDataX)
-        y_test_list.append(rideDataY)
+def readTrainTestPostedWaitTimes(data):
+    """
+        Read the train & test split of a WaitTimeDataset as (X_train, X_test, y_train, y_test)
+    """
+    train = data.filter(split="train").collect()
+    rideDataDf_trainX = train.drop(columns=["POSTED_WAIT"])
+    rideDataDf_trainY = train["POSTED_WAIT"]
+    del train
 
-    rideDataDf_testX = pd.concat(X_test_list, ignore_index=True)
-    rideDataDf_testY = pd.concat(y_test_list, ignore_index=True)
+    test = data.filter(split="test").collect()
+    rideDataDf_testX = test.drop(columns=["POSTED_WAIT"])
+    rideDataDf_testY = test["POSTED_WAIT"]
 
     return rideDataDf_trainX, rideDataDf_testX, rideDataDf_trainY, rideDataDf_testY
 
 
-def loadTrainTestActualWaitTimes():
+def loadTrainTestActualWaitTimes(cache=True):
     """
             Loads train test data for actual wait times
 
@@ -87,6 +128,8 @@ def loadTrainTestActualWaitTimes():
 
             Parameters
             ----------
+            cache : bool
+                use the loader cache (see loadTrainTestPostedWaitTimes)
 
             Returns
             -------
@@ -96,6 +139,11 @@ def loadTrainTestActualWaitTimes():
             rideDataDf_testY - test data targets for actual wait times
 
         """
+    if cache:
+        sources = [os.path.abspath(source) for source in
+                   [DTYPES_PATH] + [f'data/processed/{name}_actualtimes.csv' for name in ["Xtrain", "ytrain", "Xtest"]]]
+        return LOADER_CACHE.get(("actual",), sources, lambda: loadTrainTestActualWaitTimes(cache=False))
+
     parse_dates = ['date', 'datetime']
     dtypes = setup()
 
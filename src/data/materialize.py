@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+
+import pandas as pd
+
+CACHE_DIR = "data/interim/cache"
+
+
+def sourceSignature(sources):
+    """
+        Size & modification time of every source file - the cache key of a materialized table
+
+        Parameters
+        ----------
+        sources : list
+            list of source file paths
+
+        Returns
+        -------
+        list
+            [path, size, mtime] for every source
+    """
+    return [[source, os.path.getsize(source), os.path.getmtime(source)] for source in sources]
+
+
+def materialize(name, sources, build, version=1, cache_dir=CACHE_DIR):
+    """
+        Return the table built from slow raw sources, converting them only once
+
+        The result of build() is stored as a binary pickle next to a json file with the signature of the
+        sources it was built from. Later calls load the pickle until a source file changes (or the build
+        version is bumped), so slow parsing (Excel, large CSVs) only happens once.
+
+        Parameters
+        ----------
+        name : string
+            name of the materialized table (file name in the cache directory)
+
+        sources : list
+            raw source files the table is built from
+
+        build : function
+            builds the (already filtered, aggregated & typed) DataFrame from the sources
+
+        version : int
+            version of the build logic - bump to invalidate existing caches
+
+        cache_dir : string
+            directory for the materialized tables
+
+        Returns
+        -------
+        DataFrame
+            the materialized table
+    """
+    table_path = f"{cache_dir}/{name}.pkl"
+    meta_path = f"{cache_dir}/{name}.json"
+    signature = {"version": version, "sources": sourceSignature(sources)}
+
+    if os.path.exists(table_path) and os.path.exists(meta_path):
+        with open(meta_path) as json_file:
+            if json.load(json_file) == signature:
+                return pd.read_pickle(table_path)
+
+    print(f"MATERIALIZING {name}")
+    table = build()
+
+    # write to temporary files first so an interrupted run never leaves a stale table behind - unique
+    # per writer, so processes materializing the same table at once never share a temporary file
+    os.makedirs(cache_dir, exist_ok=True)
+    replaceFile(table_path, lambda tmp_path: table.to_pickle(tmp_path, protocol=5))
+    replaceFile(meta_path, lambda tmp_path: writeJson(tmp_path, signature))
+
+    return table
+
+
+def writeJson(path, content):
+    with open(path, "w") as json_file:
+        json.dump(content, json_file)
+
+
+def replaceFile(path, write):
+    """
+        Atomically replace path with the file written by write(tmp_path) to a unique temporary file
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.",
+                                    suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
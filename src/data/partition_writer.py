@@ -0,0 +1,83 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# compression codecs for partitioned CSV outputs (pandas compression options) - every codec writes the
+# same .csv path, readers detect gzip from the file contents (dataset.partitionFile)
+# "csv" writes plain text, byte for byte what DataFrame.to_csv writes
+# "gzip" writes exactly what the pipeline has always written (gzip compressed data in .csv files)
+CODECS = {
+    "csv": None,
+    "gzip": {"method": "gzip"},
+    "gzip-fast": {"method": "gzip", "compresslevel": 1},
+}
+
+
+def _writePartition(partition, path, compression, to_csv_kwargs):
+    partition.to_csv(path, compression=compression, **to_csv_kwargs)
+    return path
+
+
+def writePartitions(df, keys, path_template, partitions=None, codec="gzip", executor="thread",
+                    max_workers=None, **to_csv_kwargs):
+    """
+        Write one file per partition key, grouping the rows once & writing all partitions concurrently
+
+        Parameters
+        ----------
+        df : DataFrame
+            data to write
+
+        keys : Series or array
+            partition key of every row of df (e.g. df["date"].dt.year)
+
+        path_template : string
+            output path without suffix with a {key} placeholder (e.g. "data/processed/All_train_postedtimes{key}")
+
+        partitions : list
+            keys to write - keys without rows are written as empty (header only) files like a boolean
+            mask filter would. Default: every key present in keys
+
+        codec : string
+            compression codec (see CODECS)
+
+        executor : string
+            "thread" or "process" pool for serializing & compressing the partitions
+
+        max_workers : int
+            size of the pool (default: one worker per partition, at most the number of CPUs)
+
+        to_csv_kwargs :
+            passed on to DataFrame.to_csv (e.g. index=False)
+
+        Returns
+        -------
+        list
+            paths of the written partitions
+    """
+    compression = CODECS[codec]
+    positions = df.groupby(keys, sort=True).indices  # row positions per key, in original row order
+    if partitions is None:
+        partitions = list(positions)
+
+    if not partitions:
+        return []
+
+    max_workers = max_workers or min(len(partitions), os.cpu_count())
+    pool = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+
+    # a partition's rows are only copied out of df when a worker is free for it - at most max_workers
+    # partitions exist next to df instead of a second copy of the whole frame
+    paths, in_flight = [], deque()
+    with pool(max_workers=max_workers) as workers:
+        for key in partitions:
+            if len(in_flight) >= max_workers:
+                paths.append(in_flight.popleft().result())
+            partition = df.take(positions[key]) if key in positions else df.iloc[:0]
+            in_flight.append(workers.submit(_writePartition, partition, path_template.format(key=key) + ".csv",
+                                            compression, to_csv_kwargs))
+            del partition
+
+        paths.extend(future.result() for future in in_flight)
+
+    return paths
@@ -0,0 +1,52 @@
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def prefetch(load, items, depth=2, executor="thread"):
+    """
+        Yield load(item) for every item in order while the next items are already loading in the background
+
+        At most depth loads run ahead of the consumer, so no more than depth + 1 loaded items are held at
+        once. Reading & decompressing a partition (pandas & zlib release the GIL) overlaps with whatever
+        the caller does with the previous one.
+
+        Parameters
+        ----------
+        load : callable
+            loads one item (must be picklable - e.g. a functools.partial - for executor="process")
+
+        items : iterable
+            items to load (e.g. years)
+
+        depth : int
+            number of items loaded ahead of the consumer (0: load in the calling thread)
+
+        executor : string
+            "thread" or "process" pool for the background loads
+
+        Returns
+        -------
+        generator
+            load(item) of every item, in the order of items
+
+    """
+    if depth < 1:
+        yield from map(load, items)
+        return
+
+    items = iter(items)
+    pool = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+    with pool(max_workers=depth) as workers:
+        pending = deque(workers.submit(load, item) for item in itertools.islice(items, depth))
+        try:
+            while pending:
+                loaded = pending.popleft().result()
+                # refill before handing the result over so the next load runs while the caller works
+                for item in itertools.islice(items, 1):
+                    pending.append(workers.submit(load, item))
+                yield loaded
+        finally:
+            # consumer stopped early - don't start the queued loads
+            for future in pending:
+                future.cancel()
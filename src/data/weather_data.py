@@ -1,9 +1,10 @@
 from weather_helpers import *
 import glob, os
 import pandas as pd
+from date_features import hourCodes
 
 
-def weatherData(Ride_data, year):
+def weatherData(Ride_data, year, output_dir='data/interim'):
     Ride_data = Ride_data[Ride_data["datetime"].dt.year == year]
 
     # for file in glob.glob("* Weather.csv"):
@@ -42,13 +43,16 @@ def weatherData(Ride_data, year):
 
     # importing
     Ride_data['datetime'] = pd.to_datetime(Ride_data['datetime'])
-    Ride_data['round_hour'] = Ride_data['datetime'].dt.floor('h')
     Weather_data["datetime"] = pd.to_datetime(Weather_data['DATE'])
     Weather_data['round_hour'] = Weather_data['datetime'].dt.floor('h')
     Weather_data = Weather_data.drop_duplicates(subset=['round_hour'])
-    updated_file = Ride_data.merge(Weather_data, on='round_hour', how='left')
-    updated_file = updated_file.rename(columns={'datetime_x': 'datetime'})
-    updated_file = updated_file.drop(columns=['Open_date', 'datetime_y', 'round_hour', 'DATE', 'SOURCE',
-                                              'REPORT_TYPE', 'CALL_SIGN', 'QUALITY_CONTROL', 'WND',
-                                              'CIG', 'VIS', 'TMP', 'DEW', 'SLP', 'AT1'])
-    updated_file.to_csv('data/interim/RideData' + str(year) + 'Weather.csv', compression='gzip')
+    Weather_data = Weather_data.drop(columns=['datetime', 'DATE', 'SOURCE', 'REPORT_TYPE', 'CALL_SIGN',
+                                              'QUALITY_CONTROL', 'WND', 'CIG', 'VIS', 'TMP', 'DEW', 'SLP', 'AT1'])
+
+    # the weather of every distinct hour, gathered onto the rows by hour code (a left join on the hour)
+    codes, hours = hourCodes(Ride_data['datetime'])
+    hourly_weather = Weather_data.set_index('round_hour').reindex(hours).reset_index(drop=True)
+    updated_file = pd.concat([Ride_data.reset_index(drop=True),
+                              hourly_weather.reindex(codes).reset_index(drop=True)], axis=1)
+    updated_file = updated_file.drop(columns=['Open_date'], errors='ignore')
+    updated_file.to_csv(f'{output_dir}/RideData{year}Weather.csv', compression='gzip')
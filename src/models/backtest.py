@@ -0,0 +1,196 @@
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from threadpoolctl import threadpool_limits
+
+from pipeline_train import pipeline_train
+from pipeline_predict import StreamingRegressionMetrics
+from prefetch import prefetch
+from model_arguments import backtest_arguments as add_arguments
+
+
+def cache_year_partitions(input_dir, cache_dir, dtypes, chunksize=500000):
+    """
+        Split the final train & test data (output of feature_engineering.py) into one pickled
+        partition per YEAR that every backtest fold can load without re-parsing the CSVs
+
+        Partitions are only rebuilt when a source CSV is newer than the cache.
+
+        Parameters
+        ----------
+        input_dir: string
+            Final data directory (data/final)
+        cache_dir: string
+            Directory for the per-year partitions
+        dtypes: dictionary
+            dtypes of the final clean dataframes
+        chunksize: int
+            Rows parsed at a time while splitting
+
+        Returns
+        -------
+        years: list
+            Years with a cached partition
+
+    """
+    sources = [f"{input_dir}/{name}_posted_final.csv" for name in ["X_train", "y_train", "X_test", "y_test"]]
+    marker = f"{cache_dir}/years.json"
+    if os.path.exists(marker) and \
+            os.path.getmtime(marker) >= max(os.path.getmtime(source) for source in sources):
+        with open(marker) as json_file:
+            return json.load(json_file)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    partitions = {}
+    for split in ["train", "test"]:
+        X_chunks = pd.read_csv(f"{input_dir}/X_{split}_posted_final.csv", dtype=dtypes, compression='gzip',
+                               chunksize=chunksize)
+        y_chunks = pd.read_csv(f"{input_dir}/y_{split}_posted_final.csv", dtype=dtypes, compression='gzip',
+                               chunksize=chunksize)
+        for X_chunk, y_chunk in zip(X_chunks, y_chunks):
+            X_chunk = X_chunk.drop(columns=['Unnamed: 0'])
+            X_chunk["POSTED_WAIT"] = y_chunk["POSTED_WAIT"].to_numpy()
+            for year, partition in X_chunk.groupby("YEAR"):
+                partitions.setdefault(int(year), []).append(partition)
+
+    years = sorted(partitions)
+    for year in years:
+        pd.concat(partitions.pop(year), ignore_index=True).to_pickle(f"{cache_dir}/year{year}.pkl")
+
+    with open(marker, "w") as json_file:
+        json.dump(years, json_file)
+
+    return years
+
+
+def load_years(cache_dir, years):
+    # the per-year pickles of a fold are read in background threads
+    data = pd.concat(list(prefetch(pd.read_pickle, [f"{cache_dir}/year{year}.pkl" for year in years])),
+                     ignore_index=True)
+    return data.drop(columns=["POSTED_WAIT"]), data["POSTED_WAIT"]
+
+
+def rolling_origin_folds(years, first_test_year):
+    """
+        Expanding window folds: train on every year before the test year, test on the test year
+
+        Test years without an earlier year to train on (e.g. the first year of the data) are skipped.
+    """
+    folds = []
+    for test_year in years:
+        train_years = [year for year in years if year < test_year]
+        if test_year < first_test_year:
+            continue
+        if not train_years:
+            print(f"SKIPPED FOLD {test_year}: no earlier year to train on")
+            continue
+        folds.append((train_years, test_year))
+
+    if not folds:
+        raise ValueError(f"No backtest fold: years {years} have no test year from {first_test_year} "
+                         f"with an earlier year to train on")
+
+    return folds
+
+
+def run_fold(cache_dir, train_years, test_year, n_jobs=1, engine="forest"):
+    """
+        Retrain the pipeline on the train years and score it on the test year
+
+        Returns
+        -------
+        fold_metrics: dictionary
+            Fold description, timings & regression metrics
+
+    """
+    start = time.time()
+    X_train, y_train = load_years(cache_dir, train_years)
+    # OpenMP (hgb) & BLAS threads get the same share of the cores as the forest's n_jobs
+    with threadpool_limits(limits=n_jobs):
+        pipeline = pipeline_train(X_train, y_train, n_jobs=n_jobs, engine=engine)
+    train_time = time.time() - start
+    train_rows = len(X_train)
+    del X_train, y_train
+
+    X_test, y_test = load_years(cache_dir, [test_year])
+    predictions = pipeline.predict(X_test)
+    fold_metrics = StreamingRegressionMetrics().update(y_test, predictions).result()
+
+    return {"engine": engine, "train_years": f"{min(train_years)}-{max(train_years)}", "test_year": test_year,
+            "train_rows": train_rows, "test_rows": len(X_test), "train_seconds": round(train_time, 1),
+            "model_mb": round(len(pickle.dumps(pipeline, protocol=5)) / 1e6, 3), **fold_metrics}
+
+
+def backtest(input_dir, cache_dir, dtypes, first_test_year=2018, workers=None, engines=("forest",)):
+    """
+        Rolling-origin backtest of the pipeline: retrain on expanding windows of years
+        (2015-2017 -> 2018, 2015-2018 -> 2019, ...) with the folds running in parallel processes
+        that share the cached per-year partitions
+
+        Parameters
+        ----------
+        input_dir: string
+            Final data directory (data/final)
+        cache_dir: string
+            Directory for the per-year partitions
+        dtypes: dictionary
+            dtypes of the final clean dataframes
+        first_test_year: int
+            First year to predict
+        workers: int
+            Number of folds run at the same time (default: all folds)
+        engines: list
+            Regressors to backtest on the same folds (see model_arguments.ENGINES)
+
+        Returns
+        -------
+        report: DataFrame
+            One row of metrics per engine & fold
+
+    """
+    years = cache_year_partitions(input_dir, cache_dir, dtypes)
+    folds = rolling_origin_folds(years, first_test_year)
+    workers = workers or len(folds)
+    # split the cores between the folds running at the same time
+    n_jobs = max(1, os.cpu_count() // workers)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_fold, cache_dir, train_years, test_year, n_jobs, engine)
+                   for engine in engines for train_years, test_year in folds]
+        report = pd.DataFrame([future.result() for future in futures])
+
+    print(report.to_string(index=False))
+    return report
+
+
+def main(args):
+    """
+        Run the rolling-origin backtest & write the metrics report
+
+        Parameters
+        ----------
+        args: Namespace
+            Parsed command line arguments (see the __main__ block below or src/cli.py)
+    """
+    # load data types that match final clean dataframes
+    with open("src/models/dtypes.json") as json_file:
+        dtypes_final = json.load(json_file)
+
+    report = backtest(args.input, args.cache_dir or f"{args.input}/backtest_cache", dtypes_final,
+                      first_test_year=args.first_test_year, workers=args.workers, engines=args.engine)
+    report.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # parse input and output arguments
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,355 @@
+import json
+import pickle
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, RegressorMixin, clone
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.utils.validation import check_is_fitted
+from model_arguments import LEAF_CODE_DTYPES, compact_model_arguments as add_arguments
+
+
+def float32_thresholds(thresholds):
+    """
+        Round split thresholds down to float32 so that x <= threshold gives the same branch for every
+        float32 x (trees compare float32 features against float64 thresholds)
+    """
+    rounded = thresholds.astype("float32")
+    above = rounded.astype("float64") > thresholds
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+
+    return rounded
+
+
+def prune_tree(tree, max_depth=None, min_samples_leaf=1, ccp_alpha=0.0):
+    """
+        Prune a fitted sklearn tree and return its nodes as flat arrays (in depth first order)
+
+        Subtrees are collapsed into a leaf (predicting the mean of the node) when they are deeper than
+        max_depth, when a split leaves fewer than min_samples_leaf training rows on one side, or when
+        they do not pay for their leaves under minimal cost-complexity pruning with ccp_alpha.
+
+        Parameters
+        ----------
+        tree: sklearn Tree
+            tree_ attribute of a fitted DecisionTreeRegressor
+        max_depth: int
+            Maximum depth of the pruned tree
+        min_samples_leaf: int
+            Minimum number of training rows in a leaf
+        ccp_alpha: float
+            Complexity parameter of minimal cost-complexity pruning (0: off)
+
+        Returns
+        -------
+        nodes: dictionary
+            feature, threshold, left, right & value arrays of the kept nodes (left == -1 for leaves)
+            and the depth of the pruned tree
+
+    """
+    left, right = tree.children_left, tree.children_right
+    samples = tree.n_node_samples
+    # node cost R(t): impurity weighted by the node's share of the training rows
+    cost = tree.impurity * tree.weighted_n_node_samples / tree.weighted_n_node_samples[0]
+    collapse = np.zeros(tree.node_count, dtype=bool)
+
+    def visit(node, depth):
+        # returns the cost-complexity cost of the (pruned) subtree under node
+        if left[node] == -1:
+            return cost[node] + ccp_alpha
+        if (max_depth is not None and depth >= max_depth) or \
+                min(samples[left[node]], samples[right[node]]) < min_samples_leaf:
+            collapse[node] = True
+            return cost[node] + ccp_alpha
+
+        subtree_cost = visit(left[node], depth + 1) + visit(right[node], depth + 1)
+        if ccp_alpha > 0 and cost[node] + ccp_alpha <= subtree_cost:
+            collapse[node] = True
+            return cost[node] + ccp_alpha
+
+        return subtree_cost
+
+    visit(0, 0)
+
+    # renumber the kept nodes in depth first order
+    kept, parents, depth, stack = [], [], 0, [(0, -1, False, 0)]
+    while stack:
+        node, parent, is_right, node_depth = stack.pop()
+        kept.append(node)
+        parents.append((parent, is_right))
+        depth = max(depth, node_depth)
+        if left[node] != -1 and not collapse[node]:
+            stack.append((right[node], len(kept) - 1, True, node_depth + 1))
+            stack.append((left[node], len(kept) - 1, False, node_depth + 1))
+
+    kept = np.array(kept)
+    new_left = np.full(len(kept), -1, dtype="int64")
+    new_right = np.full(len(kept), -1, dtype="int64")
+    for position, (parent, is_right) in enumerate(parents[1:], start=1):
+        (new_right if is_right else new_left)[parent] = position
+
+    return {"feature": tree.feature[kept], "threshold": tree.threshold[kept], "left": new_left,
+            "right": new_right, "value": tree.value[kept, 0, 0], "depth": depth}
+
+
+class CompactForest(RegressorMixin, BaseEstimator):
+    """
+        Prediction-only random forest in a few flat arrays
+
+        All trees share one node array: int16 features, float32 thresholds, the smallest integer type
+        that fits the child indices, and float32 or quantized (8/16 bit) leaf values. Leaves point to
+        themselves so every tree is walked for all rows at once, one tree level per step.
+
+        fit trains a RandomForestRegressor & compacts it, from_forest compacts an already fitted forest.
+
+        Parameters
+        ----------
+        n_estimators: int
+            Number of trees of the forest fitted by fit
+        max_depth, min_samples_leaf, ccp_alpha: int, int, float
+            Pruning of the trees (see prune_tree)
+        leaf_bits: int
+            Quantize leaf values to 8 or 16 bit codes (default: float32 values)
+        n_jobs: int
+            Number of cores used to fit the forest (-1: all cores)
+        random_state: int
+            Seed of the forest fitted by fit
+
+    """
+
+    def __init__(self, n_estimators=10, max_depth=None, min_samples_leaf=1, ccp_alpha=0.0, leaf_bits=None,
+                 n_jobs=-1, random_state=0):
+        self.n_estimators = n_estimators
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.ccp_alpha = ccp_alpha
+        self.leaf_bits = leaf_bits
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        forest = RandomForestRegressor(n_estimators=self.n_estimators, n_jobs=self.n_jobs,
+                                       random_state=self.random_state)
+        return self._compact(forest.fit(X, y))
+
+    @classmethod
+    def from_forest(cls, forest, max_depth=None, min_samples_leaf=1, ccp_alpha=0.0, leaf_bits=None):
+        compact = cls(n_estimators=len(forest.estimators_), max_depth=max_depth, min_samples_leaf=min_samples_leaf,
+                      ccp_alpha=ccp_alpha, leaf_bits=leaf_bits)
+
+        return compact._compact(forest)
+
+    def _compact(self, forest):
+        trees = [prune_tree(estimator.tree_, self.max_depth, self.min_samples_leaf, self.ccp_alpha)
+                 for estimator in forest.estimators_]
+
+        return self._build(trees, forest.n_features_in_)
+
+    def _build(self, trees, n_features):
+        # fitted state only - the constructor arguments stay untouched so clone / set_params work
+        self.trees_ = trees
+        self.n_features_in_ = n_features
+        self.n_trees_ = len(trees)
+
+        sizes = np.array([len(nodes["left"]) for nodes in trees])
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        index_dtype = "int16" if sizes.sum() <= np.iinfo("int16").max else \
+            "int32" if sizes.sum() <= np.iinfo("int32").max else "int64"
+        self.roots_ = offsets.astype(index_dtype)
+
+        is_leaf = np.concatenate([nodes["left"] == -1 for nodes in trees])
+        own_index = np.arange(sizes.sum())
+        self.left_ = np.where(is_leaf, own_index, np.concatenate(
+            [nodes["left"] + offset for nodes, offset in zip(trees, offsets)])).astype(index_dtype)
+        self.right_ = np.where(is_leaf, own_index, np.concatenate(
+            [nodes["right"] + offset for nodes, offset in zip(trees, offsets)])).astype(index_dtype)
+        self.feature_ = np.where(is_leaf, 0, np.concatenate([nodes["feature"] for nodes in trees])).astype("int16")
+        self.threshold_ = float32_thresholds(np.where(is_leaf, np.inf,
+                                                      np.concatenate([nodes["threshold"] for nodes in trees])))
+        self.depth_ = max(nodes["depth"] for nodes in trees)
+
+        values = np.where(is_leaf, np.concatenate([nodes["value"] for nodes in trees]), 0)
+        if self.leaf_bits is None:
+            self.value_, self.value_offset_, self.value_scale_ = values.astype("float32"), 0.0, 1.0
+        else:
+            levels = 2 ** self.leaf_bits - 1
+            self.value_offset_ = float(values[is_leaf].min())
+            self.value_scale_ = float(values[is_leaf].max() - self.value_offset_) / levels or 1.0
+            codes = np.rint((values - self.value_offset_) / self.value_scale_).clip(0, levels)
+            self.value_ = codes.astype(LEAF_CODE_DTYPES[self.leaf_bits])
+
+        return self
+
+    def __getstate__(self):
+        # the uncompressed node arrays are only kept to re-select trees, not in the artifact
+        state = dict(super().__getstate__())
+        state.pop("trees_", None)
+        return state
+
+    def select_trees(self, indices):
+        if not hasattr(self, "trees_"):
+            raise ValueError("Trees can only be re-selected before the CompactForest is pickled")
+
+        return clone(self).set_params(n_estimators=len(indices))._build([self.trees_[index] for index in indices],
+                                                                          self.n_features_in_)
+
+    @property
+    def node_count(self):
+        return len(self.left_)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in [self.roots_, self.left_, self.right_, self.feature_, self.threshold_,
+                                              self.value_])
+
+    def predict_trees(self, X, chunksize=65536):
+        """
+            Prediction of every tree, shape (n_trees, n_rows)
+        """
+        check_is_fitted(self)
+        X = np.asarray(X, dtype="float32")
+        predictions = np.empty((self.n_trees_, len(X)), dtype="float64")
+        for start in range(0, len(X), chunksize):
+            X_chunk = X[start:start + chunksize]
+            rows = np.arange(len(X_chunk))
+            nodes = np.repeat(self.roots_[:, None], len(X_chunk), axis=1)
+            for _ in range(self.depth_):
+                go_left = X_chunk[rows, self.feature_[nodes]] <= self.threshold_[nodes]
+                nodes = np.where(go_left, self.left_[nodes], self.right_[nodes])
+            predictions[:, start:start + chunksize] = self.value_[nodes] * self.value_scale_ + self.value_offset_
+
+        return predictions
+
+    def predict(self, X):
+        return self.predict_trees(X).mean(axis=0)
+
+
+def select_trees_within_budget(tree_predictions, y, max_mae):
+    """
+        Greedy forward selection of trees: add the tree that lowers the MAE of the averaged prediction
+        the most until the MAE is at most max_mae
+
+        Returns
+        -------
+        selected: list
+            indices of the selected trees (all trees if the budget is never met)
+
+    """
+    y = np.asarray(y, dtype="float64")
+    selected, remaining = [], list(range(len(tree_predictions)))
+    running_sum = np.zeros(len(y))
+    while remaining:
+        maes = [np.abs((running_sum + tree_predictions[tree]) / (len(selected) + 1) - y).mean()
+                for tree in remaining]
+        best = remaining.pop(int(np.argmin(maes)))
+        selected.append(best)
+        running_sum += tree_predictions[best]
+        if min(maes) <= max_mae:
+            break
+
+    return selected
+
+
+def compact_pipeline(pipeline, X_test, y_test, max_depth=None, min_samples_leaf=1, ccp_alpha=0.0, leaf_bits=None,
+                     mae_budget=None):
+    """
+        Replace the random forest of a fitted pipeline with a CompactForest
+
+        Parameters
+        ----------
+        pipeline: sklearn Pipeline
+            Fitted pipeline (output of pipeline_train)
+        X_test: DataFrame
+            Clean feature DataFrame the size vs MAE trade-offs are measured on
+        y_test: Series
+            Targets of X_test
+        max_depth, min_samples_leaf, ccp_alpha: int, int, float
+            Pruning of the trees (see prune_tree)
+        leaf_bits: int
+            Quantize leaf values to 8 or 16 bit codes
+        mae_budget: float
+            Keep the fewest trees whose MAE is at most (1 + mae_budget) x the MAE of the original forest
+
+        Returns
+        -------
+        compact: sklearn Pipeline
+            The pipeline with the CompactForest as regressor
+        report: DataFrame
+            Trees, nodes, pickled size & MAE after every compaction step
+
+    """
+    forest = pipeline.steps[-1][1]
+    if not hasattr(forest, "estimators_"):
+        raise ValueError(f"Only random forest pipelines can be compacted, not {type(forest).__name__}")
+    # transform once - every compaction step is scored on the same regressor input
+    X_transformed = pipeline[:-1].transform(X_test.copy())
+    y_test = np.asarray(y_test, dtype="float64")
+
+    def report_row(step, model, trees, nodes):
+        mae = float(np.abs(model.predict(X_transformed) - y_test).mean())
+        return {"step": step, "trees": trees, "nodes": nodes,
+                "size_mb": round(len(pickle.dumps(model, protocol=5)) / 1e6, 3), "mae": mae}
+
+    report = [report_row("original", forest, len(forest.estimators_),
+                         sum(estimator.tree_.node_count for estimator in forest.estimators_))]
+
+    compact = CompactForest.from_forest(forest)
+    report.append(report_row("float32", compact, compact.n_trees_, compact.node_count))
+
+    if max_depth is not None or min_samples_leaf > 1 or ccp_alpha > 0:
+        compact = CompactForest.from_forest(forest, max_depth, min_samples_leaf, ccp_alpha)
+        report.append(report_row("pruned", compact, compact.n_trees_, compact.node_count))
+
+    if leaf_bits is not None:
+        compact = clone(compact).set_params(leaf_bits=leaf_bits)._build(compact.trees_, forest.n_features_in_)
+        report.append(report_row(f"leaves{leaf_bits}bit", compact, compact.n_trees_, compact.node_count))
+
+    if mae_budget is not None:
+        selected = select_trees_within_budget(compact.predict_trees(X_transformed), y_test,
+                                              report[0]["mae"] * (1 + mae_budget))
+        compact = compact.select_trees(selected)
+        report.append(report_row("tree_selection", compact, compact.n_trees_, compact.node_count))
+
+    return Pipeline(steps=pipeline.steps[:-1] + [("regressor", compact)]), pd.DataFrame(report)
+
+
+def main(args):
+    """
+        Compact a trained pipeline, print the size vs MAE report & dump the compacted pipeline
+
+        Parameters
+        ----------
+        args: Namespace
+            Parsed command line arguments (see the __main__ block below or src/cli.py)
+    """
+    # load final data types
+    with open("src/models/dtypes.json") as json_file:
+        dtypes_final = json.load(json_file)
+
+    X_test = pd.read_csv("data/final/X_test_posted_final.csv", dtype=dtypes_final, compression='gzip')
+    X_test = X_test.drop(columns=['Unnamed: 0'])
+    y_test = pd.read_csv("data/final/y_test_posted_final.csv", dtype=dtypes_final, compression='gzip')
+    y_test = y_test["POSTED_WAIT"]
+
+    compact, report = compact_pipeline(joblib.load(args.input), X_test, y_test, max_depth=args.max_depth,
+                                       min_samples_leaf=args.min_samples_leaf, ccp_alpha=args.ccp_alpha,
+                                       leaf_bits=args.leaf_bits, mae_budget=args.mae_budget)
+    print(report.to_string(index=False))
+    if args.report:
+        report.to_csv(args.report, index=False)
+
+    # same format as pipeline_train.py so pipeline_predict.py loads it unchanged
+    joblib.dump(compact, f'{args.output}.gz', compress=('gzip', 5))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # parse input and output arguments
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
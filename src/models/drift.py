@@ -0,0 +1,323 @@
+import json
+
+import numpy as np
+import pandas as pd
+from model_arguments import drift_arguments as add_arguments
+
+
+class NumericSketch:
+    """
+        Fixed size summary of a numeric feature: count, missing count, mean/variance, min/max and a
+        histogram over fixed bin edges (with open ended first & last bins) that also gives approximate
+        quantiles. Memory does not grow with the number of rows seen.
+
+        Parameters
+        ----------
+        edges: list
+            Inner bin edges - when None they are set from the quantiles of the first batch seen
+        bins: int
+            Number of quantile bins used when the edges are set from the first batch
+    """
+    kind = "numeric"
+
+    def __init__(self, edges=None, bins=20):
+        self.bins = bins
+        self.edges = None if edges is None else np.asarray(edges, dtype="float64")
+        self.counts = None if edges is None else np.zeros(len(self.edges) + 1, dtype="int64")
+        self.n = 0
+        self.missing = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def empty_like(self):
+        return NumericSketch(self.edges, self.bins)
+
+    def update(self, values):
+        values = np.asarray(values, dtype="float64")
+        present = values[~np.isnan(values)]
+        self.missing += len(values) - len(present)
+        if len(present) == 0:
+            return self
+
+        if self.edges is None:
+            self.edges = np.unique(np.quantile(present, np.linspace(0, 1, self.bins + 1)[1:-1]))
+            self.counts = np.zeros(len(self.edges) + 1, dtype="int64")
+
+        self.counts += np.bincount(np.searchsorted(self.edges, present, side="right"),
+                                   minlength=len(self.counts))
+        self._merge_moments(len(present), present.mean(), np.square(present - present.mean()).sum())
+        self.min = min(self.min, present.min())
+        self.max = max(self.max, present.max())
+        return self
+
+    def _merge_moments(self, n, mean, m2):
+        # parallel variance (Chan et al.) so batches & sketches can be combined in any order
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.n * n / total
+        self.n = total
+
+    def merge(self, other):
+        self.missing += other.missing
+        if other.n == 0:
+            return self
+        if self.edges is None:
+            self.edges, self.counts = other.edges.copy(), np.zeros_like(other.counts)
+
+        self.counts += other.counts
+        self._merge_moments(other.n, other.mean, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def distribution(self):
+        return np.append(self.counts, self.missing).astype("float64")
+
+    def quantile(self, q):
+        """
+            Approximate quantile, interpolated inside the histogram bin that contains it
+        """
+        if self.n == 0:
+            return np.nan
+
+        bounds = np.concatenate([[self.min], np.clip(self.edges, self.min, self.max), [self.max]])
+        cumulative = np.cumsum(self.counts)
+        b = int(np.searchsorted(cumulative, q * self.n))
+        below = cumulative[b - 1] if b > 0 else 0
+        fraction = (q * self.n - below) / self.counts[b] if self.counts[b] else 0
+
+        return bounds[b] + fraction * (bounds[b + 1] - bounds[b])
+
+    def to_dict(self):
+        return {"kind": self.kind, "bins": self.bins, "n": self.n, "missing": self.missing, "mean": self.mean,
+                "m2": self.m2, "min": self.min if self.n else None, "max": self.max if self.n else None,
+                "edges": None if self.edges is None else self.edges.tolist(),
+                "counts": None if self.counts is None else self.counts.tolist()}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state["edges"], state["bins"])
+        sketch.n, sketch.missing, sketch.mean, sketch.m2 = state["n"], state["missing"], state["mean"], state["m2"]
+        if sketch.n:
+            sketch.min, sketch.max = state["min"], state["max"]
+            sketch.counts = np.asarray(state["counts"], dtype="int64")
+        return sketch
+
+
+class CategorySketch:
+    """
+        Counts of the values of a categorical / boolean feature, keeping at most max_categories
+        distinct values (later values are counted together as "__other__")
+
+        A sketch made with empty_like() keeps exactly the categories of the baseline (any other value is
+        counted as "__other__"), so the same value always lands in the same bucket whatever order the
+        rows come in.
+
+        Parameters
+        ----------
+        max_categories: int
+            Maximum number of distinct values kept (without categories)
+        categories: list
+            Fixed list of the values kept (e.g. those of a baseline sketch)
+    """
+    kind = "category"
+    other = "__other__"
+
+    def __init__(self, max_categories=50, categories=None):
+        self.max_categories = max_categories
+        self.categories = None if categories is None else list(categories)
+        self._kept = None if categories is None else set(categories)
+        self.counts = {}
+        self.missing = 0
+
+    def empty_like(self):
+        return CategorySketch(self.max_categories,
+                              categories=[value for value in self.counts if value != self.other])
+
+    def _add(self, value, count):
+        if self._kept is not None:
+            if value not in self._kept:
+                value = self.other
+        elif value not in self.counts and len(self.counts) >= self.max_categories:
+            value = self.other
+        self.counts[value] = self.counts.get(value, 0) + count
+
+    def update(self, values):
+        # count the raw values - only the few distinct ones are converted to strings
+        values = pd.Series(values)
+        counts = values.value_counts(sort=False)
+        self.missing += len(values) - int(counts.sum())
+        for value, count in counts[counts > 0].items():
+            self._add(str(value), int(count))
+        return self
+
+    def merge(self, other):
+        self.missing += other.missing
+        for value, count in other.counts.items():
+            self._add(value, count)
+        return self
+
+    def distribution(self, categories):
+        return np.array([self.counts.get(value, 0) for value in categories] + [self.missing], dtype="float64")
+
+    def to_dict(self):
+        return {"kind": self.kind, "max_categories": self.max_categories, "categories": self.categories,
+                "counts": self.counts, "missing": self.missing}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state["max_categories"], state.get("categories"))
+        sketch.counts, sketch.missing = dict(state["counts"]), state["missing"]
+        return sketch
+
+
+class FeatureSketches:
+    """
+        One sketch per feature column, updated batch by batch (training data, scoring chunks...)
+
+        Numeric columns get a NumericSketch; bool, string & time (HH:MM) columns a CategorySketch.
+        Sketches made with empty_like() share the bin edges & categories of a baseline so they can be
+        compared to it, and only sketch the baseline's columns.
+
+        Parameters
+        ----------
+        sketches: dictionary
+            column -> sketch
+        fixed_columns: bool
+            Only update the columns that already have a sketch (other columns of X are skipped)
+    """
+
+    def __init__(self, sketches=None, fixed_columns=False):
+        self.sketches = sketches or {}
+        self.fixed_columns = fixed_columns
+
+    def empty_like(self):
+        return FeatureSketches({col: sketch.empty_like() for col, sketch in self.sketches.items()},
+                               fixed_columns=True)
+
+    def update(self, X):
+        columns = [col for col in X.columns if col in self.sketches] if self.fixed_columns else X.columns
+        for col in columns:
+            values = X[col]
+            if col not in self.sketches:
+                numeric = pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+                self.sketches[col] = NumericSketch() if numeric else CategorySketch()
+
+            sketch = self.sketches[col]
+            if sketch.kind == "numeric":
+                sketch.update(pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64", na_value=np.nan))
+            else:
+                sketch.update(values)
+
+        return self
+
+    def merge(self, other):
+        for col, sketch in other.sketches.items():
+            if col in self.sketches:
+                self.sketches[col].merge(sketch)
+            else:
+                self.sketches[col] = sketch
+        return self
+
+    def save(self, path):
+        with open(path, "w") as json_file:
+            json.dump({col: sketch.to_dict() for col, sketch in self.sketches.items()}, json_file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as json_file:
+            states = json.load(json_file)
+
+        return cls({col: (NumericSketch if state["kind"] == "numeric" else CategorySketch).from_dict(state)
+                    for col, state in states.items()})
+
+
+def population_stability_index(expected, actual, epsilon=1e-6):
+    """
+        PSI between two count distributions over the same bins (0: identical, > 0.2: significant shift)
+    """
+    expected = expected / expected.sum() if expected.sum() else expected
+    actual = actual / actual.sum() if actual.sum() else actual
+    expected, actual = np.clip(expected, epsilon, None), np.clip(actual, epsilon, None)
+
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def compare_sketches(baseline, current, threshold=0.2):
+    """
+        Compare feature sketches of new data against the training baseline
+
+        Parameters
+        ----------
+        baseline: FeatureSketches
+            Sketches of the training data
+        current: FeatureSketches
+            Sketches of the data to check (created with baseline.empty_like())
+        threshold: float
+            PSI above which a feature is flagged as drifted
+
+        Returns
+        -------
+        report: DataFrame
+            PSI, baseline & current mean (numeric features) and drift flag per feature, most drifted first
+
+    """
+    rows = []
+    for col, expected in baseline.sketches.items():
+        actual = current.sketches.get(col)
+        if actual is None or (actual.n if actual.kind == "numeric" else sum(actual.counts.values())) == 0:
+            rows.append({"feature": col, "kind": expected.kind, "psi": np.nan, "missing_in_current": True})
+            continue
+
+        if expected.kind == "numeric":
+            if expected.edges is None:
+                rows.append({"feature": col, "kind": expected.kind, "psi": np.nan})
+                continue
+            if actual.edges is None or not np.array_equal(actual.edges, expected.edges):
+                raise ValueError(f"Sketch of {col} does not share the baseline bin edges (use empty_like)")
+            psi = population_stability_index(expected.distribution(), actual.distribution())
+            rows.append({"feature": col, "kind": expected.kind, "psi": psi,
+                         "baseline_mean": expected.mean, "current_mean": actual.mean,
+                         "baseline_median": expected.quantile(0.5), "current_median": actual.quantile(0.5)})
+        else:
+            categories = sorted(set(expected.counts) | set(actual.counts))
+            psi = population_stability_index(expected.distribution(categories), actual.distribution(categories))
+            rows.append({"feature": col, "kind": expected.kind, "psi": psi})
+
+    report = pd.DataFrame(rows)
+    report["drifted"] = report["psi"] > threshold
+
+    return report.sort_values("psi", ascending=False, na_position="first").reset_index(drop=True)
+
+
+def main(args):
+    """
+        Compare a sketch file against the training baseline & print the drifted features
+
+        Parameters
+        ----------
+        args: Namespace
+            Parsed command line arguments (see the __main__ block below or src/cli.py)
+    """
+    report = compare_sketches(FeatureSketches.load(args.baseline), FeatureSketches.load(args.current),
+                              threshold=args.threshold)
+
+    print(report[report["drifted"]].to_string(index=False))
+    print(f"{report['drifted'].sum()} of {len(report)} features drifted (PSI > {args.threshold})")
+
+    if args.output:
+        report.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # parse input and output arguments
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
@@ -1,6 +1,17 @@
+import os
+import sys
+
+import numpy as np
 import pandas as pd
 import json
 
+# shared loaders live in src/data (this module is also run as a script) - the other models modules
+# import them from here
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "data"))
+from dataset import WaitTimeDataset
+from date_features import addCalendarFeatures
+from model_arguments import feature_engineering_arguments as add_arguments
+
 parse_times = ["MKOPEN", "MKCLOSE", "MKEMHOPEN", "MKEMHCLOSE",
                "MKOPENYEST", "MKCLOSEYEST", "MKOPENTOM",
                "MKCLOSETOM", "EPOPEN", "EPCLOSE", "EPEMHOPEN",
@@ -23,7 +34,11 @@ def setup():
     return dtypes
 
 
-def load_train_test_posted_wait_times(input_dir):
+# always read - the date features, the ride & day grouping of the imputation and the targets need them
+KEY_COLUMNS = ["Unnamed: 0", "date", "datetime", "POSTED_WAIT"]
+
+
+def load_train_test_posted_wait_times(input_dir, columns=None):
     """
         Loads train test data for posted wait times
 
@@ -31,6 +46,9 @@ def load_train_test_posted_wait_times(input_dir):
         ----------
         input_dir: string
             Directory where the cleaned posted wait time datasets are located (data/processed)
+        columns: list
+            Only read these feature columns (feature_selection.py schema) - plus the KEY_COLUMNS
+            & Ride_name_* columns the data preparation needs
 
         Returns
         -------
@@ -42,51 +60,327 @@ def load_train_test_posted_wait_times(input_dir):
     """
 
     print("LOADING DATA")
-    parse_dates = ['date', 'datetime']
-    X_train_list = []
-    y_train_list = []
-    dtypes = setup()
+    data = WaitTimeDataset(input_dir, dtypes=setup())
+    if columns is not None:
+        needed = set(columns) | set(KEY_COLUMNS)
+        data = data.select([col for col in data.header() if col in needed or col.startswith("Ride_name_")])
 
-    for year in range(2015, 2022):
-        ride_data = pd.read_csv(f'{input_dir}/All_train_postedtimes{year}.csv', dtype=dtypes,
-                               parse_dates=parse_dates, compression='gzip')
-        ride_data_x = ride_data.drop(columns=["POSTED_WAIT"])
-        ride_data_y = ride_data["POSTED_WAIT"]
-        X_train_list.append(ride_data_x)
-        y_train_list.append(ride_data_y)
+    train = data.filter(split="train").collect()
+    ride_data_df_train_x = train.drop(columns=["POSTED_WAIT"])
+    ride_data_df_train_y = train["POSTED_WAIT"]
+    del train
 
-    ride_data_df_train_x = pd.concat(X_train_list, ignore_index=True)
-    ride_data_df_train_y = pd.concat(y_train_list, ignore_index=True)
+    test = data.filter(split="test").collect()
+    ride_data_df_test_x = test.drop(columns=["POSTED_WAIT"])
+    ride_data_df_test_y = test["POSTED_WAIT"]
 
-    X_test_list = []
-    y_test_list = []
+    return ride_data_df_train_x, ride_data_df_test_x, ride_data_df_train_y, ride_data_df_test_y
 
-    for year in range(2015, 2022):
-        ride_data = pd.read_csv(f'{input_dir}/All_test_postedtimes{year}.csv', dtype=dtypes,
-                               parse_dates=parse_dates, compression='gzip')
-        ride_data_x = ride_data.drop(columns=["POSTED_WAIT"])
-        ride_data_y = ride_data["POSTED_WAIT"]
 
-        X_test_list.append(ride_data_x)
-        y_test_list.append(ride_data_y)
+def ride_codes(df, prefix="Ride_name_"):
+    """
+        Collapse the one-hot encoded Ride_name columns back into a single integer ride code
 
-    ride_data_df_test_x = pd.concat(X_test_list, ignore_index=True)
-    ride_data_df_test_y = pd.concat(y_test_list, ignore_index=True)
+        Rows where none of the Ride_name columns are set (e.g. rides whose column was dropped by the
+        variance threshold) are given the code -1 so they are still grouped together.
 
-    return ride_data_df_train_x, ride_data_df_test_x, ride_data_df_train_y, ride_data_df_test_y
+        Parameters
+        ----------
+        df: DataFrame
+            DataFrame with one-hot encoded Ride_name_* columns (or a plain Ride_name column)
+        prefix: string
+            Prefix of the one-hot encoded ride columns
+
+        Returns
+        -------
+        codes: ndarray
+            int16 ride code for every row of df
+        names: list
+            ride name for every code (names[code])
+
+    """
+    if "Ride_name" in df.columns:
+        codes, names = pd.factorize(df["Ride_name"], sort=True)
+        return codes.astype("int16"), list(names)
+
+    ride_cols = [col for col in df.columns if col.startswith(prefix)]
+    names = [col[len(prefix):] for col in ride_cols]
+    if not ride_cols:
+        return np.full(len(df), -1, dtype="int16"), names
+
+    one_hot = df[ride_cols].to_numpy(dtype=bool)
+    codes = one_hot.argmax(axis=1).astype("int16")
+    codes[~one_hot.any(axis=1)] = -1
+
+    return codes, names
+
+
+def add_history_features(df, target="POSTED_WAIT", time_col="datetime", lags=(1, 2, 3),
+                         windows=("1h", "3h"), quantiles=(0.5, 0.9), last_week_tolerance="15min"):
+    """
+        Adds per-ride recent-history features of the target wait time:
+            LAG_{k} - the k-th previous observation of the same ride
+            LASTWEEK - observation of the same ride closest to the same time 7 days earlier
+            ROLLMEAN_{w} / ROLLQ{q}_{w} - mean & quantiles over the previous time window w (current row excluded)
+
+        All features only look at strictly earlier observations of the same ride. The frame is sorted
+        once by (ride, time) and every feature is computed on that order with grouped O(n) rolling
+        windows, then scattered back to the original row order.
+
+        Parameters
+        ----------
+        df: DataFrame
+            Features & target (ride columns, datetime column and target column)
+        target: string
+            Wait time column to build history features from (POSTED_WAIT / SPOSTMIN)
+        time_col: string
+            Datetime column of each observation
+        lags: tuple
+            Observation lags to add
+        windows: tuple
+            Pandas offset strings of the rolling time windows
+        quantiles: tuple
+            Quantiles to compute over each rolling window
+        last_week_tolerance: string
+            Maximum distance from the same time last week for LASTWEEK to be filled
+
+        Returns
+        -------
+        df: DataFrame
+            df with the history feature columns added
 
+    """
+    codes, _ = ride_codes(df)
+    times = df[time_col].to_numpy(dtype="datetime64[ns]")
+
+    # one sort by (ride, time) that every feature below reuses
+    order = np.lexsort((times, codes))
+    sorted_codes = codes[order]
+    sorted_times = times[order]
+    history = pd.DataFrame({"ride": sorted_codes, "time": sorted_times,
+                            "value": df[target].to_numpy(dtype="float64")[order]})
+
+    features = {}
+    by_ride = history.groupby("ride", sort=False)["value"]
+    for lag in lags:
+        features[f"LAG_{lag}"] = by_ride.shift(lag).to_numpy()
+
+    rolling = history.set_index("time").groupby("ride", sort=False)["value"]
+    for window in windows:
+        window_name = window.upper()
+        roll = rolling.rolling(window, closed="left")
+        # groupby().rolling() returns the groups in the order they appear, which is the sort order
+        features[f"ROLLMEAN_{window_name}"] = roll.mean().to_numpy()
+        for q in quantiles:
+            features[f"ROLLQ{int(q * 100)}_{window_name}"] = roll.quantile(q).to_numpy()
+
+    # same time last week: nearest earlier observation of the ride within the tolerance
+    last_week = pd.merge_asof(
+        pd.DataFrame({"time": sorted_times - np.timedelta64(7, "D"), "ride": sorted_codes,
+                      "pos": np.arange(len(history))}).sort_values("time", kind="stable"),
+        history.sort_values("time", kind="stable"),
+        on="time", by="ride", direction="nearest", tolerance=pd.Timedelta(last_week_tolerance))
+    lastweek_values = np.empty(len(history))
+    lastweek_values[last_week["pos"].to_numpy()] = last_week["value"].to_numpy()
+    features["LASTWEEK"] = lastweek_values
+
+    # scatter back to the original row order
+    for name, values in features.items():
+        unsorted = np.empty(len(values))
+        unsorted[order] = values
+        df[name] = unsorted
+
+    return df
+
+
+class RideHistoryBuffer:
+    """
+        Fixed size in-memory ring buffer of recent wait times per ride for online feature requests
+
+        Produces the same features as add_history_features from the observations pushed with update()
+        instead of rescanning the full dataset. Observations must be pushed in time order per ride.
+
+        Parameters
+        ----------
+        capacity: int
+            Observations kept per ride - must cover a week of data for LASTWEEK (default: 5 minute
+            observations over 8 days)
+        lags, windows, quantiles, last_week_tolerance:
+            Same as add_history_features
 
-def data_preparation_for_pipeline(X_train, X_test, y_train, y_test):
+    """
+
+    def __init__(self, capacity=8 * 24 * 12, lags=(1, 2, 3), windows=("1h", "3h"), quantiles=(0.5, 0.9),
+                 last_week_tolerance="15min"):
+        self.capacity = capacity
+        self.lags = lags
+        self.windows = [(window.upper(), pd.Timedelta(window).value) for window in windows]
+        self.quantiles = quantiles
+        self.tolerance = pd.Timedelta(last_week_tolerance).value
+        self._rides = {}
+
+    def update(self, ride, timestamp, value):
+        """
+            Push a new observation for a ride, overwriting the oldest one once the buffer is full
+        """
+        if ride not in self._rides:
+            self._rides[ride] = [np.zeros(self.capacity, dtype="int64"),
+                                 np.zeros(self.capacity, dtype="float64"), 0]
+        times, values, count = self._rides[ride]
+        slot = count % self.capacity
+        times[slot] = pd.Timestamp(timestamp).value
+        values[slot] = value
+        self._rides[ride][2] = count + 1
+
+    def _ordered(self, ride):
+        # oldest to newest view of the buffer
+        if ride not in self._rides:
+            return np.zeros(0, dtype="int64"), np.zeros(0)
+        times, values, count = self._rides[ride]
+        if count <= self.capacity:
+            return times[:count], values[:count]
+        slot = count % self.capacity
+        return np.roll(times, -slot), np.roll(values, -slot)
+
+    def features(self, ride, timestamp):
+        """
+            History features for a ride at the given time from the observations seen so far
+
+            Returns
+            -------
+            features: dictionary
+                Feature name -> value (NaN when there is not enough history)
+        """
+        now = pd.Timestamp(timestamp).value
+        times, values = self._ordered(ride)
+        end = np.searchsorted(times, now, side="left")  # only strictly earlier observations
+        times, values = times[:end], values[:end]
+
+        features = {}
+        for lag in self.lags:
+            features[f"LAG_{lag}"] = values[-lag] if len(values) >= lag else np.nan
+
+        for window_name, width in self.windows:
+            window_values = values[np.searchsorted(times, now - width, side="left"):]
+            features[f"ROLLMEAN_{window_name}"] = window_values.mean() if len(window_values) else np.nan
+            for q in self.quantiles:
+                features[f"ROLLQ{int(q * 100)}_{window_name}"] = \
+                    np.quantile(window_values, q) if len(window_values) else np.nan
+
+        features["LASTWEEK"] = np.nan
+        if len(times):
+            target_time = now - pd.Timedelta(days=7).value
+            idx = np.searchsorted(times, target_time)
+            candidates = [i for i in (idx - 1, idx) if 0 <= i < len(times)]
+            nearest = min(candidates, key=lambda i: abs(times[i] - target_time))
+            if abs(times[nearest] - target_time) <= self.tolerance:
+                features["LASTWEEK"] = values[nearest]
+
+        return features
+
+
+def ride_day_index(df, time_col="datetime"):
+    """
+        Grouping index of the rows by (ride, day), ordered by time within every group
+
+        Computed once with a single lexsort and shared by every column that is imputed. Rows without a
+        ride (ride code -1, see ride_codes) can not be told apart by ride, so each of them is a group of
+        its own.
+
+        Parameters
+        ----------
+        df: DataFrame
+            DataFrame with one-hot encoded Ride_name_* columns (or a plain Ride_name column) & time_col
+        time_col: string
+            Timestamp column of the observations
+
+        Returns
+        -------
+        order: ndarray
+            row positions of df in (ride, day, time) order
+        group_end: ndarray
+            for every position of order, the (exclusive) position where its (ride, day) group ends
+
+    """
+    codes, _ = ride_codes(df)
+    times = df[time_col].to_numpy().view("int64")
+    days = df[time_col].dt.normalize().to_numpy().view("int64")
+    order = np.lexsort((times, days, codes))
+
+    codes, days = codes[order], days[order]
+    # rows without a ride (code -1) may belong to different rides - every one is its own group, so they are
+    # never backfilled from another ride's values
+    starts = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1]) | (days[1:] != days[:-1])] | (codes == -1))
+    ends = np.r_[starts[1:], len(order)]
+    group_end = np.repeat(ends, ends - starts)
+
+    return order, group_end
+
+
+def grouped_backfill(df, order, group_end, columns=None, block_size=16):
+    """
+        Fill missing values with the next observation of the same ride on the same day, in place
+
+        For a block of columns at a time the position of the next non-missing value is found for all
+        cells at once (a reverse running minimum over the grouping index); cells whose next value lies
+        in another (ride, day) group are left missing for the median fill of the pipeline.
+
+        Parameters
+        ----------
+        df: DataFrame
+            DataFrame to impute
+        order, group_end: ndarrays
+            Grouping index of df (output of ride_day_index)
+        columns: list
+            Columns to impute (default: all)
+        block_size: int
+            Columns processed at once (bounds the size of the position matrix)
+
+        Returns
+        -------
+        df: DataFrame
+            The imputed DataFrame
+
+    """
+    columns = [col for col in (columns or df.columns) if df[col].hasnans]
+    n = len(order)
+    position_dtype = "int32" if n < np.iinfo("int32").max else "int64"
+    positions = np.arange(n, dtype=position_dtype)[:, None]
+
+    for start in range(0, len(columns), block_size):
+        block = columns[start:start + block_size]
+        missing = df[block].isna().to_numpy()[order]
+        next_valid = np.where(missing, n, positions)
+        next_valid = np.minimum.accumulate(next_valid[::-1], axis=0)[::-1]
+        fillable = missing & (next_valid < group_end[:, None])
+
+        for j, col in enumerate(block):
+            rows = np.flatnonzero(fillable[:, j])
+            if len(rows):
+                filled = df[col].copy()
+                filled.iloc[order[rows]] = df[col].iloc[order[next_valid[rows, j]]].to_numpy()
+                df[col] = filled
+
+    return df
+
+
+def data_preparation_for_pipeline(X_train, X_test, y_train, y_test, history_features=False):
     """
             Converts datetime objects to integer representations:
                 MONTHOFYEAR, DAYOFYEAR, YEAR, & HOUROFDAY
 
-            Sorts in date order so that next step of data imputation is backfilling based on similar entries
+            Optionally adds per-ride lag & rolling window features of the posted wait time
+            (see add_history_features), computed on the train & test rows together in time order
+
+            Backfills missing values from the next observation of the same ride on the same day
+            (see grouped_backfill) - the remaining gaps are filled with medians in the pipeline
 
             Parameters
             ----------
             X_train, X_test, y_train, y_test: DataFrames
                 Output dataframes of load_train_test_posted_wait_times
+            history_features: bool
+                Whether to add the per-ride recent-history features
 
             Returns
             -------
@@ -95,46 +389,102 @@ def data_preparation_for_pipeline(X_train, X_test, y_train, y_test):
         """
 
     print("STARTING DATA PREP")
-    X_train["MONTHOFYEAR"] = X_train["date"].dt.month.astype("Int8")
-    X_train["YEAR"] = X_train["date"].dt.year.astype("Int16")
-    X_train["DAYOFYEAR"] = X_train["date"].dt.dayofyear.astype("Int16")
-    X_train["HOUROFDAY"] = X_train["datetime"].dt.hour.astype("Int8")
+    # computed once per distinct date & broadcast back to the rows
+    addCalendarFeatures(X_train)
+    addCalendarFeatures(X_test)
+
+    # the history features are left out - backfilling a lag would copy the row's own target into it
+    impute_cols = list(X_train.columns)
+
+    if history_features:
+        print("ADDING HISTORY FEATURES")
+        # on train & test together - the split is random, so the previous observation of a ride is in
+        # either of them; add_history_features keeps the row order, so the rows are split back by position
+        combined = pd.concat([pd.concat([X_train, y_train], axis=1), pd.concat([X_test, y_test], axis=1)],
+                             ignore_index=True)
+        combined = add_history_features(combined)
+        train, test = combined.iloc[:len(X_train)], combined.iloc[len(X_train):]
+        del combined
+
+        X_train, y_train = train.drop(columns=["POSTED_WAIT"]).set_axis(X_train.index), \
+            train["POSTED_WAIT"].set_axis(y_train.index)
+        X_test, y_test = test.drop(columns=["POSTED_WAIT"]).set_axis(X_test.index), \
+            test["POSTED_WAIT"].set_axis(y_test.index)
+        del train, test
+
+    print("IMPUTING")
+    X_train = grouped_backfill(X_train, *ride_day_index(X_train), columns=impute_cols)
+    X_test = grouped_backfill(X_test, *ride_day_index(X_test), columns=[col for col in impute_cols
+                                                                         if col in X_test.columns])
+
+    X_train_clean = X_train.drop(columns=['date', 'datetime', 'Unnamed: 0'])
+    X_test_clean = X_test.drop(columns=['date', 'datetime', 'Unnamed: 0'])
 
-    X_test["MONTHOFYEAR"] = X_test["date"].dt.month.astype("Int8")
-    X_test["YEAR"] = X_test["date"].dt.year.astype("Int16")
-    X_test["DAYOFYEAR"] = X_test["date"].dt.dayofyear.astype("Int16")
-    X_test["HOUROFDAY"] = X_test["datetime"].dt.hour.astype("Int8")
+    return X_train_clean, X_test_clean, y_train, y_test
 
-    train = pd.concat([X_train, y_train], axis=1).sort_values(['datetime'])
-    test = pd.concat([X_test, y_test], axis=1).sort_values(['datetime'])
 
-    X_train_impute = train.drop(columns=["POSTED_WAIT"])
-    y_train = train["POSTED_WAIT"]
+def select_schema_columns(X, columns, history_features=False):
+    """
+        The schema columns of the engineered features, raising if a schema column was not built
 
-    X_test_impute = test.drop(columns=["POSTED_WAIT"])
-    y_test = test["POSTED_WAIT"]
+        Parameters
+        ----------
+        X: DataFrame
+            Engineered features (output of data_preparation_for_pipeline)
+        columns: list
+            Selected columns of the schema (feature_selection.py)
+        history_features: bool
+            Whether the history features were built (--history)
 
-    X_train_clean = X_train_impute.drop(columns=['date', 'datetime', 'Unnamed: 0'])
-    X_test_clean = X_test_impute.drop(columns=['date', 'datetime', 'Unnamed: 0'])
+        Returns
+        -------
+        X: DataFrame
+            the schema columns of X
+    """
+    missing = [col for col in columns if col not in X.columns]
+    if missing:
+        hint = "" if history_features else " - schemas selected from history features need --history"
+        raise ValueError(f"Schema columns missing from the engineered features: {missing}{hint}")
 
-    return X_train_clean, X_test_clean, y_train, y_test
+    return X[columns]
 
 
-if __name__ == '__main__':
-    import argparse
+def main(args):
+    """
+        Build the final pipeline-ready train/test files from the processed data
 
-    # parse input and output arguments
-    parser = argparse.ArgumentParser()
-    parser.add_argument('input', help="Clean Train/Test Data")
-    parser.add_argument('output', help="Engineered data directory")
-    args = parser.parse_args()
+        Parameters
+        ----------
+        args: Namespace
+            Parsed command line arguments (see the __main__ block below or src/cli.py)
+    """
+    columns = None
+    if args.schema:
+        # imported here - feature_selection imports pipeline_train, which imports this module
+        from feature_selection import read_schema
+        columns = read_schema(args.schema)
 
     # load in data - results of data cleaning step & final feature engineering before pipeline
-    X_train, X_test, y_train, y_test = load_train_test_posted_wait_times(args.input)
-    X_train_clean, X_test_clean, y_train, y_test = data_preparation_for_pipeline(X_train, X_test, y_train, y_test)
+    X_train, X_test, y_train, y_test = load_train_test_posted_wait_times(args.input, columns=columns)
+    X_train_clean, X_test_clean, y_train, y_test = data_preparation_for_pipeline(X_train, X_test, y_train, y_test,
+                                                                               history_features=args.history)
+    if columns is not None:
+        X_train_clean = select_schema_columns(X_train_clean, columns, args.history)
+        X_test_clean = select_schema_columns(X_test_clean, columns, args.history)
 
     # write files to data/final for pipeline
     print("WRITING FILES")
     for idx, file in enumerate([X_train_clean, X_test_clean, y_train, y_test]):
         names = ["X_train", "X_test", "y_train", "y_test"]
         file.to_csv(f"{args.output}/{names[idx]}_posted_final.csv", compression='gzip')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # parse input and output arguments
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,195 @@
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.inspection import permutation_importance
+
+from pipeline_train import pipeline_train
+from model_arguments import feature_selection_arguments as add_arguments
+
+
+def source_column(feature_name, columns):
+    """
+        Final data column behind a regressor input column (e.g. "robustscaler__log_new_case" -> "new_case")
+    """
+    name = feature_name.split("__", 1)[-1]
+    if name not in columns and name.startswith("log_"):
+        name = name[len("log_"):]
+
+    return name
+
+
+def feature_importances(X, y, method="impurity", sample_rows=200000, n_jobs=-1, n_repeats=3, random_state=42):
+    """
+        Importance of every final data column, measured with a forest fitted on a sample of the rows
+
+        The forest is trained with pipeline_train on the sample; impurity importances come for free with
+        the fit, permutation importances are computed (in parallel over the columns) on a held out third
+        of the sample. Importances of the regressor inputs are summed back onto the data columns they
+        come from (e.g. log transformed columns).
+
+        Parameters
+        ----------
+        X: DataFrame
+            Clean training features (output of feature_engineering.py)
+        y: Series
+            Training targets
+        method: string
+            "impurity" or "permutation"
+        sample_rows: int
+            Number of rows the importances are computed on
+        n_jobs: int
+            Number of cores used to fit the forest & permute the columns (-1: all cores)
+        n_repeats: int
+            Number of shuffles of every column (permutation)
+        random_state: int
+            Seed of the row sample & shuffles
+
+        Returns
+        -------
+        importances: Series
+            Importance of every column of X, sorted in decreasing order
+
+    """
+    if len(X) > sample_rows:
+        rows = np.sort(np.random.RandomState(random_state).choice(len(X), sample_rows, replace=False))
+        X, y = X.iloc[rows], y.iloc[rows]
+
+    if method == "permutation":
+        holdout = np.random.RandomState(random_state).rand(len(X)) < 1 / 3
+        X_fit, y_fit, X_holdout, y_holdout = X[~holdout], y[~holdout], X[holdout], y[holdout]
+    else:
+        X_fit, y_fit = X, y
+
+    # copy - the pipeline imputes & transforms its input in place
+    pipeline = pipeline_train(X_fit.copy(), y_fit, n_jobs=n_jobs)
+    forest = pipeline.steps[-1][1]
+    names = pipeline.named_steps["preprocessor"].get_feature_names_out()
+
+    if method == "permutation":
+        X_transformed = np.asarray(pipeline[:-1].transform(X_holdout.copy()), dtype="float32")
+        scores = permutation_importance(forest, X_transformed, y_holdout, scoring="neg_mean_absolute_error",
+                                        n_repeats=n_repeats, n_jobs=n_jobs, random_state=random_state)
+        values = scores.importances_mean
+    else:
+        values = forest.feature_importances_
+
+    columns = set(X.columns)
+    importances = pd.Series(values, index=[source_column(name, columns) for name in names])
+    importances = importances.groupby(level=0).sum().reindex(X.columns, fill_value=0.0)
+
+    return importances.sort_values(ascending=False)
+
+
+def select_features(importances, top_k=None, cumulative=None):
+    """
+        Columns to keep: the top_k most important and/or the fewest reaching a cumulative share of the importance
+
+        At least one of top_k & cumulative is required. The cumulative share only counts positive importances,
+        so it needs at least one column with a positive importance.
+
+        Returns
+        -------
+        columns: list
+            Selected columns, most important first
+    """
+    if top_k is None and cumulative is None:
+        raise ValueError("Feature selection needs top_k and/or cumulative - without them every column is kept")
+
+    importances = importances.sort_values(ascending=False)
+    keep = len(importances)
+
+    if cumulative is not None:
+        positive = importances.clip(lower=0)
+        if positive.sum() <= 0:
+            raise ValueError("No column has a positive importance - the cumulative share is undefined "
+                             "(use top_k or compute the importances on more rows)")
+        share = positive.cumsum() / positive.sum()
+        keep = min(keep, int(np.searchsorted(share.to_numpy(), cumulative)) + 1)
+    if top_k is not None:
+        keep = min(keep, top_k)
+
+    return list(importances.index[:keep])
+
+
+def write_schema(path, columns, importances, method):
+    """
+        Persist the selected columns (the schema the loaders & the predictor read)
+    """
+    schema = {"columns": columns, "method": method, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "importances": {col: float(value) for col, value in importances.items()}}
+
+    with open(f"{path}.tmp", "w") as json_file:
+        json.dump(schema, json_file, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_schema(path):
+    """
+        Selected columns of a schema written by write_schema
+    """
+    with open(path) as json_file:
+        return json.load(json_file)["columns"]
+
+
+def read_final_features(path, dtypes, columns=None, chunksize=None):
+    """
+        Read a final features CSV (output of feature_engineering.py) - only the schema columns if given
+
+        Returns
+        -------
+        DataFrame (or an iterator of DataFrames with chunksize)
+    """
+    if columns is None:
+        frames = pd.read_csv(path, dtype=dtypes, compression='gzip', chunksize=chunksize)
+        if chunksize is None:
+            return frames.drop(columns=['Unnamed: 0'])
+        return (frame.drop(columns=['Unnamed: 0']) for frame in frames)
+
+    frames = pd.read_csv(path, dtype=dtypes, compression='gzip', usecols=columns, chunksize=chunksize)
+    if chunksize is None:
+        return frames[columns]
+    return (frame[columns] for frame in frames)
+
+
+def main(args):
+    """
+        Rank the final training features by importance & write the selected columns schema
+
+        Parameters
+        ----------
+        args: Namespace
+            Parsed command line arguments (see the __main__ block below or src/cli.py)
+    """
+    # before the (long) importance computation
+    if args.top_k is None and args.cumulative is None:
+        raise ValueError("--top-k and/or --cumulative is required")
+
+    # load data types that match final clean dataframes
+    with open("src/models/dtypes.json") as json_file:
+        dtypes_final = json.load(json_file)
+
+    X_train = read_final_features(f"{args.input}/X_train_posted_final.csv", dtypes_final)
+    y_train = pd.read_csv(f"{args.input}/y_train_posted_final.csv", dtype=dtypes_final, compression='gzip')
+    y_train = y_train["POSTED_WAIT"]
+
+    importances = feature_importances(X_train, y_train, method=args.method, sample_rows=args.sample,
+                                      n_jobs=args.workers or -1)
+    columns = select_features(importances, top_k=args.top_k, cumulative=args.cumulative)
+    write_schema(args.output, columns, importances, args.method)
+
+    print(importances.to_string())
+    print(f"SELECTED {len(columns)} OF {len(importances)} COLUMNS")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # parse input and output arguments
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
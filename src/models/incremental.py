@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+
+import joblib
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+from pipeline_train import batch_dependent
+from model_arguments import incremental_arguments as add_arguments
+
+MANIFEST = "manifest.json"
+
+
+def preprocessing_version(pipeline):
+    """
+        Version id of the fitted preprocessing steps (everything before the regressor)
+    """
+    return hashlib.sha256(pickle.dumps(pipeline[:-1], protocol=5)).hexdigest()[:16]
+
+
+def read_manifest(store_dir):
+    with open(f"{store_dir}/{MANIFEST}") as json_file:
+        return json.load(json_file)
+
+
+def _write_version(store_dir, manifest, pipeline, entry):
+    path = f"{store_dir}/v{entry['version']:04d}.pkl.gz"
+    joblib.dump(pipeline, path, compress=('gzip', 5))
+    entry["path"] = path
+    manifest["versions"].append(entry)
+    manifest["latest"] = entry["version"]
+
+    # replace the manifest atomically - it always points at a complete model
+    with open(f"{store_dir}/{MANIFEST}.tmp", "w") as json_file:
+        json.dump(manifest, json_file, indent=2)
+    os.replace(f"{store_dir}/{MANIFEST}.tmp", f"{store_dir}/{MANIFEST}")
+
+    return path
+
+
+def check_pipeline(pipeline):
+    """
+        Raise if the pipeline can not be updated incrementally
+    """
+    forest = pipeline.steps[-1][1]
+    if not isinstance(forest, RandomForestRegressor):
+        raise ValueError(f"Incremental updates need a random forest pipeline, not {type(forest).__name__}")
+    if batch_dependent(pipeline):
+        # new trees would split on different log_* columns than the existing ones
+        raise ValueError("Incremental updates need the fitted preprocessing of pipeline_train.py - retrain this "
+                         "pipeline first (it transforms every batch with its own statistics)")
+
+
+def init_store(store_dir, modelPkl):
+    """
+        Start a versioned model store from a pipeline trained by pipeline_train.py (version 1)
+
+        Raises if store_dir already holds a store - its manifest & versions are never overwritten.
+
+        Returns
+        -------
+        path: string
+            pickle of version 1
+    """
+    if os.path.exists(f"{store_dir}/{MANIFEST}"):
+        raise FileExistsError(f"{store_dir} already holds a model store (latest version "
+                              f"{read_manifest(store_dir)['latest']}) - update it or start a new one")
+
+    pipeline = joblib.load(modelPkl)
+    check_pipeline(pipeline)
+    forest = pipeline.steps[-1][1]
+
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = {"versions": [], "latest": None}
+    entry = {"version": 1, "parent": None, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "data": modelPkl,
+             "rows": None, "added_trees": len(forest.estimators_), "retired_trees": 0,
+             "tree_versions": [1] * len(forest.estimators_), "preprocessing": preprocessing_version(pipeline)}
+
+    return _write_version(store_dir, manifest, pipeline, entry)
+
+
+def update_forest(pipeline, X_new, y_new, new_trees=2, max_trees=None, random_state=None):
+    """
+        Warm start the forest of a fitted pipeline with trees grown on new data only & retire the oldest trees
+
+        The new rows go through the already fitted preprocessing steps, so the new trees split on the
+        same feature space as the existing ones.
+
+        Parameters
+        ----------
+        pipeline: sklearn Pipeline
+            Fitted random forest pipeline - updated in place
+        X_new: DataFrame
+            Clean features of the newly ingested data
+        y_new: Series
+            Targets of the newly ingested data
+        new_trees: int
+            Number of trees grown on the new data
+        max_trees: int
+            Tree budget - the oldest trees are dropped beyond it (default: no budget)
+        random_state: int
+            Seed of the new trees - warm start skips one seed per existing tree, so once trees are retired
+            the forest's own seed would hand out the seeds of trees that are still in it again
+
+        Returns
+        -------
+        retired: int
+            Number of trees dropped (the first `retired` trees of the forest before the update)
+
+    """
+    check_pipeline(pipeline)
+    forest = pipeline.steps[-1][1]
+    X_transformed = pipeline[:-1].transform(X_new.copy())
+
+    if random_state is not None:
+        forest.set_params(random_state=random_state)
+    forest.set_params(warm_start=True, n_estimators=len(forest.estimators_) + new_trees)
+    forest.fit(X_transformed, y_new)
+    forest.set_params(warm_start=False)
+
+    retired = 0
+    if max_trees is not None and len(forest.estimators_) > max_trees:
+        retired = len(forest.estimators_) - max_trees
+        forest.estimators_ = forest.estimators_[retired:]
+        forest.n_estimators = max_trees
+
+    return retired
+
+
+def update_store(store_dir, X_new, y_new, new_trees=2, max_trees=None, data=None):
+    """
+        Create the next model version: the latest version updated with trees grown on the new data
+
+        Parameters
+        ----------
+        store_dir: string
+            Model store directory (see init_store)
+        X_new, y_new: DataFrame, Series
+            Newly ingested data
+        new_trees: int
+            Number of trees grown on the new data
+        max_trees: int
+            Tree budget - the oldest trees are retired beyond it
+        data: string
+            Description of the new data recorded in the manifest (e.g. its path)
+
+        Returns
+        -------
+        path: string
+            pickle of the new version
+
+    """
+    manifest = read_manifest(store_dir)
+    parent = manifest["versions"][-1]
+    pipeline = joblib.load(parent["path"])
+    if preprocessing_version(pipeline) != parent["preprocessing"]:
+        raise ValueError(f"Preprocessing of {parent['path']} does not match the manifest - the store was modified")
+
+    start = time.time()
+    version = parent["version"] + 1
+    # a fresh seed per version - the new trees never repeat the bootstrap samples of older ones
+    retired = update_forest(pipeline, X_new, y_new, new_trees, max_trees, random_state=version)
+    print(f"VERSION {version}: {new_trees} trees added, {retired} retired in {time.time() - start:.1f}s")
+
+    entry = {"version": version, "parent": parent["version"], "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+             "data": data, "rows": len(X_new), "added_trees": new_trees, "retired_trees": retired,
+             # which version grew every tree of the forest - the oldest are retired first
+             "tree_versions": (parent["tree_versions"] + [version] * new_trees)[retired:],
+             "preprocessing": preprocessing_version(pipeline)}
+
+    return _write_version(store_dir, manifest, pipeline, entry)
+
+
+def main(args):
+    """
+        Start a model store from a trained pipeline and/or add a version trained on new data
+
+        Parameters
+        ----------
+        args: Namespace
+            Parsed command line arguments (see the __main__ block below or src/cli.py)
+    """
+    if bool(args.X) != bool(args.y):
+        raise ValueError("--X & --y are only given together")
+
+    if args.base:
+        print(f"STORE STARTED: {init_store(args.store, args.base)}")
+
+    if args.X:
+        # load final data types
+        with open("src/models/dtypes.json") as json_file:
+            dtypes_final = json.load(json_file)
+
+        X_new = pd.read_csv(args.X, dtype=dtypes_final, compression='gzip')
+        X_new = X_new.drop(columns=['Unnamed: 0'])
+        y_new = pd.read_csv(args.y, dtype=dtypes_final, compression='gzip')
+        y_new = y_new["POSTED_WAIT"]
+
+        path = update_store(args.store, X_new, y_new, new_trees=args.new_trees, max_trees=args.max_trees,
+                            data=args.X)
+        print(f"LATEST MODEL: {path}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # parse input and output arguments
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,137 @@
+"""
+    Command line arguments of the models stages
+
+    Only the argument definitions & their choices live here, without pandas, sklearn or the stage
+    modules, so src/cli.py builds every subcommand parser (and answers --help) without importing them.
+    Every stage module runs its __main__ block with the same definitions.
+"""
+
+# training engines of pipeline_train.make_regressor
+ENGINES = ["forest", "hgb"]
+
+# importance measures of feature_selection.feature_importances
+IMPORTANCE_METHODS = ["impurity", "permutation"]
+
+# leaf value codes for quantized leaves of compact_model.CompactForest
+LEAF_CODE_DTYPES = {8: "uint8", 16: "uint16"}
+LEAF_BITS = sorted(LEAF_CODE_DTYPES)
+
+
+def feature_engineering_arguments(parser):
+    """
+        Command line arguments of feature_engineering.py
+    """
+    parser.add_argument('input', help="Clean Train/Test Data")
+    parser.add_argument('output', help="Engineered data directory")
+    parser.add_argument('--history', action='store_true',
+                        help="Add per-ride lag & rolling window features of the posted wait time")
+    parser.add_argument('--schema', help="Only build the columns selected by feature_selection.py (.json)")
+
+
+def feature_selection_arguments(parser):
+    """
+        Command line arguments of feature_selection.py
+    """
+    parser.add_argument('input', help="Final Data Folder (output of feature_engineering.py)")
+    parser.add_argument('output', help="Selected columns schema (.json)")
+    parser.add_argument('--method', choices=IMPORTANCE_METHODS, default="impurity", help="Importance measure")
+    parser.add_argument('--top-k', type=int, help="Keep the k most important columns (--top-k and/or --cumulative)")
+    parser.add_argument('--cumulative', type=float,
+                        help="Keep the fewest columns reaching this share of the total importance (e.g. 0.99)")
+    parser.add_argument('--sample', type=int, default=200000, help="Rows the importances are computed on")
+    parser.add_argument('--workers', type=int, help="Cores used to fit the forest & permute the columns")
+
+
+def training_matrix_arguments(parser):
+    """
+        Command line arguments of training_matrix.py
+    """
+    parser.add_argument('input', help="Final Data Folder (output of feature_engineering.py)")
+    parser.add_argument('output', help="Training matrix directory")
+
+
+def pipeline_train_arguments(parser):
+    """
+        Command line arguments of pipeline_train.py
+    """
+    parser.add_argument('input', help="Final Data Folder (output of feature_engineering.py)")
+    parser.add_argument('output', help="Pipeline Pickle (.pkl)")
+    parser.add_argument('--sketch-output', help="Write training feature sketches for drift monitoring (.json)")
+    parser.add_argument('--per-ride', action='store_true', help="Train one smaller model per ride (RideRouter)")
+    parser.add_argument('--ride-clusters', help="JSON ride name -> cluster mapping (one model per cluster)")
+    parser.add_argument('--retrain-rides', nargs='+', help="Only retrain these rides of the existing router")
+    parser.add_argument('--max-depth', type=int, help="Maximum tree depth (default: 50, --per-ride: 20, hgb: none)")
+    parser.add_argument('--engine', choices=ENGINES, default="forest", help="Regressor to train")
+    parser.add_argument('--workers', type=int, help="Ride models fitted in parallel (--per-ride)")
+    parser.add_argument('--matrix', help="Fit on a memory-mapped training matrix (training_matrix.py) instead of the CSVs")
+    parser.add_argument('--schema', help="Only train on the columns selected by feature_selection.py (.json)")
+
+
+def pipeline_predict_arguments(parser):
+    """
+        Command line arguments of pipeline_predict.py
+    """
+    parser.add_argument('input', help="Pipeline Pickle (.pkl.gz)")
+    parser.add_argument('--chunksize', type=int, help="Stream the test set in chunks of this many rows")
+    parser.add_argument('--workers', type=int, help="Scoring processes for chunked scoring")
+    parser.add_argument('--breakdown-output', help="CSV for per-ride/hour/year metrics (chunked scoring)")
+    parser.add_argument('--predictions-output', help="CSV to stream predictions to (chunked scoring)")
+    parser.add_argument('--prediction-cache', help="sqlite file memoizing predictions across runs")
+    parser.add_argument('--drift-baseline', help="Training feature sketches (pipeline_train.py --sketch-output)")
+    parser.add_argument('--sketch-output', help="Write feature sketches of the scored data (needs --drift-baseline)")
+    parser.add_argument('--quantiles', type=float, nargs='+',
+                        help="Prediction quantiles from the per-tree predictions (e.g. 0.1 0.5 0.9)")
+    parser.add_argument('--memory-budget-mb', type=float, default=256,
+                        help="Maximum size of the trees x rows matrix per chunk (--quantiles)")
+    parser.add_argument('--intervals-output', help="CSV for the predictions & quantiles (--quantiles)")
+    parser.add_argument('--schema', help="Selected columns the model was trained on (feature_selection.py)")
+
+
+def incremental_arguments(parser):
+    """
+        Command line arguments of incremental.py
+    """
+    parser.add_argument('store', help="Versioned model store directory")
+    parser.add_argument('--base', help="Start the store from this pipeline pickle (pipeline_train.py output)")
+    parser.add_argument('--X', help="Features of the new data (final format .csv)")
+    parser.add_argument('--y', help="Targets of the new data (final format .csv)")
+    parser.add_argument('--new-trees', type=int, default=2, help="Trees grown on the new data")
+    parser.add_argument('--max-trees', type=int, help="Tree budget - the oldest trees are retired beyond it")
+
+
+def compact_model_arguments(parser):
+    """
+        Command line arguments of compact_model.py
+    """
+    parser.add_argument('input', help="Pipeline Pickle (.pkl.gz)")
+    parser.add_argument('output', help="Compacted Pipeline Pickle (.pkl)")
+    parser.add_argument('--max-depth', type=int, help="Prune the trees to this depth")
+    parser.add_argument('--min-samples-leaf', type=int, default=1, help="Minimum training rows per leaf")
+    parser.add_argument('--ccp-alpha', type=float, default=0.0, help="Cost-complexity pruning parameter")
+    parser.add_argument('--leaf-bits', type=int, choices=LEAF_BITS, help="Quantize leaf values")
+    parser.add_argument('--mae-budget', type=float,
+                        help="Drop trees while the test MAE stays within (1 + budget) x the original MAE")
+    parser.add_argument('--report', help="CSV for the size vs MAE report")
+
+
+def backtest_arguments(parser):
+    """
+        Command line arguments of backtest.py
+    """
+    parser.add_argument('input', help="Final Data Folder (output of feature_engineering.py)")
+    parser.add_argument('output', help="Backtest metrics report (.csv)")
+    parser.add_argument('--cache-dir', help="Per-year partition cache (default: <input>/backtest_cache)")
+    parser.add_argument('--first-test-year', type=int, default=2018, help="First year to predict")
+    parser.add_argument('--workers', type=int, help="Folds run in parallel")
+    parser.add_argument('--engine', nargs='+', choices=ENGINES, default=["forest"],
+                        help="Regressors to compare on the same folds")
+
+
+def drift_arguments(parser):
+    """
+        Command line arguments of drift.py
+    """
+    parser.add_argument('baseline', help="Training feature sketches (.json, pipeline_train.py --sketch-output)")
+    parser.add_argument('current', help="Scoring feature sketches (.json, pipeline_predict.py --sketch-output)")
+    parser.add_argument('--threshold', type=float, default=0.2, help="PSI above which a feature is drifted")
+    parser.add_argument('--output', help="CSV for the full drift report")
@@ -1,9 +1,18 @@
 import joblib
 import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
 from sklearn import metrics
-from pipeline_train import impute_transform
+from pipeline_train import batch_dependent
+from feature_engineering import ride_codes
+from prediction_cache import PredictionCache
+from drift import FeatureSketches, compare_sketches
+from feature_selection import read_schema, read_final_features
+from model_arguments import pipeline_predict_arguments as add_arguments
 
 
 def setup():
@@ -13,7 +22,7 @@ def setup():
     return dtypes
 
 
-def predict_and_get_metrics(modelPkl, X_test, y_test):
+def predict_and_get_metrics(modelPkl, X_test, y_test, cache=None, sketches=None):
     """
         Predict wait times for test datasets based on pickled model from pipeline_train.py
 
@@ -25,6 +34,10 @@ def predict_and_get_metrics(modelPkl, X_test, y_test):
             Clean feature DataFrame ready for pipeline predictions
         y_test: Series
             Clean targets list ready for metrics calculation
+        cache: PredictionCache
+            Optional memoization cache of the model - only rows that are not cached are scored
+        sketches: FeatureSketches
+            Optional drift monitoring sketches updated with the scored features
 
         Returns
         -------
@@ -34,11 +47,19 @@ def predict_and_get_metrics(modelPkl, X_test, y_test):
             Metrics dictionary with key performance metrics
 
     """
-    # load model from pkl
-    model = joblib.load(modelPkl)
+    if sketches is not None:
+        # before predicting - the pipeline imputes & transforms X_test in place
+        sketches.update(X_test)
 
-    # make predictions based on test features
-    predictions = model.predict(X_test)
+    if cache is not None:
+        predictions = cache.predict(X_test)
+        print(cache.stats())
+    else:
+        # load model from pkl
+        model = joblib.load(modelPkl)
+
+        # make predictions based on test features
+        predictions = model.predict(X_test)
 
     # calculate performance metrics
     mae = metrics.mean_absolute_error(y_test, predictions)
@@ -54,22 +75,361 @@ def predict_and_get_metrics(modelPkl, X_test, y_test):
     return predictions, regression_metrics
 
 
-if __name__ == '__main__':
-    import argparse
+def tree_predictions(regressor, X):
+    """
+        Prediction of every tree of a fitted forest (RandomForestRegressor or CompactForest), shape (n_trees, n_rows)
+    """
+    if hasattr(regressor, "predict_trees"):
+        return regressor.predict_trees(X)
+    if not hasattr(regressor, "estimators_"):
+        raise ValueError(f"Prediction quantiles need a forest, not {type(regressor).__name__}")
+
+    # trees split on float32 features - convert the chunk once instead of once per tree
+    X = np.asarray(X, dtype="float32")
+    return np.stack([tree.predict(X, check_input=False) for tree in regressor.estimators_])
+
+
+def quantile_column(q):
+    return f"q{q * 100:g}"
+
+
+def predict_quantiles(model, X, quantiles=(0.1, 0.5, 0.9), memory_budget_mb=256):
+    """
+        Point prediction & quantiles of the per-tree predictions of every row (the spread of the forest)
+
+        X is preprocessed in one batch (like predict), then scored in row chunks so the trees x rows matrix
+        of tree predictions stays within the memory budget.
+
+        Parameters
+        ----------
+        model: sklearn Pipeline
+            Fitted random forest pipeline (pipeline_train or compact_model output)
+        X: DataFrame
+            Clean feature DataFrame ready for pipeline predictions
+        quantiles: list
+            Quantiles to compute (between 0 & 1)
+        memory_budget_mb: float
+            Maximum size of the trees x rows matrix of one chunk
+
+        Returns
+        -------
+        predictions: DataFrame
+            "prediction" (mean of the trees, same as model.predict) & one column per quantile (e.g. q10, q90)
+
+    """
+    if not hasattr(model, "steps"):
+        raise ValueError(f"Prediction quantiles need a single forest pipeline, not a {type(model).__name__} "
+                         f"(per-ride models)")
+
+    regressor = model.steps[-1][1]
+    X_transformed = model[:-1].transform(X.copy())
+    n_trees = len(regressor.estimators_) if hasattr(regressor, "estimators_") else regressor.n_trees_
+    chunksize = max(1, int(memory_budget_mb * 1e6 // (n_trees * 8)))
+
+    results = np.empty((len(X), len(quantiles) + 1))
+    for start in range(0, len(X), chunksize):
+        trees = tree_predictions(regressor, X_transformed[start:start + chunksize])
+        results[start:start + chunksize, 0] = trees.mean(axis=0)
+        results[start:start + chunksize, 1:] = np.quantile(trees, quantiles, axis=0).T
+
+    return pd.DataFrame(results, columns=["prediction"] + [quantile_column(q) for q in quantiles], index=X.index)
+
+
+def interval_coverage(y_true, predictions, quantiles):
+    """
+        How often the targets fall below every quantile & inside every central interval (q, 1 - q)
+
+        Returns
+        -------
+        report: DataFrame
+            nominal vs observed rate (and mean width for the intervals)
+
+    """
+    y_true = np.asarray(y_true, dtype="float64")
+    rows = [{"range": f"<= {quantile_column(q)}", "nominal": q,
+             "observed": float(np.mean(y_true <= predictions[quantile_column(q)].to_numpy()))}
+            for q in quantiles]
+
+    for q in sorted(quantiles):
+        # the upper quantile as it was given - 1 - q is not exact in floating point (1 - 0.07 != 0.93)
+        upper = [other for other in quantiles if np.isclose(other, 1 - q)]
+        if q < 0.5 and upper:
+            low, high = predictions[quantile_column(q)].to_numpy(), predictions[quantile_column(upper[0])].to_numpy()
+            rows.append({"range": f"{quantile_column(q)} - {quantile_column(upper[0])}", "nominal": 1 - 2 * q,
+                         "observed": float(np.mean((y_true >= low) & (y_true <= high))),
+                         "mean_width": float(np.mean(high - low))})
+
+    return pd.DataFrame(rows)
+
+
+class StreamingRegressionMetrics:
+    """
+        MAE, MSE & R-Squared accumulated chunk by chunk, so the metrics of a test set can be computed
+        without holding all targets & predictions in memory. The target variance (R-Squared) is kept as
+        a mean & sum of squared deviations merged with Chan's formula instead of raw sums of squares,
+        which would cancel on large totals.
+
+        Accumulators from different chunks/processes are combined with merge()
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.abs_error = 0.0
+        self.sq_error = 0.0
+        self.y_mean = 0.0
+        self.y_m2 = 0.0
+
+    def _merge_moments(self, n, mean, m2):
+        # parallel variance (Chan et al.) so chunks & processes can be combined in any order
+        total = self.n + n
+        delta = mean - self.y_mean
+        self.y_mean += delta * n / total
+        self.y_m2 += m2 + delta ** 2 * self.n * n / total
+        self.n = total
+
+    def update(self, y_true, y_pred):
+        y_true = np.asarray(y_true, dtype="float64")
+        if len(y_true) == 0:
+            return self
+
+        error = y_true - np.asarray(y_pred, dtype="float64")
+        self.abs_error += np.abs(error).sum()
+        self.sq_error += np.square(error).sum()
+        self._merge_moments(len(y_true), y_true.mean(), np.square(y_true - y_true.mean()).sum())
+        return self
+
+    def merge(self, other):
+        if other.n == 0:
+            return self
+
+        self.abs_error += other.abs_error
+        self.sq_error += other.sq_error
+        self._merge_moments(other.n, other.y_mean, other.y_m2)
+        return self
+
+    def result(self):
+        if self.n == 0:
+            return {"Mean Absolute Error (MAE)": np.nan, "Mean Squared Error (MSE)": np.nan, "R-Squared": np.nan}
+
+        return {"Mean Absolute Error (MAE)": float(self.abs_error / self.n),
+                "Mean Squared Error (MSE)": float(self.sq_error / self.n),
+                "R-Squared": float(1 - self.sq_error / self.y_m2) if self.y_m2 > 0 else np.nan}
+
+
+def metric_breakdown_groups(X):
+    """
+        Group labels of every row for the per-ride, per-hour & per-year metric breakdowns
+    """
+    codes, names = ride_codes(X)
+    groups = {"ride": np.array(names + ["other"], dtype=object)[codes]}
+    for breakdown, col in [("hour", "HOUROFDAY"), ("year", "YEAR")]:
+        if col in X.columns:
+            groups[breakdown] = X[col].to_numpy()
+
+    return groups
+
+
+def update_breakdowns(breakdowns, groups, y_true, y_pred):
+    """
+        Update per-group StreamingRegressionMetrics ({breakdown: {group: metrics}}) for one chunk
+    """
+    y_true = np.asarray(y_true, dtype="float64")
+    y_pred = np.asarray(y_pred, dtype="float64")
+    for breakdown, labels in groups.items():
+        group_metrics = breakdowns.setdefault(breakdown, {})
+        for label, idx in pd.Series(np.arange(len(labels))).groupby(labels).indices.items():
+            group_metrics.setdefault(label, StreamingRegressionMetrics()).update(y_true[idx], y_pred[idx])
+
+    return breakdowns
 
-    # parse input and output args
-    parser = argparse.ArgumentParser()
-    parser.add_argument('input', help="Pipeline Pickle (.pkl.gz)")
-    args = parser.parse_args()
 
+def merge_breakdowns(breakdowns, other):
+    for breakdown, group_metrics in other.items():
+        merged = breakdowns.setdefault(breakdown, {})
+        for label, group_metric in group_metrics.items():
+            merged.setdefault(label, StreamingRegressionMetrics()).merge(group_metric)
+
+    return breakdowns
+
+
+def breakdowns_to_frame(breakdowns):
+    rows = []
+    for breakdown, group_metrics in breakdowns.items():
+        for label in sorted(group_metrics):
+            rows.append({"breakdown": breakdown, "group": label, "n": group_metrics[label].n,
+                         **group_metrics[label].result()})
+
+    return pd.DataFrame(rows)
+
+
+_worker_model = None
+
+
+def _init_scoring_worker(modelPkl):
+    # once per worker process - every worker holds its own copy of the model
+    global _worker_model
+    _worker_model = joblib.load(modelPkl)
+
+
+def _score_chunk(X_chunk, y_chunk, sketches=None):
+    groups = metric_breakdown_groups(X_chunk)
+    if sketches is not None:
+        sketches.update(X_chunk)
+    predictions = _worker_model.predict(X_chunk)
+
+    chunk_metrics = StreamingRegressionMetrics().update(y_chunk, predictions)
+    chunk_breakdowns = update_breakdowns({}, groups, y_chunk, predictions)
+
+    return predictions, chunk_metrics, chunk_breakdowns, sketches
+
+
+def predict_and_get_metrics_chunked(modelPkl, X_path, y_path, dtypes, chunksize=100000, workers=None,
+                                    predictions_output=None, sketches=None, columns=None):
+    """
+        Batch scoring mode of predict_and_get_metrics for test sets larger than memory
+
+        The test set is streamed in chunks to a pool of worker processes, each loading the model once;
+        metrics are accumulated incrementally. At most 2 chunks per worker are in flight so memory
+        stays bounded (the model itself is held once per worker). Every chunk is preprocessed on its
+        own, so pipelines whose imputation depends on the batch (see pipeline_train.batch_dependent)
+        are rejected.
+
+        Parameters
+        ----------
+        modelPkl: String
+            Pickle file path from pipeline_train.py
+        X_path, y_path: String
+            Test features & targets CSVs (output of feature_engineering.py)
+        dtypes: Dictionary
+            dtypes of the final clean dataframes
+        chunksize: int
+            Rows per chunk
+        workers: int
+            Number of scoring processes (default: number of CPUs)
+        predictions_output: String
+            Optional CSV path to stream the predictions to (in test set order)
+        sketches: FeatureSketches
+            Optional drift monitoring sketches updated with the scored features (e.g. baseline.empty_like())
+        columns: list
+            Only read these feature columns (the feature_selection.py schema the model was trained on)
+
+        Returns
+        -------
+        regression_metrics: Dictionary
+            Metrics dictionary with key performance metrics
+        breakdown: DataFrame
+            Metrics per ride, per hour of day & per year
+
+    """
+    if batch_dependent(joblib.load(modelPkl)):
+        raise ValueError(f"{modelPkl} imputes from the scored batch (impute_transform) and can't be scored in "
+                         f"chunks - retrain it with pipeline_train.py or score without --chunksize")
+    workers = workers or os.cpu_count()
+
+    X_chunks = read_final_features(X_path, dtypes, columns=columns, chunksize=chunksize)
+    y_chunks = pd.read_csv(y_path, dtype=dtypes, compression='gzip', chunksize=chunksize)
+
+    total = StreamingRegressionMetrics()
+    breakdowns = {}
+    in_flight = deque()
+    first_write = True
+
+    def collect(future):
+        nonlocal first_write
+        predictions, chunk_metrics, chunk_breakdowns, chunk_sketches = future.result()
+        total.merge(chunk_metrics)
+        if sketches is not None:
+            sketches.merge(chunk_sketches)
+        merge_breakdowns(breakdowns, chunk_breakdowns)
+        if predictions_output is not None:
+            pd.Series(predictions, name="PREDICTED_WAIT").to_csv(predictions_output, index=False,
+                                                                 mode='w' if first_write else 'a',
+                                                                 header=first_write)
+            first_write = False
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_scoring_worker,
+                             initargs=(modelPkl,)) as executor:
+        for X_chunk, y_chunk in zip(X_chunks, y_chunks):
+            chunk_sketches = sketches.empty_like() if sketches is not None else None
+            in_flight.append(executor.submit(_score_chunk, X_chunk, y_chunk["POSTED_WAIT"], chunk_sketches))
+
+            # collect in submission order so streamed predictions stay aligned with the test set
+            while len(in_flight) >= 2 * workers:
+                collect(in_flight.popleft())
+
+        while in_flight:
+            collect(in_flight.popleft())
+
+    regression_metrics = total.result()
+    breakdown = breakdowns_to_frame(breakdowns)
+
+    print(regression_metrics)
+    return regression_metrics, breakdown
+
+
+def main(args):
+    """
+        Score the test data with a pickled pipeline & print the regression metrics
+
+        Parameters
+        ----------
+        args: Namespace
+            Parsed command line arguments (see the __main__ block below or src/cli.py)
+    """
     # load final data types
     with open("src/models/dtypes.json") as json_file:
         dtypes_final = json.load(json_file)
 
-    # Load testing data
-    X_test = pd.read_csv("data/final/X_test_posted_final.csv", dtype=dtypes_final, compression='gzip')
-    X_test = X_test.drop(columns=['Unnamed: 0'])
-    y_test = pd.read_csv("data/final/y_test_posted_final.csv", dtype=dtypes_final, compression='gzip')
-    y_test = y_test["POSTED_WAIT"]
+    # drift monitoring sketches binned like the training baseline
+    sketches = FeatureSketches.load(args.drift_baseline).empty_like() if args.drift_baseline else None
+
+    if args.chunksize and args.quantiles:
+        raise ValueError("--quantiles is computed in memory budget chunks of its own, drop --chunksize")
+
+    # only the columns the model was trained on (pipeline_train.py --schema)
+    columns = read_schema(args.schema) if args.schema else None
+
+    if args.chunksize:
+        regression_metrics, breakdown = predict_and_get_metrics_chunked(
+            args.input, "data/final/X_test_posted_final.csv", "data/final/y_test_posted_final.csv", dtypes_final,
+            chunksize=args.chunksize, workers=args.workers, predictions_output=args.predictions_output,
+            sketches=sketches, columns=columns)
+        if args.breakdown_output:
+            breakdown.to_csv(args.breakdown_output, index=False)
+    else:
+        # Load testing data
+        X_test = read_final_features("data/final/X_test_posted_final.csv", dtypes_final, columns=columns)
+        y_test = pd.read_csv("data/final/y_test_posted_final.csv", dtype=dtypes_final, compression='gzip')
+        y_test = y_test["POSTED_WAIT"]
+
+        cache = None
+        if args.prediction_cache:
+            cache = PredictionCache.from_pickle(args.input, disk_path=args.prediction_cache)
+
+        if args.quantiles:
+            # before predict_and_get_metrics - the pipeline imputes & transforms X_test in place
+            intervals = predict_quantiles(joblib.load(args.input), X_test, args.quantiles,
+                                          memory_budget_mb=args.memory_budget_mb)
+            print(interval_coverage(y_test, intervals, args.quantiles).to_string(index=False))
+            if args.intervals_output:
+                intervals.assign(POSTED_WAIT=y_test).to_csv(args.intervals_output, index=False)
+
+        preds, regression_metrics = predict_and_get_metrics(args.input, X_test, y_test, cache=cache,
+                                                            sketches=sketches)
+
+    if sketches is not None:
+        drift_report = compare_sketches(FeatureSketches.load(args.drift_baseline), sketches)
+        print("DRIFTED FEATURES: ", drift_report.loc[drift_report["drifted"], "feature"].tolist())
+        if args.sketch_output:
+            sketches.save(args.sketch_output)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # parse input and output args
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
 
-    preds, regression_metrics = predict_and_get_metrics(args.input, X_test, y_test)
+    main(args)
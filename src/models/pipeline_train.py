@@ -1,23 +1,36 @@
 import numpy as np
 import pandas as pd
 import joblib
-import swifter
 
 from feature_engineering import parse_times
+from drift import FeatureSketches
 from sklearn.compose import make_column_selector as selector, make_column_transformer
 from sklearn.feature_selection import VarianceThreshold
 from sklearn.preprocessing import RobustScaler, FunctionTransformer
 from sklearn.pipeline import Pipeline
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
 
 from scipy.stats import skew
 import json
+from model_arguments import pipeline_train_arguments as add_arguments
+
+
+def parse_hours(col):
+    """
+        HH:MM times to integer hours, missing as 99 to differentiate
+    """
+    col = col.fillna("99")
+    return col.apply(lambda h: h[:2] if h[0] != 0 else h[:1]).astype(int).astype("Int8")
 
 
 def impute_transform(x):
     """
             Perform data imputation as necessary & log transformation to skewed numeric columns
 
+            Medians & skew are taken from x itself, so the result depends on the batch - kept for pipelines
+            pickled before ImputeLogTransformer (see batch_dependent)
+
             Parameters
             ----------
             x: DataFrame
@@ -32,72 +45,225 @@ def impute_transform(x):
     for col in x:
         # convert HH:MM to integer hour, filling missing with 99 to differentiate
         if col in parse_times:
-            x[col] = x[col].fillna("99")
-            x[col] = x[col].apply(lambda h: h[:2] if h[0] != 0 else h[:1]).astype(int).astype("Int8")
+            x[col] = parse_hours(x[col])
 
-        # backfill imputation to fill with similar days and any remaining fill with median
-        x[col] = x[col].fillna(method='bfill')
+        # same ride & day gaps are backfilled in feature_engineering.py (grouped_backfill), fill the rest with median
         x[col] = x[col].fillna(x[col].median())
 
         # check skew in numeric columns and log transform if necessary
         if (x[col].dtype != "bool") and (abs(skew(list(x[col]))) > 0.8):
             # +20 linear scale on all values to ensure no resulting -inf vals
-            x[f"log_{col}"] = x[col].swifter.apply(lambda k: np.log(k + 20))
+            x[f"log_{col}"] = np.log(x[col].astype("float64") + 20)
             # drop old columns
             x.drop(columns=[col], inplace=True)
 
     return x
 
 
-def pipeline_train(X_train, y_train):
+class ImputeLogTransformer(TransformerMixin, BaseEstimator):
+    """
+        impute_transform with its decisions fitted on the training data
+
+        The fill value (median) of every column and the columns that are log transformed (skew above
+        skew_threshold) are learned in fit, so transform treats every row the same whatever batch it
+        is scored in - chunks, single rows & cache misses get the same columns as the training data.
+
+        Missing values are filled with the training medians only: gaps within the same ride & day are
+        expected to be backfilled already (feature_engineering.grouped_backfill). Data that did not go
+        through feature_engineering.py gets median fills where it would have been backfilled.
+
+        Parameters
+        ----------
+        skew_threshold: float
+            Columns with an absolute skew above it are log transformed
+    """
+
+    def __init__(self, skew_threshold=0.8):
+        self.skew_threshold = skew_threshold
+
+    def _parse(self, X):
+        # shallow copy - replaced columns never touch the caller's frame
+        x = X.copy(deep=False)
+        for col in x.columns.intersection(parse_times):
+            x[col] = parse_hours(x[col])
+
+        return x
+
+    def fit(self, X, y=None):
+        x = self._parse(X)
+        self.feature_names_in_ = np.asarray(x.columns, dtype=object)
+        self.medians_ = {}
+        self.log_columns_ = []
+        for col in x:
+            self.medians_[col] = x[col].median()
+            filled = x[col].fillna(self.medians_[col])
+            if (filled.dtype != "bool") and (abs(skew(list(filled))) > self.skew_threshold):
+                self.log_columns_.append(col)
+
+        return self
+
+    def transform(self, X):
+        x = self._parse(X)
+        for col in x:
+            if col in self.medians_:
+                x[col] = x[col].fillna(self.medians_[col])
+            if col in self.log_columns_:
+                # +20 linear scale on all values to ensure no resulting -inf vals
+                x[f"log_{col}"] = np.log(x[col].astype("float64") + 20)
+                x = x.drop(columns=[col])
+
+        return x
+
+
+def batch_dependent(model):
+    """
+        Whether a fitted pipeline (or RideRouter) still imputes with impute_transform, whose output depends
+        on the other rows of the batch (pipelines trained before ImputeLogTransformer)
+    """
+    if hasattr(model, "models"):
+        return any(batch_dependent(sub_model) for sub_model in
+                   list(model.models.values()) + ([model.fallback] if model.fallback is not None else []))
+
+    first_step = model.steps[0][1] if isinstance(model, Pipeline) else model
+    return isinstance(first_step, FunctionTransformer) and first_step.func is impute_transform
+
+
+def preprocessing_steps():
+    """
+        Imputation/log transform & scaling steps of the pipeline (everything before the regressor)
+
+        The imputation only fills the gaps left by feature_engineering.py with training medians - its input
+        must already be backfilled within every ride & day (feature_engineering.grouped_backfill), otherwise
+        those gaps get medians too and the model sees other values than it was trained on.
+    """
+    preprocessor = make_column_transformer(
+        (RobustScaler(), selector(dtype_include=np.number)), remainder='passthrough')
+
+    return [("imputerAndLogTransformer", ImputeLogTransformer()),
+            ("preprocessor", preprocessor)]
+
+
+# depth of the forest trees - the one default every training entry point uses
+DEFAULT_MAX_DEPTH = 50
+
+
+def engine_max_depth(engine, max_depth=None):
+    """
+        max_depth if given, else the default of the engine: DEFAULT_MAX_DEPTH for forests, unlimited for
+        boosting (its trees are bounded by their number of leaves)
+    """
+    if max_depth is not None:
+        return max_depth
+
+    return None if engine == "hgb" else DEFAULT_MAX_DEPTH
+
+
+def make_regressor(n_jobs=-1, max_depth=None, engine="forest"):
+    max_depth = engine_max_depth(engine, max_depth)
+    if engine == "hgb":
+        # histogram gradient boosting bins the preprocessed features itself (OpenMP threads - limited with
+        # threadpoolctl where several models are fitted at the same time)
+        return HistGradientBoostingRegressor(max_iter=300, max_depth=max_depth, random_state=0)
+
+    return RandomForestRegressor(n_estimators=10, max_depth=max_depth, n_jobs=n_jobs, random_state=0)
+
+
+def pipeline_train(X_train, y_train, n_jobs=-1, max_depth=None, engine="forest"):
     """
             Train the pipeline for final model
 
             Parameters
             ----------
             X_train: DataFrame
-                Clean feature DataFrame ready for pipeline transformation & fitting
+                Clean feature DataFrame ready for pipeline transformation & fitting (output of
+                feature_engineering.py - backfilled within every ride & day, see preprocessing_steps)
             y_train: Series
                 Clean targets list ready for pipeline fitting
+            n_jobs: int
+                Number of cores used to fit the forest (-1: all cores)
+            max_depth: int
+                Maximum depth of the trees (default: the engine's, see engine_max_depth)
+            engine: string
+                "forest" (random forest) or "hgb" (histogram gradient boosting)
 
             Returns
             -------
             pipeline: sklearn Pipeline object
                 Fitted model with transformed data
         """
-    preprocessor = make_column_transformer(
-        (RobustScaler(), selector(dtype_include=np.number)), remainder='passthrough')
-
-    pipeline = Pipeline(
-        steps=[("imputerAndLogTransformer", FunctionTransformer(impute_transform)),
-               ("preprocessor", preprocessor),
-               ("regressor", RandomForestRegressor(n_estimators=10, max_depth=50, n_jobs=-1, random_state=0))]
-    )
+    steps = preprocessing_steps()
+    pipeline = Pipeline(steps=steps + [("regressor", make_regressor(n_jobs, max_depth, engine))])
 
     pipeline.fit(X_train, y_train)
 
     return pipeline
 
-if __name__ == '__main__':
-    import argparse
 
-    # parse input and output arguments
-    parser = argparse.ArgumentParser()
-    parser.add_argument('input', help="Final Data Folder (output of feature_engineering.py)")
-    parser.add_argument('output', help="Pipeline Pickle (.pkl)")
-    args = parser.parse_args()
+def main(args):
+    """
+        Train the pipeline on the final data & dump it as a compressed pickle
 
+        Parameters
+        ----------
+        args: Namespace
+            Parsed command line arguments (see the __main__ block below or src/cli.py)
+    """
     # load data types that match final clean dataframes
     with open("src/models/dtypes.json") as json_file:
         dtypes_final = json.load(json_file)
 
-    # import pandas dataframes
-    X_train = pd.read_csv(f"{args.input}/X_train_posted_final.csv", dtype=dtypes_final, compression='gzip')
-    X_train = X_train.drop(columns=['Unnamed: 0'])
+    if args.matrix:
+        if args.per_ride or args.sketch_output or args.schema:
+            raise ValueError("--matrix cannot be combined with --per-ride, --sketch-output or --schema")
+        # imported here - training_matrix imports the pipeline steps from this module
+        from training_matrix import train_from_matrix
+
+        pipeline = train_from_matrix(args.matrix, max_depth=args.max_depth, engine=args.engine)
+        joblib.dump(pipeline, f'{args.output}.gz', compress=('gzip', 5))
+        return
+
+    # imported here - feature_selection imports pipeline_train from this module
+    from feature_selection import read_schema, read_final_features
+
+    # import pandas dataframes (only the selected columns with --schema)
+    columns = read_schema(args.schema) if args.schema else None
+    X_train = read_final_features(f"{args.input}/X_train_posted_final.csv", dtypes_final, columns=columns)
     y_train = pd.read_csv(f"{args.input}/y_train_posted_final.csv", dtype=dtypes_final, compression='gzip')
     y_train = y_train["POSTED_WAIT"]
 
-    pipeline = pipeline_train(X_train, y_train)
+    if args.sketch_output:
+        # training baseline for drift monitoring (before the pipeline transforms X_train in place)
+        FeatureSketches().update(X_train).save(args.sketch_output)
+
+    if (args.retrain_rides or args.ride_clusters) and not args.per_ride:
+        raise ValueError("--retrain-rides & --ride-clusters only apply to --per-ride training")
+
+    if args.per_ride:
+        # imported here - ride_models imports pipeline_train from this module
+        from ride_models import train_ride_models
+
+        clusters = None
+        if args.ride_clusters:
+            with open(args.ride_clusters) as json_file:
+                clusters = json.load(json_file)
+
+        # --retrain-rides updates the shards of those rides in the existing router pickle
+        router = joblib.load(f'{args.output}.gz') if args.retrain_rides else None
+        pipeline = train_ride_models(X_train, y_train, clusters=clusters, rides=args.retrain_rides, router=router,
+                                     max_depth=args.max_depth, workers=args.workers, engine=args.engine)
+    else:
+        pipeline = pipeline_train(X_train, y_train, max_depth=args.max_depth, engine=args.engine)
 
     # dump pipeline into compressed pickle file as defined in output argument
     joblib.dump(pipeline, f'{args.output}.gz', compress=('gzip', 5))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # parse input and output arguments
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,179 @@
+import hashlib
+import sqlite3
+import time
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from pipeline_train import batch_dependent
+
+# bumped when the way cached predictions are made changes - older disk tier entries are never read
+KEY_FORMAT = "2"
+
+
+def model_version(modelPkl):
+    """
+        Stable version id of a pickled model (sha256 of the file contents)
+    """
+    digest = hashlib.sha256()
+    with open(modelPkl, "rb") as model_file:
+        for block in iter(lambda: model_file.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+        Memoizes pipeline predictions per feature row so identical rows are not re-scored
+
+        Rows are keyed by a 64 bit hash of the model version, the column names and the row values.
+        The in-memory tier is an LRU of at most maxsize entries with an optional time to live; an optional
+        sqlite file keeps predictions across processes & runs. Rows missing from both tiers are predicted
+        in a single batch (each distinct row once).
+
+        Pipelines imputing with ImputeLogTransformer score every row independently of its batch, so only
+        the uncached rows are sent to the model. Older pipelines (impute_transform, see batch_dependent)
+        take medians & skew from the batch: their uncached rows are scored inside the full batch, exactly
+        as model.predict(X) would, and only those predictions are stored.
+
+        Parameters
+        ----------
+        model: sklearn Pipeline
+            Fitted pipeline (output of pipeline_train)
+        version: string
+            Model version - predictions of different versions never share keys
+        maxsize: int
+            Maximum number of predictions kept in memory
+        ttl: float
+            Seconds a prediction stays valid (default: forever)
+        disk_path: string
+            Optional sqlite file for the on-disk tier
+
+    """
+
+    def __init__(self, model, version, maxsize=1000000, ttl=None, disk_path=None):
+        self.model = model
+        self.version = version
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._batch_dependent = batch_dependent(model)
+
+        self._disk = None
+        if disk_path is not None:
+            self._disk = sqlite3.connect(disk_path)
+            self._disk.execute("CREATE TABLE IF NOT EXISTS predictions "
+                               "(key INTEGER PRIMARY KEY, prediction REAL, created REAL)")
+
+    @classmethod
+    def from_pickle(cls, modelPkl, **kwargs):
+        return cls(joblib.load(modelPkl), model_version(modelPkl), **kwargs)
+
+    def row_keys(self, X):
+        """
+            Signed 64 bit cache key of every row of X
+        """
+        salt = hashlib.sha256("|".join([KEY_FORMAT, self.version] + list(map(str, X.columns))).encode()).digest()
+        salt = np.frombuffer(salt[:8], dtype="uint64")[0]
+        row_hashes = pd.util.hash_pandas_object(X, index=False).to_numpy()
+
+        return (row_hashes ^ salt).view("int64")
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _get_memory(self, key):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry[1]):
+            del self._memory[key]
+            return None
+
+        self._memory.move_to_end(key)
+        return entry[0]
+
+    def _put_memory(self, key, prediction, created):
+        self._memory[key] = (prediction, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def _get_disk(self, keys):
+        found = {}
+        for start in range(0, len(keys), 500):  # stay below the sqlite host parameter limit
+            batch = keys[start:start + 500]
+            rows = self._disk.execute(f"SELECT key, prediction, created FROM predictions "
+                                      f"WHERE key IN ({','.join('?' * len(batch))})", batch).fetchall()
+            found.update({key: (prediction, created) for key, prediction, created in rows
+                          if not self._expired(created)})
+
+        return found
+
+    def predict(self, X):
+        """
+            Predict with the cached pipeline, only scoring rows that are not cached yet
+
+            Parameters
+            ----------
+            X: DataFrame
+                Clean feature DataFrame ready for pipeline predictions
+
+            Returns
+            -------
+            predictions: ndarray
+                prediction for every row of X
+        """
+        keys = self.row_keys(X)
+        predictions = np.empty(len(X))
+        missing = {}
+        for position, key in enumerate(keys.tolist()):
+            prediction = self._get_memory(key)
+            if prediction is None:
+                missing.setdefault(key, []).append(position)
+            else:
+                predictions[position] = prediction
+        self.hits += len(X) - sum(len(positions) for positions in missing.values())
+
+        if missing and self._disk is not None:
+            for key, (prediction, created) in self._get_disk(list(missing)).items():
+                positions = missing.pop(key)
+                predictions[positions] = prediction
+                self.disk_hits += len(positions)
+                self._put_memory(key, prediction, created)
+
+        if missing:
+            first_positions = [positions[0] for positions in missing.values()]
+            if self._batch_dependent:
+                new_predictions = self.model.predict(X.copy())[first_positions]
+            else:
+                # one model call for every distinct uncached row
+                new_predictions = self.model.predict(X.iloc[first_positions])
+            now = time.time()
+            for (key, positions), prediction in zip(missing.items(), new_predictions.tolist()):
+                predictions[positions] = prediction
+                self.misses += len(positions)
+                self._put_memory(key, prediction, now)
+
+            if self._disk is not None:
+                self._disk.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)",
+                                       [(key, prediction, now) for key, prediction
+                                        in zip(missing, new_predictions.tolist())])
+                self._disk.commit()
+
+        return predictions
+
+    def stats(self):
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "cached": len(self._memory)}
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
@@ -0,0 +1,161 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+from feature_engineering import ride_codes
+from dataset import normalizeRideName
+from pipeline_train import pipeline_train
+
+# depth of the per-ride forests - every shard only has the rows of its rides, so its trees are kept shallower
+# than the global model's (pipeline_train.DEFAULT_MAX_DEPTH)
+RIDE_MAX_DEPTH = 20
+
+# shard of the rows without a Ride_name column set (rides whose column was dropped by the variance threshold)
+OTHER_RIDES = "__other__"
+
+
+def ride_shards(X, clusters=None):
+    """
+        Shard key of every row: its ride name, or the ride's cluster when a cluster mapping is given
+
+        Parameters
+        ----------
+        X: DataFrame
+            Feature DataFrame with one-hot encoded Ride_name_* columns (or a plain Ride_name column)
+        clusters: dictionary
+            Optional ride name -> cluster name mapping (rides missing from it keep their own shard)
+
+        Returns
+        -------
+        shards: ndarray
+            object array with the shard key of every row (OTHER_RIDES for rows without a ride)
+
+    """
+    codes, names = ride_codes(X)
+    clusters = clusters or {}
+    # one lookup per ride code instead of per row, with the last slot for code -1
+    keys = np.array([clusters.get(name, name) for name in names] + [OTHER_RIDES], dtype=object)
+
+    return keys[codes]
+
+
+def _fit_shard(shard, X, y, max_depth, n_jobs, engine):
+    # OpenMP (hgb) & BLAS threads get the same share of the cores as the forest's n_jobs
+    with threadpool_limits(limits=n_jobs):
+        return shard, pipeline_train(X, y, n_jobs=n_jobs, max_depth=max_depth, engine=engine)
+
+
+class RideRouter:
+    """
+        One pipeline per ride (or ride cluster), used like a single pipeline
+
+        predict() splits the rows by shard and calls every sub-model once on its rows.
+        Rows of rides without a sub-model go to the fallback pipeline (e.g. a model of all rides);
+        without a fallback they raise a ValueError.
+
+        Parameters
+        ----------
+        models: dictionary
+            shard key -> fitted pipeline
+        clusters: dictionary
+            ride name -> cluster name mapping the models were trained with
+        fallback: sklearn Pipeline
+            Optional pipeline for rows of rides without a sub-model
+
+    """
+
+    def __init__(self, models=None, clusters=None, fallback=None):
+        self.models = models or {}
+        self.clusters = clusters or {}
+        self.fallback = fallback
+
+    def predict(self, X):
+        shards = ride_shards(X, self.clusters)
+        predictions = np.empty(len(X))
+        routed = np.zeros(len(X), dtype=bool)
+
+        for shard, model in self.models.items():
+            rows = np.flatnonzero(shards == shard)
+            if len(rows):
+                # the pipeline imputes & transforms in place - give it its own copy of the rows
+                predictions[rows] = model.predict(X.iloc[rows].copy())
+                routed[rows] = True
+
+        if not routed.all():
+            rows = np.flatnonzero(~routed)
+            if self.fallback is None:
+                raise ValueError(f"No model for rides {sorted(set(map(str, shards[rows])))}")
+            predictions[rows] = self.fallback.predict(X.iloc[rows].copy())
+
+        return predictions
+
+
+def train_ride_models(X_train, y_train, clusters=None, rides=None, router=None, max_depth=None, workers=None,
+                      engine="forest"):
+    """
+        Train one pipeline per ride (or ride cluster), with the shards fitted in parallel processes
+
+        Parameters
+        ----------
+        X_train: DataFrame
+            Clean feature DataFrame ready for pipeline transformation & fitting
+        y_train: Series
+            Clean targets list ready for pipeline fitting
+        clusters: dictionary
+            Optional ride name -> cluster name mapping (one model per cluster), names in any case
+        rides: list
+            Only (re)train the shards of these rides (names in any case, see dataset.normalizeRideName)
+        router: RideRouter
+            Existing router to update - shards that are not retrained are kept as they are
+        max_depth: int
+            Maximum depth of the trees of every sub-model (default: RIDE_MAX_DEPTH for forests, unlimited
+            for boosting)
+        workers: int
+            Number of shards fitted at the same time (default: all cores)
+        engine: string
+            Regressor of every sub-model (see pipeline_train)
+
+        Returns
+        -------
+        router: RideRouter
+            Router over the fitted sub-models
+
+    """
+    if max_depth is None and engine == "forest":
+        max_depth = RIDE_MAX_DEPTH
+
+    # the ride columns hold the cleaned (lowercased) ride names
+    if clusters is not None:
+        clusters = {normalizeRideName(ride): cluster for ride, cluster in clusters.items()}
+    if router is None:
+        router = RideRouter(clusters=clusters)
+    elif clusters is not None and clusters != router.clusters:
+        raise ValueError("Ride clusters differ from the clusters of the router being updated")
+
+    shards = ride_shards(X_train, router.clusters)
+    keys = list(dict.fromkeys(shards.tolist()))
+    if rides is not None:
+        wanted = {router.clusters.get(ride, ride) for ride in map(normalizeRideName, rides)}
+        missing = sorted(wanted.difference(keys))
+        if missing:
+            raise ValueError(f"No training rows for rides {missing}")
+        keys = [key for key in keys if key in wanted]
+
+    workers = workers or min(len(keys), os.cpu_count())
+    # split the cores between the shards being fitted at the same time
+    n_jobs = max(1, os.cpu_count() // max(workers, 1))
+
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = []
+        for key in keys:
+            rows = np.flatnonzero(shards == key)
+            futures.append(executor.submit(_fit_shard, key, X_train.iloc[rows], y_train.iloc[rows],
+                                           max_depth, n_jobs, engine))
+        for future in futures:
+            key, model = future.result()
+            print(f"TRAINED {key}")
+            router.models[key] = model
+
+    return router
@@ -0,0 +1,159 @@
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+
+from pipeline_train import preprocessing_steps, make_regressor
+from model_arguments import training_matrix_arguments as add_arguments
+
+
+def build_training_matrix(input_dir, matrix_dir, dtypes):
+    """
+        Preprocess the final training data once and store it as a memory-mappable float32 matrix
+
+        The imputation/log transform & scaling steps of the pipeline are fitted on the whole training
+        set (exactly as pipeline_train does) and the resulting regressor input is written column by
+        column to a Fortran ordered (column contiguous) .npy file, next to the targets, the
+        fitted preprocessing steps and a sidecar json with the column index. The matrix is only
+        rebuilt when a source CSV is newer than it.
+
+        Parameters
+        ----------
+        input_dir: string
+            Final data directory (data/final)
+        matrix_dir: string
+            Directory for the matrix files
+        dtypes: dictionary
+            dtypes of the final clean dataframes
+
+        Returns
+        -------
+        index: dictionary
+            Sidecar column index (columns, rows, dtype & order of the matrix)
+
+    """
+    sources = [f"{input_dir}/X_train_posted_final.csv", f"{input_dir}/y_train_posted_final.csv"]
+    index_path = f"{matrix_dir}/columns.json"
+    if os.path.exists(index_path) and \
+            os.path.getmtime(index_path) >= max(os.path.getmtime(source) for source in sources):
+        with open(index_path) as json_file:
+            return json.load(json_file)
+
+    os.makedirs(matrix_dir, exist_ok=True)
+    X_train = pd.read_csv(sources[0], dtype=dtypes, compression='gzip').drop(columns=['Unnamed: 0'])
+    y_train = pd.read_csv(sources[1], dtype=dtypes, compression='gzip')["POSTED_WAIT"]
+
+    preprocessing = Pipeline(steps=preprocessing_steps())
+    X_transformed = preprocessing.fit_transform(X_train, y_train)
+    # the ColumnTransformer (fitted on the imputed DataFrame) names the matrix columns
+    columns = preprocessing.named_steps["preprocessor"].get_feature_names_out().tolist()
+    del X_train
+
+    matrix = np.lib.format.open_memmap(f"{matrix_dir}/X.npy", mode="w+", dtype="float32",
+                                       shape=X_transformed.shape, fortran_order=True)
+    # column by column - the passthrough columns make the transformed array an object array
+    for col in range(X_transformed.shape[1]):
+        matrix[:, col] = X_transformed[:, col].astype("float32")
+    matrix.flush()
+    del matrix, X_transformed
+
+    # targets stay float64 - the forest fits on float64 targets and they are a single column
+    np.save(f"{matrix_dir}/y.npy", y_train.to_numpy(dtype="float64"))
+    joblib.dump(preprocessing, f"{matrix_dir}/preprocessing.pkl")
+
+    index = {"columns": columns, "rows": len(y_train), "dtype": "float32", "order": "F"}
+    # written last - marks the matrix as complete
+    with open(index_path, "w") as json_file:
+        json.dump(index, json_file)
+
+    return index
+
+
+def open_training_matrix(matrix_dir):
+    """
+        Map the training matrix read-only - every process opening it shares the same pages
+
+        Returns
+        -------
+        X: memmap
+            (rows, columns) float32 feature matrix
+        y: memmap
+            float64 targets
+        index: dictionary
+            Sidecar column index
+
+    """
+    with open(f"{matrix_dir}/columns.json") as json_file:
+        index = json.load(json_file)
+
+    X = np.load(f"{matrix_dir}/X.npy", mmap_mode="r")
+    y = np.load(f"{matrix_dir}/y.npy", mmap_mode="r")
+
+    return X, y, index
+
+
+def train_from_matrix(matrix_dir, rows=None, n_jobs=-1, max_depth=None, engine="forest"):
+    """
+        Fit the regressor on the memory-mapped matrix and assemble the same pipeline as pipeline_train
+
+        Parameters
+        ----------
+        matrix_dir: string
+            Directory of the matrix (output of build_training_matrix)
+        rows: slice
+            Optional subset of the training rows (a slice keeps it a view of the mapped pages)
+        n_jobs: int
+            Number of cores used to fit the forest (-1: all cores)
+        max_depth: int
+            Maximum depth of the trees (default: the engine's, see pipeline_train.engine_max_depth)
+        engine: string
+            "forest" or "hgb" (see pipeline_train.make_regressor) - the boosting re-bins the float32
+            matrix on every fit, the matrix only saves re-reading & re-scaling the CSVs
+
+        Returns
+        -------
+        pipeline: sklearn Pipeline object
+            Fitted preprocessing steps followed by the fitted regressor
+
+    """
+    X, y, index = open_training_matrix(matrix_dir)
+    steps = joblib.load(f"{matrix_dir}/preprocessing.pkl").steps
+    if rows is not None:
+        X, y = X[rows], y[rows]
+
+    regressor = make_regressor(n_jobs, max_depth, engine)
+    # float32 is what the forest fits on, so the mapped matrix is used without a copy
+    regressor.fit(X, y)
+
+    return Pipeline(steps=steps + [("regressor", regressor)])
+
+
+def main(args):
+    """
+        Build the memory-mapped training matrix from the final data
+
+        Parameters
+        ----------
+        args: Namespace
+            Parsed command line arguments (see the __main__ block below or src/cli.py)
+    """
+    # load data types that match final clean dataframes
+    with open("src/models/dtypes.json") as json_file:
+        dtypes_final = json.load(json_file)
+
+    index = build_training_matrix(args.input, args.output, dtypes_final)
+    print(f"TRAINING MATRIX: {index['rows']} rows x {len(index['columns'])} columns")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # parse input and output arguments
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the stage modules import their neighbours by module name (they are also run as scripts)
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+for stage_dir in ["data", "models"]:
+    sys.path.insert(0, os.path.join(SRC_DIR, stage_dir))
+
+
+def make_final_data(rows=2000, seed=0):
+    """
+        Synthetic features & targets in the format of feature_engineering.py's final files
+    """
+    rng = np.random.default_rng(seed)
+    ride = rng.integers(0, 3, rows)
+    X = pd.DataFrame({f"Ride_name_{name}": ride == code for code, name in enumerate(["a", "b", "c"])})
+    X["a"] = rng.lognormal(3, 1, rows)  # skewed - log transformed by the pipeline
+    X["TL_rank"] = rng.normal(5, 1, rows)
+    X.loc[rng.random(rows) < 0.1, "TL_rank"] = np.nan
+    X["MKOPEN"] = pd.Series(rng.choice(["08:00", "09:00", None], rows), dtype="string")
+    X["YEAR"] = rng.integers(2015, 2022, rows)
+    X["HOUROFDAY"] = rng.integers(8, 23, rows)
+    y = pd.Series(10 + 20 * ride + X["HOUROFDAY"] + np.log(X["a"]) + rng.normal(0, 2, rows), name="POSTED_WAIT")
+
+    return X, y
+
+
+@pytest.fixture
+def final_data():
+    return make_final_data()
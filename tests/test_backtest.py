@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import cache_year_partitions, load_years, rolling_origin_folds, run_fold
+from conftest import make_final_data
+from pipeline_predict import StreamingRegressionMetrics
+from pipeline_train import pipeline_train
+
+DTYPES = {"MKOPEN": "string"}
+
+
+def write_final_data(input_dir):
+    """
+        Final train & test CSVs (feature_engineering.py format) of two synthetic splits
+    """
+    splits = {}
+    for split, seed in [("train", 0), ("test", 1)]:
+        X, y = make_final_data(rows=600, seed=seed)
+        X.to_csv(f"{input_dir}/X_{split}_posted_final.csv", compression='gzip')
+        y.to_frame().to_csv(f"{input_dir}/y_{split}_posted_final.csv", compression='gzip')
+        splits[split] = X.assign(POSTED_WAIT=y)
+    return splits
+
+
+def test_folds_expand_the_training_window():
+    assert rolling_origin_folds([2015, 2016, 2017, 2018], 2017) == [([2015, 2016], 2017), ([2015, 2016, 2017], 2018)]
+
+
+def test_first_year_without_training_data_is_skipped():
+    assert rolling_origin_folds([2015, 2016], 2015) == [([2015], 2016)]
+
+
+def test_no_fold_with_training_data_raises():
+    with pytest.raises(ValueError, match="No backtest fold"):
+        rolling_origin_folds([2015], 2015)
+
+
+def test_year_partitions_hold_every_row_of_the_year(tmp_path):
+    splits = write_final_data(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+
+    years = cache_year_partitions(str(tmp_path), cache_dir, DTYPES, chunksize=97)
+
+    everything = pd.concat([splits["train"], splits["test"]], ignore_index=True)
+    assert years == sorted(everything["YEAR"].unique().tolist())
+    for year in years:
+        expected = everything[everything["YEAR"] == year].reset_index(drop=True)
+        pd.testing.assert_frame_equal(pd.read_pickle(f"{cache_dir}/year{year}.pkl"), expected,
+                                      check_dtype=False)
+
+
+def test_year_partitions_are_rebuilt_only_for_newer_sources(tmp_path, monkeypatch):
+    write_final_data(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    years = cache_year_partitions(str(tmp_path), cache_dir, DTYPES)
+
+    def read_csv(*args, **kwargs):
+        raise AssertionError("up to date partitions were re-parsed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(pd, "read_csv", read_csv)
+        assert cache_year_partitions(str(tmp_path), cache_dir, DTYPES) == years
+
+    # a newer source CSV invalidates the cache
+    marker = os.path.getmtime(f"{cache_dir}/years.json")
+    os.utime(tmp_path / "y_test_posted_final.csv", (marker + 10, marker + 10))
+    os.remove(f"{cache_dir}/year{years[0]}.pkl")
+    assert cache_year_partitions(str(tmp_path), cache_dir, DTYPES) == years
+    assert os.path.exists(f"{cache_dir}/year{years[0]}.pkl")
+
+
+def test_load_years_concatenates_the_years_in_order(tmp_path):
+    write_final_data(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    cache_year_partitions(str(tmp_path), cache_dir, DTYPES)
+
+    X, y = load_years(cache_dir, [2017, 2015])
+
+    expected = pd.concat([pd.read_pickle(f"{cache_dir}/year{year}.pkl") for year in [2017, 2015]],
+                         ignore_index=True)
+    assert "POSTED_WAIT" not in X.columns
+    pd.testing.assert_frame_equal(X, expected.drop(columns=["POSTED_WAIT"]))
+    pd.testing.assert_series_equal(y, expected["POSTED_WAIT"])
+    assert X["YEAR"].tolist() == sorted(X["YEAR"], reverse=True)
+
+
+def test_run_fold_scores_the_test_year_of_a_pipeline_fit_on_the_train_years(tmp_path):
+    write_final_data(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    cache_year_partitions(str(tmp_path), cache_dir, DTYPES)
+
+    fold = run_fold(cache_dir, [2015, 2016, 2017], 2018)
+
+    X_train, y_train = load_years(cache_dir, [2015, 2016, 2017])
+    X_test, y_test = load_years(cache_dir, [2018])
+    expected = StreamingRegressionMetrics().update(
+        y_test, pipeline_train(X_train, y_train, n_jobs=1).predict(X_test)).result()
+    assert fold["engine"] == "forest"
+    assert fold["train_years"] == "2015-2017"
+    assert fold["test_year"] == 2018
+    assert (fold["train_rows"], fold["test_rows"]) == (len(X_train), len(X_test))
+    assert fold["model_mb"] > 0
+    for metric, value in expected.items():
+        assert np.isclose(fold[metric], value)
@@ -0,0 +1,60 @@
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn import metrics
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer
+
+from pipeline_predict import StreamingRegressionMetrics, predict_and_get_metrics_chunked
+from pipeline_train import pipeline_train, preprocessing_steps, make_regressor, impute_transform
+
+
+@pytest.fixture
+def test_files(final_data, tmp_path):
+    X, y = final_data
+    X.to_csv(tmp_path / "X.csv", compression="gzip")
+    y.to_frame().to_csv(tmp_path / "y.csv", compression="gzip")
+
+    return str(tmp_path / "X.csv"), str(tmp_path / "y.csv")
+
+
+def test_streaming_metrics_match_sklearn_on_large_targets():
+    rng = np.random.default_rng(0)
+    y_true = 1e9 + rng.normal(0, 1, 10000)
+    y_pred = y_true + rng.normal(0, 0.1, 10000)
+
+    streamed = StreamingRegressionMetrics()
+    for start in range(0, len(y_true), 999):
+        streamed.merge(StreamingRegressionMetrics().update(y_true[start:start + 999], y_pred[start:start + 999]))
+
+    result = streamed.result()
+    assert result["R-Squared"] == pytest.approx(metrics.r2_score(y_true, y_pred), rel=1e-9)
+    assert result["Mean Absolute Error (MAE)"] == pytest.approx(metrics.mean_absolute_error(y_true, y_pred))
+
+
+def test_chunked_scoring_matches_full_batch(final_data, test_files, tmp_path):
+    X_path, y_path = test_files
+    X = pd.read_csv(X_path, compression="gzip").drop(columns=["Unnamed: 0"])
+    y = final_data[1]
+    joblib.dump(pipeline_train(X, y, n_jobs=1), tmp_path / "model.pkl.gz", compress=("gzip", 5))
+
+    # 2000 rows in chunks of 333 - the short last chunk is scored like any other
+    regression_metrics, breakdown = predict_and_get_metrics_chunked(str(tmp_path / "model.pkl.gz"), X_path, y_path,
+                                                                     {}, chunksize=333, workers=1)
+
+    predictions = joblib.load(tmp_path / "model.pkl.gz").predict(X)
+    assert regression_metrics["Mean Absolute Error (MAE)"] == pytest.approx(metrics.mean_absolute_error(y, predictions))
+    assert regression_metrics["R-Squared"] == pytest.approx(metrics.r2_score(y, predictions))
+    assert set(breakdown["breakdown"]) == {"ride", "hour", "year"}
+
+
+def test_chunked_scoring_rejects_batch_dependent_pipelines(final_data, test_files, tmp_path):
+    X, y = final_data
+    steps = preprocessing_steps()
+    steps[0] = ("imputerAndLogTransformer", FunctionTransformer(impute_transform))
+    legacy = Pipeline(steps=steps + [("regressor", make_regressor(n_jobs=1))]).fit(X.copy(), y)
+    joblib.dump(legacy, tmp_path / "legacy.pkl.gz", compress=("gzip", 5))
+
+    with pytest.raises(ValueError, match="chunks"):
+        predict_and_get_metrics_chunked(str(tmp_path / "legacy.pkl.gz"), *test_files, {}, chunksize=333, workers=1)
@@ -0,0 +1,35 @@
+import subprocess
+import sys
+
+import pytest
+
+from conftest import SRC_DIR
+
+sys.path.insert(0, SRC_DIR)
+
+import cli  # noqa: E402
+
+
+@pytest.mark.parametrize("command", list(cli.STAGES))
+def test_every_stage_defines_its_arguments(command, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        cli.build_parser().parse_args([command, "--help"])
+
+    assert exit_info.value.code == 0
+    assert "usage: wait-times" in capsys.readouterr().out
+
+
+def test_stage_arguments_match_the_module_arguments():
+    args = cli.build_parser().parse_args(["update", "models/store", "--X", "X.csv", "--y", "y.csv"])
+
+    assert (args.store, args.X, args.y, args.new_trees) == ("models/store", "X.csv", "y.csv", 2)
+
+
+def test_help_does_not_import_the_stages():
+    # a fresh interpreter - the other tests already imported pandas & sklearn
+    script = ("import sys; sys.path.insert(0, sys.argv[1]); import cli\n"
+              "try:\n    cli.main(['predict', '--help'])\nexcept SystemExit:\n    pass\n"
+              "print(sorted({'pandas', 'sklearn', 'numpy'}.intersection(sys.modules)))")
+    result = subprocess.run([sys.executable, "-c", script, SRC_DIR], capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip().splitlines()[-1] == "[]"
@@ -0,0 +1,52 @@
+import pickle
+
+import numpy as np
+import pytest
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestRegressor
+
+from compact_model import CompactForest, compact_pipeline
+from pipeline_predict import predict_quantiles
+from pipeline_train import pipeline_train
+
+
+@pytest.fixture
+def regression_data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(500, 4))
+    y = X[:, 0] * 10 + rng.normal(size=500)
+
+    return X, y
+
+
+def test_from_forest_matches_forest(regression_data):
+    X, y = regression_data
+    forest = RandomForestRegressor(n_estimators=5, random_state=0).fit(X, y)
+    compact = CompactForest.from_forest(forest)
+
+    np.testing.assert_allclose(compact.predict(X.astype("float32")), forest.predict(X.astype("float32")), rtol=1e-5)
+    assert compact.n_estimators == 5 and compact.n_trees_ == 5
+
+
+def test_clone_and_set_params_keep_estimator_contract(regression_data):
+    X, y = regression_data
+    compact = CompactForest(n_estimators=4, max_depth=3, leaf_bits=8, n_jobs=1).fit(X, y)
+
+    unfitted = clone(compact)
+    assert unfitted.get_params() == compact.get_params()
+    assert not hasattr(unfitted, "value_")
+
+    deeper = unfitted.set_params(max_depth=6).fit(X, y)
+    assert deeper.depth_ > compact.depth_ == 3
+    assert compact.value_.dtype == np.uint8
+
+
+def test_pickled_compact_pipeline_predicts(final_data):
+    X, y = final_data
+    pipeline = pipeline_train(X.copy(), y, n_jobs=1)
+    compact, report = compact_pipeline(pipeline, X, y, max_depth=8, leaf_bits=16, mae_budget=0.5)
+
+    restored = pickle.loads(pickle.dumps(compact))
+    np.testing.assert_allclose(restored.predict(X), compact.predict(X))
+    assert predict_quantiles(restored, X).shape == (len(X), 4)
+    assert list(report["step"]) == ["original", "float32", "pruned", "leaves16bit", "tree_selection"]
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_cleaning
+from data_cleaning import (checkRideFiles, combineMetadataAndUpdate, combineMetadataStar, joinDimensions,
+                           readDimensionTables, writeDimensionTables)
+from helper import park_rides
+
+COVID_FILE = "data/raw/United_States_COVID-19_Cases_and_Deaths_by_State_over_Time.csv"
+
+
+def test_missing_ride_files_are_named(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "raw").mkdir(parents=True)
+    for file in park_rides["EP"]["ride_files"]:
+        (tmp_path / file).touch()
+
+    checkRideFiles(["EP"])
+
+    with pytest.raises(FileNotFoundError, match="HS: data/raw/alien_saucers.csv") as error:
+        checkRideFiles(["EP", "HS"])
+    assert "soarin" not in str(error.value)
+    assert "data/raw/toy_story_mania.csv" in str(error.value)
+
+
+def raw_tables(tmp_path):
+    """
+        Synthetic raw wait time files, data.world ride metadata, park metadata & covid cases in tmp_path
+    """
+    rng = np.random.default_rng(0)
+    (tmp_path / "data" / "raw").mkdir(parents=True)
+    days = pd.date_range("2019-12-28", "2020-01-08")
+    ride_files = []
+    for ride in ["x", "y"]:
+        datetimes = pd.Series(days[rng.integers(0, len(days), 40)]) + pd.to_timedelta(rng.integers(8, 22, 40),
+                                                                                       unit="h")
+        waits = pd.DataFrame({"date": datetimes.dt.strftime("%m/%d/%Y"), "datetime": datetimes.astype(str),
+                              "SACTMIN": np.where(rng.random(40) < 0.5, rng.integers(0, 60, 40), np.nan),
+                              "SPOSTMIN": rng.integers(5, 90, 40)})
+        ride_files.append(f"data/raw/{ride}.csv")
+        waits.to_csv(tmp_path / ride_files[-1], index=False)
+
+    data_world = pd.DataFrame({"Ride_name": ["Ride X", "Ride Y", "Other park ride"],
+                               "Park_location": ["MK", "MK", "EC"], "Park_area": ["Land", "Land", "World"],
+                               "Ride_type_all": ["slow", "thrill", "slow"], "Age_interest_all": ["all"] * 3,
+                               "Fast_pass": [1, 0, 1], "Ride_duration": [5.5, 3.0, 7.0],
+                               "Open_date": pd.to_datetime(["1971-10-01", "2019-12-30", "1982-10-01"]),
+                               "Age_of_ride_total": [48, 0, 37]})
+    # the park metadata misses the last two days of rides
+    park_metadata = pd.DataFrame({"DATE": days[:-2], "WDW_TICKET_SEASON": rng.choice(["peak", "value"], 10),
+                                  "WDWTICKETSEASON": "drop", "inSession": rng.integers(0, 100, 10),
+                                  "MKOPEN": "9:00", "HOLIDAYN": pd.Series(["nyd"] * 10).where(rng.random(10) < 0.5)})
+    # covid cases from before the first & without the last day of park metadata
+    covid = pd.DataFrame({"DATE": pd.date_range("2019-12-20", "2020-01-04").strftime("%m/%d/%Y"),
+                          "state": "FL", "new_case": rng.integers(0, 1000, 16)})
+    covid = pd.concat([covid, covid.assign(state="NY")])
+    covid.to_csv(tmp_path / COVID_FILE, index=False)
+
+    return ride_files, ["Ride X", "Ride Y"], data_world, park_metadata, covid
+
+
+def merge_reference(ride_files, ride_names, data_world, park_metadata, covid):
+    """
+        Wide metadata of every observation joined with hash merges like the original combineMetadataAndUpdate
+    """
+    mk_dw = data_world[data_world["Park_location"] == "MK"]
+    all_rides = pd.concat([pd.read_csv(file).assign(Ride_name=name).merge(mk_dw, how="left")
+                           for file, name in zip(ride_files, ride_names)], ignore_index=True)
+    all_rides["datetime"] = pd.to_datetime(all_rides["datetime"])
+    all_rides["date"] = pd.to_datetime(all_rides["date"])
+    all_rides["Age_of_ride_days"] = (all_rides["date"] - all_rides["Open_date"]).dt.days.astype("int16")
+    all_rides["Age_of_ride_years"] = all_rides["Age_of_ride_days"] / 365
+    all_rides = all_rides.drop(columns="Age_of_ride_total")
+    all_rides["DATE"] = all_rides["date"]
+
+    covid = covid.groupby("DATE")["new_case"].sum().reset_index()
+    covid["DATE"] = pd.to_datetime(covid["DATE"])
+    combined = all_rides.merge(park_metadata, how="left", on="DATE").merge(covid, on="DATE", how="left")
+    combined["new_case"] = combined["new_case"].fillna(0)
+
+    return combined.drop(columns=["DATE", "WDWTICKETSEASON", "Park_location", "Ride_type_all", "Age_interest_all"])
+
+
+def assert_same_rows(actual, expected):
+    assert sorted(actual.columns) == sorted(expected.columns)
+    pd.testing.assert_frame_equal(actual[expected.columns], expected, check_dtype=False)
+
+
+def test_star_schema_round_trip_matches_the_merged_metadata(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ride_files, ride_names, data_world, park_metadata, covid = raw_tables(tmp_path)
+    monkeypatch.setattr(data_cleaning, "loadParkMetadata", lambda: park_metadata.copy())
+    monkeypatch.setattr(data_cleaning, "loadDataWorld",
+                        lambda park: data_world[data_world["Park_location"] == park].reset_index(drop=True))
+    monkeypatch.setattr(data_cleaning, "dtypes", {"Park_area": "category"}, raising=False)
+    expected = merge_reference(ride_files, ride_names, data_world, park_metadata, covid)
+
+    assert_same_rows(combineMetadataAndUpdate(ride_files, ride_names), expected)
+
+    fact, park_day_dim, ride_dim = combineMetadataStar(ride_files, ride_names)
+    writeDimensionTables(str(tmp_path), park_day_dim, ride_dim)
+    park_day_dim, ride_dim = readDimensionTables(str(tmp_path))
+    combined = joinDimensions(fact, park_day_dim, ride_dim)
+    combined["Park_area"] = combined["Park_area"].astype(str)
+    assert_same_rows(combined, expected)
+
+    # only the requested dimension columns are joined
+    narrow = joinDimensions(fact, park_day_dim, ride_dim, columns=["inSession", "new_case"])
+    assert_same_rows(narrow, expected[list(fact.columns.drop(["RIDE_ID", "DATE_ID"])) +
+                                      ["Open_date", "inSession", "new_case", "Age_of_ride_days", "Age_of_ride_years"]])
@@ -0,0 +1,53 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataset import WaitTimeDataset
+
+RIDES = ["tomorrowland transit authority peoplemover", "space mountain"]
+
+
+@pytest.fixture
+def processed_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    for split in ["train", "test"]:
+        for year in range(2015, 2022):
+            times = pd.date_range(f"{year}-03-01 09:00", periods=40, freq="6h")
+            ride = rng.integers(0, len(RIDES), len(times))
+            df = pd.DataFrame({"date": times.normalize(), "datetime": times, "TL_rank": rng.normal(size=len(times))})
+            for code, name in enumerate(RIDES):
+                df[f"Ride_name_{name}"] = ride == code
+            df["POSTED_WAIT"] = rng.integers(5, 90, len(times))
+            df.to_csv(tmp_path / f"All_{split}_postedtimes{year}.csv", compression="gzip")
+    with open(tmp_path / "dtypes_parsed.json", "w") as json_file:
+        json.dump({}, json_file)
+
+    return str(tmp_path)
+
+
+def test_ride_filter_matches_the_cleaned_ride_names(processed_dir):
+    data = WaitTimeDataset(processed_dir).filter(ride="Tomorrowland Transit Authority PeopleMover ", years=[2019])
+    rows = data.collect()
+
+    expected = pd.concat([pd.read_csv(f"{processed_dir}/All_{split}_postedtimes2019.csv", compression="gzip")
+                          for split in ["train", "test"]], ignore_index=True)
+    expected = expected[expected[f"Ride_name_{RIDES[0]}"]]
+    assert len(rows) == len(expected) > 0
+    assert rows["POSTED_WAIT"].tolist() == expected["POSTED_WAIT"].tolist()
+
+
+def test_unknown_ride_raises(processed_dir):
+    with pytest.raises(ValueError, match="Rides without"):
+        WaitTimeDataset(processed_dir).filter(ride="Haunted Mansion").collect()
+
+
+def test_projection_and_date_pushdown(processed_dir):
+    data = WaitTimeDataset(processed_dir).filter(start="2018-03-02", end="2019-03-03", split="test")
+
+    assert data.files() == [("test", 2018), ("test", 2019)]
+    rows = data.select(["datetime", "POSTED_WAIT"]).collect()
+    assert list(rows.columns) == ["datetime", "POSTED_WAIT"]
+    assert rows["datetime"].min() >= pd.Timestamp("2018-03-02")
+    assert rows["datetime"].max() < pd.Timestamp("2019-03-04")
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from date_features import addCalendarFeatures, calendarTable, dateCodes, hourCodes, rideAgeDays
+
+
+def observations(rows=500, seed=0):
+    """
+        Ride observations: 5 minute timestamps over a few weeks around a year end, with missing timestamps
+    """
+    rng = np.random.default_rng(seed)
+    datetimes = pd.Series(pd.Timestamp("2019-12-20") + pd.to_timedelta(rng.integers(0, 30 * 288, rows) * 5,
+                                                                       unit="min"))
+    datetimes[rng.random(rows) < 0.05] = pd.NaT
+    return pd.DataFrame({"date": datetimes.dt.floor("D"), "datetime": datetimes})
+
+
+def test_date_codes_index_the_distinct_dates():
+    dates = observations()["date"]
+    codes, uniques = dateCodes(dates)
+
+    assert uniques.is_unique and not uniques.hasnans
+    assert (codes[dates.isna().to_numpy()] == -1).all()
+    pd.testing.assert_series_equal(pd.Series(uniques[codes[codes >= 0]]), dates.dropna().reset_index(drop=True),
+                                   check_names=False, check_freq=False)
+
+
+def test_calendar_features_match_the_per_row_datetime_accessors():
+    df = observations()
+    expected = df.copy()
+    expected["MONTHOFYEAR"] = expected["date"].dt.month.astype("Int8")
+    expected["YEAR"] = expected["date"].dt.year.astype("Int16")
+    expected["DAYOFYEAR"] = expected["date"].dt.dayofyear.astype("Int16")
+    expected["HOUROFDAY"] = expected["datetime"].dt.hour.astype("Int8")
+
+    pd.testing.assert_frame_equal(addCalendarFeatures(df), expected)
+    assert list(calendarTable(pd.DatetimeIndex([])).columns) == ["MONTHOFYEAR", "YEAR", "DAYOFYEAR"]
+
+
+def test_ride_age_matches_the_timedelta_days():
+    df = observations().dropna()
+    open_dates = pd.Series(pd.to_datetime(["1971-10-01", "2019-12-25", "1989-05-01"]))
+    df["Open_date"] = open_dates[np.arange(len(df)) % 3].to_numpy()
+
+    expected = (df["date"] - df["Open_date"]).dt.days.astype("int16").to_numpy()
+    np.testing.assert_array_equal(rideAgeDays(df["date"], df["Open_date"]), expected)
+
+    with pytest.raises(ValueError, match="Open_date on every row"):
+        rideAgeDays(observations()["date"], observations()["date"])
+
+
+def test_hour_codes_gather_the_same_weather_as_the_merge_on_the_hour():
+    df = observations()
+    weather = pd.DataFrame({"round_hour": pd.date_range("2019-12-20", "2020-01-10", freq="h"),
+                            "Temperature": np.arange(505.0)})
+    weather = weather.sample(frac=0.8, random_state=0)  # hours without a weather report
+
+    merged = df.assign(round_hour=df["datetime"].dt.floor("h")).merge(weather, on="round_hour", how="left")
+
+    codes, hours = hourCodes(df["datetime"])
+    hourly = weather.set_index("round_hour").reindex(hours).reset_index(drop=True)
+    gathered = pd.concat([df, hourly.reindex(codes).reset_index(drop=True)], axis=1)
+
+    pd.testing.assert_frame_equal(gathered, merged.drop(columns="round_hour"))
+    assert hourCodes(pd.Series([], dtype="datetime64[ns]"))[0].size == 0
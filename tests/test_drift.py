@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from drift import CategorySketch, FeatureSketches, NumericSketch, compare_sketches, population_stability_index
+
+
+def test_numeric_sketch_merges_like_one_pass():
+    values = np.random.default_rng(0).normal(100, 5, 5000)
+    whole = NumericSketch().update(values)
+    merged = whole.empty_like()
+    for start in range(0, len(values), 700):
+        merged.merge(whole.empty_like().update(values[start:start + 700]))
+
+    assert merged.counts.tolist() == whole.counts.tolist()
+    assert merged.mean == pytest.approx(values.mean())
+    assert merged.m2 / merged.n == pytest.approx(values.var())
+    assert whole.quantile(0.5) == pytest.approx(np.median(values), abs=0.5)
+
+    restored = NumericSketch.from_dict(whole.to_dict())
+    assert restored.to_dict() == whole.to_dict()
+
+
+def test_psi():
+    counts = np.array([10.0, 20.0, 30.0])
+    assert population_stability_index(counts, counts * 3) == pytest.approx(0.0)
+    assert population_stability_index(counts, counts[::-1]) > 0.2
+
+
+def test_current_sketch_buckets_categories_like_the_baseline():
+    baseline = CategorySketch(max_categories=2).update(pd.Series(["a", "b", "c", "a", "b", "c"]))
+    assert baseline.counts == {"a": 2, "b": 2, "__other__": 2}
+
+    # same values, new value first - without the baseline's categories "c" would take a slot
+    current = baseline.empty_like().update(pd.Series(["c", "c", "b", "a", "b", "a"]))
+    assert current.counts == baseline.counts
+
+    restored = CategorySketch.from_dict(current.to_dict()).update(pd.Series(["d", None]))
+    assert restored.counts["__other__"] == 3 and restored.missing == 1
+
+
+def test_compare_sketches_flags_drifted_features():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame({"wait": rng.normal(30, 5, 2000), "open": rng.choice(["08:00", "09:00"], 2000)})
+    baseline = FeatureSketches().update(X)
+
+    same = baseline.empty_like().update(X.sample(frac=1, random_state=0).assign(extra=1.0))
+    assert "extra" not in same.sketches
+    assert not compare_sketches(baseline, same)["drifted"].any()
+
+    shifted = baseline.empty_like().update(X.assign(wait=X["wait"] + 10, open="08:00"))
+    report = compare_sketches(baseline, shifted).set_index("feature")
+    assert report["drifted"].all()
+
+    with pytest.raises(ValueError, match="bin edges"):
+        compare_sketches(baseline, FeatureSketches().update(X.assign(wait=X["wait"] * 2)))
+
+    report = compare_sketches(baseline, FeatureSketches({"wait": baseline.sketches["wait"].empty_like()}))
+    assert report.set_index("feature")["missing_in_current"].all()
@@ -0,0 +1,28 @@
+import pandas as pd
+import pytest
+
+from feature_selection import select_features
+
+
+@pytest.fixture
+def importances():
+    return pd.Series({"a": 0.1, "b": 0.6, "c": 0.3, "d": -0.05})
+
+
+def test_top_k_and_cumulative(importances):
+    assert select_features(importances, top_k=2) == ["b", "c"]
+    assert select_features(importances, cumulative=0.85) == ["b", "c"]
+    assert select_features(importances, top_k=1, cumulative=0.85) == ["b"]
+
+
+def test_a_selection_rule_is_required(importances):
+    with pytest.raises(ValueError, match="top_k and/or cumulative"):
+        select_features(importances)
+
+
+def test_cumulative_needs_a_positive_importance():
+    importances = pd.Series({"a": 0.0, "b": -0.2})
+
+    with pytest.raises(ValueError, match="positive importance"):
+        select_features(importances, cumulative=0.9)
+    assert select_features(importances, top_k=1) == ["a"]
@@ -0,0 +1,76 @@
+import os
+
+import pandas as pd
+
+from frame_cache import FrameCache, frameBytes
+
+
+def frame(rows=1000):
+    return pd.DataFrame({"a": range(rows), "b": [1.5] * rows})
+
+
+def write_source(path, text="1"):
+    with open(path, "w") as source:
+        source.write(text)
+
+    return str(path)
+
+
+def test_hits_return_copies_of_the_cached_frames(tmp_path):
+    cache = FrameCache()
+    source = write_source(tmp_path / "source.csv")
+    loaded = cache.get(("frame",), [source], lambda: frame())
+
+    loaded.fillna(0, inplace=True)
+    loaded.loc[0, "b"] = -1.0
+    loaded.drop(columns=["a"], inplace=True)
+    again = cache.get(("frame",), [source], lambda: frame())
+
+    pd.testing.assert_frame_equal(again, frame())
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_changed_source_is_reloaded(tmp_path):
+    cache = FrameCache()
+    source = write_source(tmp_path / "source.csv")
+    cache.get(("frame",), [source], lambda: frame(10))
+
+    write_source(source, "changed")
+    reloaded = cache.get(("frame",), [source], lambda: frame(20))
+
+    assert len(reloaded) == 20
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_least_recently_used_frames_are_evicted(tmp_path):
+    source = write_source(tmp_path / "source.csv")
+    cache = FrameCache(max_bytes=int(frameBytes(frame()) * 2.5))
+    for key in ["a", "b"]:
+        cache.get((key,), [source], frame)
+    cache.get(("a",), [source], frame)
+    cache.get(("c",), [source], frame)
+
+    assert list(cache.entries) == [("a",), ("c",)]
+    assert cache.nbytes <= cache.max_bytes
+
+    # larger than the whole budget - returned but never kept
+    cache.get(("big",), [source], lambda: frame(10000))
+    assert ("big",) not in cache.entries
+
+
+def test_snapshots_survive_a_new_cache(tmp_path):
+    source = write_source(tmp_path / "source.csv")
+    snapshots = str(tmp_path / "snapshots")
+    FrameCache(snapshot_dir=snapshots).get(("frame", None), [source], lambda: (frame(), frame(5)))
+
+    cache = FrameCache(snapshot_dir=snapshots)
+    loaded = cache.get(("frame", None), [source], lambda: 1 / 0)
+    pd.testing.assert_frame_equal(loaded[1], frame(5))
+    assert (cache.snapshot_hits, cache.misses) == (1, 0)
+
+    # a changed source invalidates the snapshot too
+    write_source(source, "changed")
+    os.utime(source, (0, 0))
+    cache = FrameCache(snapshot_dir=snapshots)
+    cache.get(("frame", None), [source], lambda: (frame(), frame(5)))
+    assert (cache.snapshot_hits, cache.misses) == (0, 1)
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from feature_engineering import grouped_backfill, ride_codes, ride_day_index
+
+
+def observations(rows=600, seed=0):
+    rng = np.random.default_rng(seed)
+    ride = rng.integers(-1, 3, rows)  # -1: a ride whose column was dropped
+    df = pd.DataFrame({f"Ride_name_{name}": ride == code for code, name in enumerate(["a", "b", "c"])})
+    # a few days of 5 minute observations, in random order
+    df["datetime"] = pd.Timestamp("2019-03-01 08:00") + pd.to_timedelta(rng.integers(0, 4 * 288, rows) * 5, "min")
+    for col in ["x", "y", "z"]:
+        df[col] = rng.normal(size=rows)
+        df.loc[rng.random(rows) < 0.4, col] = np.nan
+
+    return df
+
+
+def reference_bfill(df, columns):
+    # next observation of the same ride on the same day - rows without a ride are never filled
+    codes, _ = ride_codes(df)
+    keys = pd.DataFrame({"ride": np.where(codes == -1, -1 - np.arange(len(df)), codes),
+                         "day": df["datetime"].dt.normalize(), "time": df["datetime"]}, index=df.index)
+    ordered = pd.concat([keys, df[columns]], axis=1).sort_values(["ride", "day", "time"], kind="stable")
+    filled = ordered.groupby(["ride", "day"])[columns].bfill()
+
+    return filled.reindex(df.index)
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 16])
+def test_matches_grouped_bfill(block_size):
+    df = observations()
+    expected = reference_bfill(df, ["x", "y", "z"])
+
+    filled = grouped_backfill(df.copy(), *ride_day_index(df), columns=["x", "y", "z"], block_size=block_size)
+    pd.testing.assert_frame_equal(filled[["x", "y", "z"]], expected)
+
+
+def test_rows_without_a_ride_are_not_filled_from_other_rides():
+    df = observations()
+    unknown = ride_codes(df)[0] == -1
+    filled = grouped_backfill(df.copy(), *ride_day_index(df), columns=["x"])
+
+    pd.testing.assert_series_equal(filled.loc[unknown, "x"], df.loc[unknown, "x"])
+
+
+def test_split_is_filled_on_its_own_rows():
+    df = observations()
+    train = np.random.default_rng(1).random(len(df)) < 0.7
+    X_train = df[train]
+
+    filled = grouped_backfill(X_train.copy(), *ride_day_index(X_train), columns=["x", "y"])
+    pd.testing.assert_frame_equal(filled[["x", "y"]], reference_bfill(X_train, ["x", "y"]))
+    # the full data would fill more train rows - from observations of the test split
+    assert filled["x"].isna().sum() > reference_bfill(df, ["x"])[train]["x"].isna().sum()
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from feature_engineering import (RideHistoryBuffer, add_history_features, data_preparation_for_pipeline,
+                                 select_schema_columns)
+
+
+def test_lags_come_from_the_previous_observation_across_splits():
+    rng = np.random.default_rng(0)
+    times = pd.date_range("2019-06-01 09:00", periods=200, freq="5min")
+    data = pd.DataFrame({"Unnamed: 0": np.arange(200), "date": times.normalize(), "datetime": times,
+                         "Ride_name_a": True, "POSTED_WAIT": rng.integers(5, 90, 200).astype("float64")})
+    data = data.sample(frac=1, random_state=1).reset_index(drop=True)
+    train, test = data.iloc[:130].reset_index(drop=True), data.iloc[130:].reset_index(drop=True)
+
+    X_train, X_test, y_train, y_test = data_preparation_for_pipeline(
+        train.drop(columns=["POSTED_WAIT"]), test.drop(columns=["POSTED_WAIT"]),
+        train["POSTED_WAIT"], test["POSTED_WAIT"], history_features=True)
+
+    previous = data.set_index("datetime")["POSTED_WAIT"].sort_index().shift(1)
+    assert np.allclose(X_test["LAG_1"], previous[test["datetime"]].to_numpy(), equal_nan=True)
+    assert np.allclose(X_train["LAG_1"], previous[train["datetime"]].to_numpy(), equal_nan=True)
+    assert y_test.equals(test["POSTED_WAIT"])
+
+
+def test_streaming_buffer_matches_the_batch_features():
+    rng = np.random.default_rng(0)
+    data = []
+    for ride in ["a", "b"]:
+        # irregular 5 minute observations over 10 days
+        steps = rng.choice(np.arange(12 * 24 * 10), 1200, replace=False)
+        times = pd.Timestamp("2019-06-01") + pd.to_timedelta(np.sort(steps) * 5, unit="min")
+        data.append(pd.DataFrame({"ride": ride, "datetime": times,
+                                  "POSTED_WAIT": rng.integers(5, 90, len(times)).astype("float64")}))
+    data = pd.concat(data).sample(frac=1, random_state=0).reset_index(drop=True)
+    for ride in ["a", "b"]:
+        data[f"Ride_name_{ride}"] = data["ride"] == ride
+
+    expected = add_history_features(data.copy())
+
+    # small buffer - older observations are overwritten but a week of history is kept
+    buffer = RideHistoryBuffer(capacity=1100)
+    streamed = {}
+    for row in data.sort_values("datetime").itertuples():
+        streamed[row.Index] = buffer.features(row.ride, row.datetime)
+        buffer.update(row.ride, row.datetime, row.POSTED_WAIT)
+    streamed = pd.DataFrame.from_dict(streamed, orient="index").sort_index()
+
+    pd.testing.assert_frame_equal(streamed, expected[streamed.columns])
+
+
+def test_schema_with_history_columns_needs_history_features():
+    X = pd.DataFrame({"a": [1.0], "HOUROFDAY": [9]})
+
+    assert list(select_schema_columns(X, ["HOUROFDAY", "a"]).columns) == ["HOUROFDAY", "a"]
+    with pytest.raises(ValueError, match=r"\['LAG_1'\] - schemas selected from history features need --history"):
+        select_schema_columns(X, ["a", "LAG_1"])
+    with pytest.raises(ValueError, match=r"\['LAG_1'\]$"):
+        select_schema_columns(X, ["a", "LAG_1"], history_features=True)
@@ -0,0 +1,122 @@
+import json
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer
+
+from incremental import MANIFEST, init_store, read_manifest, update_forest, update_store
+from pipeline_train import pipeline_train, preprocessing_steps, make_regressor, impute_transform
+
+
+@pytest.fixture
+def base_model(final_data, tmp_path):
+    X, y = final_data
+    path = str(tmp_path / "pipeline.pkl.gz")
+    joblib.dump(pipeline_train(X.copy(), y, n_jobs=1), path, compress=("gzip", 5))
+
+    return path
+
+
+def test_updates_draw_new_seeds_after_retiring_trees(final_data, base_model, tmp_path):
+    X, y = final_data
+    store = str(tmp_path / "store")
+    init_store(store, base_model)
+    for _ in range(2):
+        update_store(store, X.iloc[:500], y.iloc[:500], new_trees=2, max_trees=10)
+
+    forest = joblib.load(read_manifest(store)["versions"][-1]["path"]).steps[-1][1]
+    seeds = [tree.random_state for tree in forest.estimators_]
+    assert len(forest.estimators_) == 10
+    assert len(set(seeds)) == len(seeds)
+
+
+def test_update_retires_the_oldest_trees(final_data, base_model):
+    X, y = final_data
+    pipeline = joblib.load(base_model)
+    forest = pipeline.steps[-1][1]
+    old_trees = list(forest.estimators_)
+
+    assert update_forest(pipeline, X.iloc[:500], y.iloc[:500], new_trees=3, max_trees=11) == 2
+    assert forest.estimators_[:8] == old_trees[2:]
+    assert len(forest.estimators_) == forest.n_estimators == 11
+
+    assert update_forest(pipeline, X.iloc[:500], y.iloc[:500], new_trees=1) == 0
+    assert len(forest.estimators_) == 12
+
+
+def test_manifest_tracks_the_version_of_every_tree(final_data, base_model, tmp_path):
+    X, y = final_data
+    store = str(tmp_path / "store")
+    init_store(store, base_model)
+    update_store(store, X.iloc[:500], y.iloc[:500], new_trees=2, max_trees=10)
+    update_store(store, X.iloc[500:1000], y.iloc[500:1000], new_trees=3, max_trees=11)
+
+    versions = read_manifest(store)["versions"]
+    assert [entry["retired_trees"] for entry in versions] == [0, 2, 2]
+    assert versions[1]["tree_versions"] == [1] * 8 + [2] * 2
+    assert versions[2]["tree_versions"] == [1] * 6 + [2] * 2 + [3] * 3
+    assert len(joblib.load(versions[2]["path"]).steps[-1][1].estimators_) == 11
+
+
+def test_new_trees_are_seeded_by_the_version(final_data, base_model, tmp_path):
+    X, y = final_data
+    store = str(tmp_path / "store")
+    init_store(store, base_model)
+    update_store(store, X.iloc[:500], y.iloc[:500])
+    forest = joblib.load(read_manifest(store)["versions"][-1]["path"]).steps[-1][1]
+    assert forest.random_state == 2
+
+    # the same update outside the store draws the same trees with the version as seed, other trees without
+    for random_state, same in [(2, True), (3, False)]:
+        pipeline = joblib.load(base_model)
+        update_forest(pipeline, X.iloc[:500], y.iloc[:500], random_state=random_state)
+        seeds = [tree.random_state for tree in pipeline.steps[-1][1].estimators_[-2:]]
+        assert (seeds == [tree.random_state for tree in forest.estimators_[-2:]]) == same
+
+
+def test_existing_store_is_not_reset(base_model, tmp_path):
+    store = str(tmp_path / "store")
+    init_store(store, base_model)
+
+    with pytest.raises(FileExistsError):
+        init_store(store, base_model)
+    assert read_manifest(store)["latest"] == 1
+
+
+def test_update_checks_the_preprocessing(final_data, base_model, tmp_path):
+    X, y = final_data
+    store = str(tmp_path / "store")
+    init_store(store, base_model)
+
+    # a version pickle replaced by a pipeline with other preprocessing statistics
+    other = pipeline_train(X.iloc[:1000].copy(), y.iloc[:1000], n_jobs=1)
+    joblib.dump(other, read_manifest(store)["versions"][-1]["path"], compress=("gzip", 5))
+    with pytest.raises(ValueError, match="does not match"):
+        update_store(store, X, y)
+
+
+def test_changed_preprocessing_hash_is_rejected(final_data, base_model, tmp_path):
+    X, y = final_data
+    store = str(tmp_path / "store")
+    init_store(store, base_model)
+    manifest = read_manifest(store)
+    manifest["versions"][-1]["preprocessing"] = "0" * 16
+    with open(f"{store}/{MANIFEST}", "w") as json_file:
+        json.dump(manifest, json_file)
+
+    with pytest.raises(ValueError, match="does not match the manifest"):
+        update_store(store, X, y)
+    assert read_manifest(store)["latest"] == 1
+
+
+def test_batch_dependent_pipelines_are_rejected(final_data, tmp_path):
+    X, y = final_data
+    steps = preprocessing_steps()
+    steps[0] = ("imputerAndLogTransformer", FunctionTransformer(impute_transform))
+    legacy = Pipeline(steps=steps + [("regressor", make_regressor(n_jobs=1))]).fit(X.copy(), y)
+    joblib.dump(legacy, tmp_path / "legacy.pkl.gz", compress=("gzip", 5))
+
+    with pytest.raises(ValueError, match="fitted preprocessing"):
+        init_store(str(tmp_path / "store"), str(tmp_path / "legacy.pkl.gz"))
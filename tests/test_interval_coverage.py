@@ -0,0 +1,17 @@
+import numpy as np
+import pandas as pd
+
+from pipeline_predict import interval_coverage, quantile_column
+
+
+def test_intervals_pair_quantiles_that_are_not_exact_complements():
+    quantiles = [0.07, 0.93]
+    y_true = np.arange(100, dtype="float64")
+    predictions = pd.DataFrame({quantile_column(0.07): y_true - 1, quantile_column(0.93): y_true + 1})
+
+    report = interval_coverage(y_true, predictions, quantiles)
+    interval = report[report["range"] == "q7 - q93"]
+
+    assert len(interval) == 1
+    assert interval["nominal"].iloc[0] == np.float64(1 - 2 * 0.07)
+    assert interval["observed"].iloc[0] == 1.0 and interval["mean_width"].iloc[0] == 2.0
@@ -0,0 +1,46 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from materialize import materialize
+
+
+def write_source(path, rows):
+    pd.DataFrame({"DATE": ["2020-01-01"] * rows, "new_case": range(rows)}).to_csv(path, index=False)
+
+
+def test_table_is_built_once_until_the_source_changes(tmp_path):
+    source = str(tmp_path / "source.csv")
+    write_source(source, 3)
+    builds = []
+
+    def build():
+        builds.append(1)
+        return pd.read_csv(source)
+
+    first = materialize("table", [source], build, cache_dir=str(tmp_path / "cache"))
+    second = materialize("table", [source], build, cache_dir=str(tmp_path / "cache"))
+    assert len(builds) == 1 and first.equals(second)
+
+    write_source(source, 5)
+    assert len(materialize("table", [source], build, cache_dir=str(tmp_path / "cache"))) == 5
+    assert len(builds) == 2
+
+
+def test_concurrent_cold_materialization(tmp_path):
+    source = str(tmp_path / "source.csv")
+    write_source(source, 1000)
+    cache_dir = str(tmp_path / "cache")
+
+    def build():
+        time.sleep(0.05)
+        return pd.read_csv(source)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        tables = list(executor.map(lambda _: materialize("shared", [source], build, cache_dir=cache_dir), range(8)))
+
+    assert all(table.equals(tables[0]) for table in tables)
+    assert sorted(os.listdir(cache_dir)) == ["shared.json", "shared.pkl"]
+    assert pd.read_pickle(os.path.join(cache_dir, "shared.pkl")).equals(tables[0])
@@ -0,0 +1,47 @@
+import pandas as pd
+
+from dataset import partitionFile
+from partition_writer import writePartitions
+
+
+def frame():
+    return pd.DataFrame({"year": [2019, 2020, 2019, 2021], "POSTED_WAIT": [10, 20, 30, 40]})
+
+
+def test_csv_codec_is_byte_identical_to_to_csv(tmp_path):
+    df = frame()
+    writePartitions(df, df["year"], str(tmp_path / "part{key}"), codec="csv", index=False)
+
+    df[df["year"] == 2019].to_csv(tmp_path / "expected.csv", index=False)
+    assert (tmp_path / "part2019.csv").read_bytes() == (tmp_path / "expected.csv").read_bytes()
+    assert partitionFile(str(tmp_path / "part2019")) == (str(tmp_path / "part2019.csv"), None)
+
+
+def test_switching_codec_replaces_the_partition(tmp_path):
+    df = frame()
+    writePartitions(df, df["year"], str(tmp_path / "part{key}"), codec="csv", index=False)
+    writePartitions(df.assign(POSTED_WAIT=df["POSTED_WAIT"] + 1), df["year"], str(tmp_path / "part{key}"),
+                    partitions=[2019, 2020, 2021, 2022], codec="gzip", index=False)
+
+    path, compression = partitionFile(str(tmp_path / "part2019"))
+    assert compression == "gzip"
+    assert pd.read_csv(path, compression=compression)["POSTED_WAIT"].tolist() == [11, 31]
+    # keys without rows are written as header only files
+    path, compression = partitionFile(str(tmp_path / "part2022"))
+    assert pd.read_csv(path, compression=compression).empty
+
+
+def test_no_partitions_writes_nothing(tmp_path):
+    df = frame().iloc[:0]
+
+    assert writePartitions(df, df["year"], str(tmp_path / "part{key}")) == []
+    assert not list(tmp_path.iterdir())
+
+
+def test_partitions_are_written_in_order_with_fewer_workers(tmp_path):
+    df = frame()
+    paths = writePartitions(df, df["year"], str(tmp_path / "part{key}"), codec="csv", executor="process",
+                            max_workers=1, index=False)
+
+    assert paths == [str(tmp_path / f"part{year}.csv") for year in [2019, 2020, 2021]]
+    assert pd.read_csv(paths[2])["POSTED_WAIT"].tolist() == [40]
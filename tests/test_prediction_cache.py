@@ -0,0 +1,53 @@
+import numpy as np
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer
+
+from pipeline_train import pipeline_train, preprocessing_steps, make_regressor, impute_transform
+from prediction_cache import PredictionCache
+
+
+def test_pipeline_scores_rows_independently_of_the_batch(final_data):
+    X, y = final_data
+    pipeline = pipeline_train(X, y, n_jobs=1)
+
+    full = pipeline.predict(X)
+    assert np.allclose(pipeline.predict(X.iloc[:1]), full[:1])
+    assert np.allclose(pipeline.predict(X.iloc[5:8]), full[5:8])
+
+
+def test_warm_cache_with_few_new_rows(final_data):
+    X, y = final_data
+    pipeline = pipeline_train(X.iloc[:1500], y.iloc[:1500], n_jobs=1)
+    cache = PredictionCache(pipeline, "v1")
+
+    cache.predict(X.iloc[1500:1900])
+    predictions = cache.predict(X.iloc[1500:1903])
+
+    assert cache.stats()["misses"] == 403
+    assert np.allclose(predictions, pipeline.predict(X.iloc[1500:1903]))
+
+
+def test_batch_dependent_pipeline_scores_misses_in_the_full_batch(final_data):
+    X, y = final_data
+    steps = preprocessing_steps()
+    steps[0] = ("imputerAndLogTransformer", FunctionTransformer(impute_transform))
+    legacy = Pipeline(steps=steps + [("regressor", make_regressor(n_jobs=1))]).fit(X.copy(), y)
+    cache = PredictionCache(legacy, "legacy")
+
+    cache.predict(X.iloc[:400])
+    batch = X.iloc[:403]
+    predictions = cache.predict(batch)
+
+    assert np.allclose(predictions[400:], legacy.predict(batch.copy())[400:])
+
+
+def test_disk_tier_is_shared_across_caches(final_data, tmp_path):
+    X, y = final_data
+    pipeline = pipeline_train(X, y, n_jobs=1)
+    first = PredictionCache(pipeline, "v1", disk_path=str(tmp_path / "cache.sqlite"))
+    expected = first.predict(X.iloc[:50])
+    first.close()
+
+    second = PredictionCache(pipeline, "v1", disk_path=str(tmp_path / "cache.sqlite"))
+    assert np.allclose(second.predict(X.iloc[:50]), expected)
+    assert second.stats()["disk_hits"] == 50 and second.stats()["misses"] == 0
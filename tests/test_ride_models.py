@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from pipeline_predict import predict_quantiles
+from ride_models import RIDE_MAX_DEPTH, RideRouter, ride_shards, train_ride_models
+
+
+@pytest.fixture
+def router(final_data):
+    X, y = final_data
+    return train_ride_models(X, y, workers=1)
+
+
+def test_router_routes_rows_to_their_ride_model(final_data, router):
+    X, _ = final_data
+    shards = ride_shards(X, {})
+    predictions = router.predict(X)
+
+    assert sorted(router.models) == ["a", "b", "c"]
+    for ride, model in router.models.items():
+        rows = np.flatnonzero(shards == ride)
+        np.testing.assert_allclose(predictions[rows], model.predict(X.iloc[rows].copy()))
+        assert model.steps[-1][1].max_depth == RIDE_MAX_DEPTH
+
+
+def test_rides_without_a_model_need_a_fallback(final_data, router):
+    X, _ = final_data
+    partial = RideRouter(models={"a": router.models["a"]})
+
+    with pytest.raises(ValueError, match="No model for rides"):
+        partial.predict(X)
+
+    partial.fallback = router.models["b"]
+    rows = np.flatnonzero(ride_shards(X, {}) != "a")
+    np.testing.assert_allclose(partial.predict(X)[rows], router.models["b"].predict(X.iloc[rows].copy()))
+
+
+def test_clusters_share_a_model(final_data):
+    X, y = final_data
+    router = train_ride_models(X, y, clusters={" A ": "ab", "B": "ab"}, workers=1)
+
+    assert sorted(router.models) == ["ab", "c"]
+    assert router.clusters == {"a": "ab", "b": "ab"}
+
+
+def test_retrain_rides_only_replaces_their_models(final_data, router):
+    X, y = final_data
+    kept = dict(router.models)
+    updated = train_ride_models(X, y, rides=["B "], router=router, workers=1)
+
+    assert updated.models["a"] is kept["a"] and updated.models["c"] is kept["c"]
+    assert updated.models["b"] is not kept["b"]
+
+    with pytest.raises(ValueError, match="No training rows"):
+        train_ride_models(X, y, rides=["space mountain"], router=router, workers=1)
+
+
+def test_quantiles_reject_routers(final_data, router):
+    with pytest.raises(ValueError, match="single forest pipeline"):
+        predict_quantiles(router, final_data[0])
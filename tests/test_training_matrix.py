@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from pipeline_train import pipeline_train, make_regressor
+from training_matrix import build_training_matrix, train_from_matrix
+
+
+@pytest.fixture
+def matrix_dir(final_data, tmp_path):
+    X, y = final_data
+    X.to_csv(tmp_path / "X_train_posted_final.csv", compression="gzip")
+    y.to_frame().to_csv(tmp_path / "y_train_posted_final.csv", compression="gzip")
+    build_training_matrix(str(tmp_path), str(tmp_path / "matrix"), {"MKOPEN": "string"})
+
+    return str(tmp_path / "matrix")
+
+
+def test_engine_depth_defaults():
+    assert make_regressor(engine="forest").max_depth == 50
+    assert make_regressor(engine="hgb").max_depth is None
+    assert make_regressor(max_depth=7, engine="hgb").max_depth == 7
+
+
+@pytest.mark.parametrize("engine", ["forest", "hgb"])
+def test_matrix_fit_matches_the_csv_pipeline(final_data, matrix_dir, engine):
+    X, y = final_data
+    from_matrix = train_from_matrix(matrix_dir, n_jobs=1, engine=engine)
+    from_frame = pipeline_train(X.copy(), y, n_jobs=1, engine=engine)
+
+    assert [name for name, _ in from_matrix.steps] == [name for name, _ in from_frame.steps]
+    # float32 matrix vs float64 frame - close, not identical splits
+    matrix_mae = np.abs(from_matrix.predict(X) - y).mean()
+    assert matrix_mae == pytest.approx(np.abs(from_frame.predict(X) - y).mean(), rel=0.05)
+
+
+def test_matrix_rows_subset(matrix_dir, final_data):
+    X, _ = final_data
+    pipeline = train_from_matrix(matrix_dir, rows=slice(0, 500), n_jobs=1, engine="hgb")
+
+    assert pipeline.steps[-1][1].n_features_in_ == len(pipeline[:-1].transform(X.iloc[:5]).T)